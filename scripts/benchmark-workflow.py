@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""
+Benchmark the dependency queries of `swirlc.core.entity.Workflow`.
+
+The indexed `Workflow` is compared against a reference implementation that
+scans the whole set of `(src, dst)` dependencies at each query, as swirlc did
+before the adjacency indexes were introduced. Synthetic layered graphs are
+generated, where each step consumes the outputs of (up to) `fan_in` steps of the
+previous layer and produces a single port.
+
+Usage: python scripts/benchmark-workflow.py [--sizes 1000 10000 100000]
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import time
+from collections.abc import Callable, MutableSequence
+
+from swirlc.core.entity import Port, Step, Workflow
+
+
+class ScanWorkflow(Workflow):
+    """Reference implementation scanning all the dependencies at each query."""
+
+    __slots__ = ("deps",)
+
+    def __init__(self):
+        super().__init__()
+        self.deps: set[tuple[str, str]] = set()
+
+    def _add_dependency(self, src: str, dst: str) -> None:
+        self.deps.add((src, dst))
+
+    def get_input_ports(self, step: Step) -> MutableSequence[Port]:
+        return sorted(
+            [self.ports[d[0]] for d in self.deps if d[1] == step.name],
+            key=lambda port: port.name,
+        )
+
+    def get_input_steps(self, port: Port) -> MutableSequence[Step]:
+        return sorted(
+            [self.steps[d[0]] for d in self.deps if d[1] == port.name],
+            key=lambda step: step.name,
+        )
+
+    def get_output_ports(self, step: Step) -> MutableSequence[Port]:
+        return sorted(
+            [self.ports[d[1]] for d in self.deps if d[0] == step.name],
+            key=lambda port: port.name,
+        )
+
+    def get_output_steps(self, port: Port) -> MutableSequence[Step]:
+        return sorted(
+            [self.steps[d[1]] for d in self.deps if d[0] == port.name],
+            key=lambda step: step.name,
+        )
+
+
+def build(workflow: Workflow, nof_steps: int, width: int, fan_in: int) -> Workflow:
+    rnd = random.Random(nof_steps)
+    previous: MutableSequence[Port] = []
+    current: MutableSequence[Port] = []
+    for i in range(nof_steps):
+        if i % width == 0:
+            previous, current = current, []
+        step = Step(f"s{i}", f"s{i}")
+        workflow.add_step(step)
+        for port in rnd.sample(previous, min(fan_in, len(previous))):
+            workflow.add_input_port(step, port)
+        port = Port(f"p{i}", f"p{i}", {f"d{i}"})
+        workflow.add_output_port(step, port)
+        current.append(port)
+    return workflow
+
+
+def query(workflow: Workflow, steps: MutableSequence[Step]) -> None:
+    # Same access pattern of `AbstractTranslator.translate`
+    for step in steps:
+        for port in workflow.get_input_ports(step):
+            workflow.get_input_steps(port)
+        for port in workflow.get_output_ports(step):
+            workflow.get_output_steps(port)
+
+
+def measure(fn: Callable[..., None], *args) -> float:
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--fan-in", type=int, default=4)
+    parser.add_argument(
+        "--samples",
+        type=int,
+        default=200,
+        help="Number of steps queried to estimate the per-step cost",
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10**3, 10**4, 10**5])
+    parser.add_argument("--width", type=int, default=100)
+    args = parser.parse_args()
+    print(
+        f"{'steps':>8} {'scan (ms/step)':>15} {'indexed (ms/step)':>18} {'speedup':>8} "
+        f"{'translate est. scan (s)':>24} {'indexed (s)':>12}"
+    )
+    for size in args.sizes:
+        indexed = build(Workflow(), size, args.width, args.fan_in)
+        scan = build(ScanWorkflow(), size, args.width, args.fan_in)
+        sample = random.Random(0).sample(
+            list(indexed.steps.values()), min(args.samples, size)
+        )
+        t_scan = measure(query, scan, sample) / len(sample)
+        t_indexed = measure(query, indexed, sample) / len(sample)
+        # The indexed version is cheap enough to be measured on the whole graph
+        t_full = measure(query, indexed, list(indexed.steps.values()))
+        print(
+            f"{size:>8} {t_scan * 1e3:>15.4f} {t_indexed * 1e3:>18.4f} "
+            f"{t_scan / t_indexed:>7.0f}x {t_scan * size:>24.2f} {t_full:>12.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
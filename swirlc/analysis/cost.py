@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+import math
+from collections.abc import Iterable, MutableMapping
+from typing import Any
+
+
+class Link:
+    __slots__ = ("latency", "bandwidth")
+
+    def __init__(self, latency: float = 0.0, bandwidth: float = math.inf):
+        self.latency: float = latency
+        self.bandwidth: float = bandwidth
+
+    def get_transfer_time(self, size: int) -> float:
+        return self.latency + size / self.bandwidth
+
+
+class CostModel:
+    def __init__(self, metadata: MutableMapping[str, Any]):
+        self.runtimes: MutableMapping[str, float] = {
+            name: float(step.get("runtime", 0.0))
+            for name, step in metadata.get("steps", {}).items()
+        }
+        self.cores: MutableMapping[str, int] = {
+            name: int(location.get("resources", {}).get("cores", 1))
+            for name, location in metadata.get("locations", {}).items()
+        }
+        self.filesystems: MutableMapping[str, str] = {
+            name: location["sharedFilesystem"]
+            for name, location in metadata.get("locations", {}).items()
+            if "sharedFilesystem" in location
+        }
+        self.sizes: MutableMapping[str, int] = {
+            name: int(dependency.get("size", 0))
+            for name, dependency in metadata.get("dependencies", {}).items()
+        }
+        # Links are indexed by `(src, dst)`, where `None` matches any location
+        self.links: MutableMapping[tuple[str | None, str | None], Link] = {}
+        for link in metadata.get("links", []):
+            self.links[(link.get("src"), link.get("dst"))] = Link(
+                latency=float(link.get("latency", 0.0)),
+                bandwidth=float(link.get("bandwidth", math.inf)),
+            )
+        self._default_link: Link = Link()
+
+    def get_cores(self, location: str) -> int:
+        return self.cores.get(location, 1)
+
+    def get_link(self, src: str, dst: str) -> Link:
+        for key in ((src, dst), (src, None), (None, dst), (None, None)):
+            if (link := self.links.get(key)) is not None:
+                return link
+        return self._default_link
+
+    def get_runtime(self, step: str) -> float:
+        return self.runtimes.get(step, 0.0)
+
+    def get_size(self, data: Iterable[str]) -> int:
+        return sum(self.sizes.get(d, 0) for d in data)
+
+    def is_shared(self, src: str, dst: str) -> bool:
+        # Data on a shared filesystem are linked, not copied
+        return src in self.filesystems and self.filesystems[
+            src
+        ] == self.filesystems.get(dst)
+
+    def get_transfer_time(self, data: Iterable[str], src: str, dst: str) -> float:
+        if src == dst or self.is_shared(src, dst):
+            return 0.0
+        return self.get_link(src, dst).get_transfer_time(self.get_size(data))
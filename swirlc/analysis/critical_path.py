@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import heapq
+import math
+import sys
+from collections.abc import MutableMapping, MutableSequence
+from typing import TextIO
+
+from swirlc.analysis.cost import CostModel
+from swirlc.core.entity import FrozenWorkflow, Location, Port, Step, Workflow
+from swirlc.core.utils import write_table
+
+
+class StepTiming:
+    __slots__ = ("step", "locations", "runtime", "earliest_start", "latest_start")
+
+    def __init__(
+        self,
+        step: Step,
+        locations: MutableSequence[Location],
+        runtime: float,
+        earliest_start: float,
+    ):
+        self.step: Step = step
+        self.locations: MutableSequence[Location] = locations
+        self.runtime: float = runtime
+        self.earliest_start: float = earliest_start
+        self.latest_start: float = math.inf
+
+    @property
+    def earliest_finish(self) -> float:
+        return self.earliest_start + self.runtime
+
+    @property
+    def slack(self) -> float:
+        return self.latest_start - self.earliest_start
+
+
+class CriticalPath:
+    __slots__ = ("makespan", "order", "path", "timings")
+
+    def __init__(
+        self,
+        makespan: float,
+        order: MutableSequence[Step],
+        path: MutableSequence[Step],
+        timings: MutableMapping[str, StepTiming],
+    ):
+        self.makespan: float = makespan
+        self.order: MutableSequence[Step] = order
+        self.path: MutableSequence[Step] = path
+        self.timings: MutableMapping[str, StepTiming] = timings
+
+    def write(self, output: TextIO = sys.stdout) -> None:
+        output.write(f"Makespan: {self.makespan:.3f}\n")
+        output.write(
+            f"Critical path: {' -> '.join(step.name for step in self.path)}\n\n"
+        )
+        critical = {step.name for step in self.path}
+        rows = [("Step", "Name", "Locations", "Runtime", "Start", "Latest", "Slack")]
+        for step in self.order:
+            timing = self.timings[step.name]
+            rows.append(
+                (
+                    step.name,
+                    step.display_name,
+                    ",".join(loc.name for loc in timing.locations),
+                    f"{timing.runtime:.3f}",
+                    f"{timing.earliest_start:.3f}",
+                    f"{timing.latest_start:.3f}",
+                    f"{timing.slack:.3f}" + (" *" if step.name in critical else ""),
+                )
+            )
+        write_table(rows, output)
+
+
+def _get_release_time(
+    workflow: Workflow | FrozenWorkflow, cost_model: CostModel, step: Step
+) -> float:
+    # Time to receive the input data that belong to the initial datasets
+    release = 0.0
+    for port in workflow.get_input_ports(step):
+        for src in workflow.get_locations():
+            if data := [d for d in port.data if d in src.data]:
+                for dst in workflow.get_step_locations(step):
+                    release = max(
+                        release, cost_model.get_transfer_time(data, src.name, dst.name)
+                    )
+    return release
+
+
+def _get_transfer_time(
+    workflow: Workflow | FrozenWorkflow,
+    cost_model: CostModel,
+    port: Port,
+    src: Step,
+    dst: Step,
+) -> float:
+    # A step instance waits for the data sent by all the instances of its predecessor
+    return max(
+        (
+            cost_model.get_transfer_time(port.data, src_loc.name, dst_loc.name)
+            for src_loc in workflow.get_step_locations(src)
+            for dst_loc in workflow.get_step_locations(dst)
+        ),
+        default=0.0,
+    )
+
+
+def topological_sort(workflow: Workflow | FrozenWorkflow) -> MutableSequence[Step]:
+    indegree = {name: 0 for name in workflow.steps}
+    for step in workflow.steps.values():
+        for port in workflow.get_output_ports(step):
+            for succ in workflow.get_output_steps(port):
+                indegree[succ.name] += 1
+    # Ready steps are visited in name order to obtain a deterministic result
+    ready = [name for name, degree in indegree.items() if degree == 0]
+    heapq.heapify(ready)
+    order = []
+    while ready:
+        step = workflow.steps[heapq.heappop(ready)]
+        order.append(step)
+        for port in workflow.get_output_ports(step):
+            for succ in workflow.get_output_steps(port):
+                indegree[succ.name] -= 1
+                if indegree[succ.name] == 0:
+                    heapq.heappush(ready, succ.name)
+    if len(order) < len(indegree):
+        cycle = sorted(name for name, degree in indegree.items() if degree > 0)
+        raise Exception(f"Workflow contains a cycle among steps: {cycle}")
+    return order
+
+
+def analyze(workflow: Workflow | FrozenWorkflow, cost_model: CostModel) -> CriticalPath:
+    order = topological_sort(workflow)
+    predecessors: MutableMapping[str, MutableSequence[tuple[str, float]]] = {
+        step.name: [] for step in order
+    }
+    successors: MutableMapping[str, MutableSequence[tuple[str, float]]] = {
+        step.name: [] for step in order
+    }
+    for step in order:
+        for port in workflow.get_output_ports(step):
+            for succ in workflow.get_output_steps(port):
+                cost = _get_transfer_time(workflow, cost_model, port, step, succ)
+                predecessors[succ.name].append((step.name, cost))
+                successors[step.name].append((succ.name, cost))
+    # Forward pass
+    timings: MutableMapping[str, StepTiming] = {}
+    for step in order:
+        timings[step.name] = StepTiming(
+            step=step,
+            locations=workflow.get_step_locations(step),
+            runtime=cost_model.get_runtime(step.name),
+            earliest_start=max(
+                [_get_release_time(workflow, cost_model, step)]
+                + [
+                    timings[pred].earliest_finish + cost
+                    for pred, cost in predecessors[step.name]
+                ]
+            ),
+        )
+    makespan = max((t.earliest_finish for t in timings.values()), default=0.0)
+    # Backward pass
+    for step in reversed(order):
+        timing = timings[step.name]
+        timing.latest_start = (
+            min(
+                [makespan]
+                + [
+                    timings[succ].latest_start - cost
+                    for succ, cost in successors[step.name]
+                ]
+            )
+            - timing.runtime
+        )
+    # Walk back from the last finishing step through tight dependencies
+    path = []
+    if order:
+        current = max(order, key=lambda s: timings[s.name].earliest_finish).name
+        while current is not None:
+            path.append(timings[current].step)
+            current = next(
+                (
+                    pred
+                    for pred, cost in predecessors[current]
+                    if math.isclose(
+                        timings[pred].earliest_finish + cost,
+                        timings[current].earliest_start,
+                        abs_tol=1e-9,
+                    )
+                ),
+                None,
+            )
+    return CriticalPath(
+        makespan=makespan, order=order, path=path[::-1], timings=timings
+    )
@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import heapq
+import io
+import sys
+from collections.abc import MutableMapping, MutableSequence
+from typing import Any, TextIO
+
+from ruamel.yaml import YAML
+
+from swirlc.analysis.cost import CostModel
+from swirlc.analysis.critical_path import topological_sort
+from swirlc.core.entity import (
+    DistributedWorkflow,
+    FrozenWorkflow,
+    Location,
+    Step,
+    Workflow,
+)
+from swirlc.core.translator import AbstractTranslator
+
+
+class Placement:
+    __slots__ = ("workflow", "mapping", "finish_times", "makespan", "transferred_bytes")
+
+    def __init__(
+        self,
+        workflow: DistributedWorkflow,
+        mapping: MutableMapping[str, str],
+        finish_times: MutableMapping[str, float],
+        transferred_bytes: int,
+    ):
+        self.workflow: DistributedWorkflow = workflow
+        self.mapping: MutableMapping[str, str] = mapping
+        self.finish_times: MutableMapping[str, float] = finish_times
+        self.makespan: float = max(finish_times.values(), default=0.0)
+        self.transferred_bytes: int = transferred_bytes
+
+
+def _get_upward_ranks(
+    workflow: Workflow | FrozenWorkflow,
+    cost_model: CostModel,
+    order: MutableSequence[Step],
+    locations: MutableSequence[Location],
+) -> MutableMapping[str, float]:
+    # Average transfer time of each byte group between any pair of locations
+    pairs = [(src.name, dst.name) for src in locations for dst in locations]
+    ranks: MutableMapping[str, float] = {}
+    for step in reversed(order):
+        ranks[step.name] = cost_model.get_runtime(step.name) + max(
+            (
+                sum(
+                    cost_model.get_transfer_time(port.data, src, dst)
+                    for src, dst in pairs
+                )
+                / len(pairs)
+                + ranks[succ.name]
+                for port in workflow.get_output_ports(step)
+                for succ in workflow.get_output_steps(port)
+            ),
+            default=0.0,
+        )
+    return ranks
+
+
+def heft(workflow: Workflow | FrozenWorkflow, cost_model: CostModel) -> Placement:
+    # Heterogeneous Earliest Finish Time list scheduler: steps are visited by decreasing
+    # upward rank and mapped on the location where they finish first. Ties are broken by
+    # minimising the bytes moved across locations
+    locations = list(workflow.get_locations())
+    if not locations:
+        raise Exception("Cannot place a workflow without locations")
+    order = topological_sort(workflow)
+    position = {step.name: i for i, step in enumerate(order)}
+    ranks = _get_upward_ranks(workflow, cost_model, order, locations)
+    # Each location is modelled as a pool of cores, storing the time at which each core is free
+    cores: MutableMapping[str, MutableSequence[float]] = {
+        loc.name: [0.0] * cost_model.get_cores(loc.name) for loc in locations
+    }
+    mapping: MutableMapping[str, str] = {}
+    finish_times: MutableMapping[str, float] = {}
+    transferred_bytes = 0
+    for step in sorted(order, key=lambda s: (-ranks[s.name], position[s.name])):
+        best = None
+        for location in locations:
+            ready, moved = 0.0, 0
+            for port in workflow.get_input_ports(step):
+                # Inputs are either produced by another step or part of an initial dataset
+                sources = [
+                    (mapping[pred.name], finish_times[pred.name])
+                    for pred in workflow.get_input_steps(port)
+                ] + [
+                    (loc.name, 0.0)
+                    for loc in locations
+                    if any(d in loc.data for d in port.data)
+                ]
+                for src, available in sources:
+                    ready = max(
+                        ready,
+                        available
+                        + cost_model.get_transfer_time(port.data, src, location.name),
+                    )
+                if sources and all(src != location.name for src, _ in sources):
+                    moved += cost_model.get_size(port.data)
+            start = max(ready, cores[location.name][0])
+            candidate = (
+                start + cost_model.get_runtime(step.name),
+                moved,
+                location.name,
+            )
+            if best is None or candidate < best:
+                best = candidate
+        finish, moved, location_name = best
+        heapq.heapreplace(cores[location_name], finish)
+        mapping[step.name] = location_name
+        finish_times[step.name] = finish
+        transferred_bytes += moved
+    # Build the distributed workflow
+    placed = DistributedWorkflow()
+    placed.ports.update(workflow.ports)
+    for location in locations:
+        placed.add_location(location)
+    for step in order:
+        placed.add_step(step)
+        for port in workflow.get_input_ports(step):
+            placed.add_input_port(step, port)
+        for port in workflow.get_output_ports(step):
+            placed.add_output_port(step, port)
+        placed.map(step, placed.locations[mapping[step.name]])
+    return Placement(placed, mapping, finish_times, transferred_bytes)
+
+
+class PlacementTranslator(AbstractTranslator):
+    def __init__(
+        self, workflow: Workflow | FrozenWorkflow, metadata: MutableMapping[str, Any]
+    ):
+        self.workflow: Workflow | FrozenWorkflow = workflow
+        self.metadata: MutableMapping[str, Any] = metadata
+        self.placement: Placement | None = None
+
+    def _translate(self) -> Workflow:
+        self.placement = heft(self.workflow, CostModel(self.metadata))
+        return self.placement.workflow
+
+    def translate(
+        self, workflow_output: TextIO = sys.stdout, metadata_output: TextIO = sys.stdout
+    ):
+        buffer = io.StringIO()
+        super().translate(workflow_output, buffer)
+        # Preserve the settings and the estimates of the original metadata
+        yaml = YAML()
+        metadata = yaml.load(buffer.getvalue())
+        for section in ("steps", "locations", "dependencies"):
+            for name, settings in self.metadata.get(section, {}).items():
+                if name in metadata[section]:
+                    for key, value in settings.items():
+                        metadata[section][name].setdefault(key, value)
+        if "links" in self.metadata:
+            metadata["links"] = self.metadata["links"]
+        yaml.dump(metadata, metadata_output)
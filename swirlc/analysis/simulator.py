@@ -0,0 +1,505 @@
+from __future__ import annotations
+
+import heapq
+import itertools
+import sys
+from collections.abc import Callable, MutableMapping, MutableSequence
+from typing import Any, TextIO
+
+from swirlc.analysis.cost import CostModel, Link
+from swirlc.core.compiler import BaseCompiler
+from swirlc.core.entity import Data, Location, Step
+from swirlc.core.utils import write_table
+
+
+class Exec:
+    __slots__ = ("step", "inputs", "outputs")
+
+    def __init__(
+        self, step: Step, inputs: MutableSequence[str], outputs: MutableSequence[str]
+    ):
+        self.step: Step = step
+        self.inputs: MutableSequence[str] = inputs
+        self.outputs: MutableSequence[str] = outputs
+
+
+class Send:
+    __slots__ = ("data", "port", "src", "dst")
+
+    def __init__(self, data: str, port: str, src: str, dst: str):
+        self.data: str = data
+        self.port: str = port
+        self.src: str = src
+        self.dst: str = dst
+
+
+class SendBatch:
+    __slots__ = ("sends",)
+
+    def __init__(self, sends: MutableSequence[Send]):
+        self.sends: MutableSequence[Send] = sends
+
+
+class Recv:
+    __slots__ = ("port", "src", "dst")
+
+    def __init__(self, port: str, src: str, dst: str):
+        self.port: str = port
+        self.src: str = src
+        self.dst: str = dst
+
+
+class Forward:
+    __slots__ = ("data", "port", "src", "dsts")
+
+    def __init__(self, data: str, port: str, src: str, dsts: MutableSequence[str]):
+        self.data: str = data
+        self.port: str = port
+        self.src: str = src
+        self.dsts: MutableSequence[str] = dsts
+
+
+class Par:
+    __slots__ = ("children",)
+
+    def __init__(self):
+        self.children: MutableSequence[Any] = []
+
+
+class Seq:
+    __slots__ = ("children",)
+
+    def __init__(self):
+        self.children: MutableSequence[Any] = []
+
+
+class TraceBuilder(BaseCompiler):
+    """Build the trace of each location as a tree of `Exec`, `Send`, `SendBatch`, `Recv`, `Par` and `Seq` nodes."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.datasets: MutableMapping[str, MutableSequence[str]] = {}
+        self.traces: MutableMapping[str, Any] = {}
+        self.current_location: Location | None = None
+        self.stack: MutableSequence[Par | Seq] = []
+
+    def _append(self, node: Any) -> None:
+        self.stack[-1].children.append(node)
+
+    def begin_choice(self) -> None:
+        raise NotImplementedError("Choice is not supported by the simulator")
+
+    def begin_dataset(self, dataset: MutableSequence[tuple[str, Data]]) -> None:
+        self.datasets[self.current_location.name] = [port for port, _ in dataset]
+
+    def begin_location(self, location: Location) -> None:
+        self.current_location = location
+        self.stack = [Seq()]
+
+    def begin_par(self) -> None:
+        self.stack.append(Par())
+
+    def begin_seq(self) -> None:
+        self.stack.append(Seq())
+
+    def end_location(self) -> None:
+        self.traces[self.current_location.name] = self.stack.pop()
+        self.current_location = None
+
+    def end_par(self) -> None:
+        node = self.stack.pop()
+        self._append(node)
+
+    def end_seq(self) -> None:
+        node = self.stack.pop()
+        self._append(node)
+
+    def exec(
+        self,
+        step: Step,
+        flow: tuple[set[tuple[str, str]], set[tuple[str, str]]],
+        mapping: set[str],
+    ) -> None:
+        self._append(
+            Exec(
+                step,
+                sorted(port for port, _ in flow[0]),
+                sorted(port for port, _ in flow[1]),
+            )
+        )
+
+    def forward(
+        self,
+        data: str,
+        port: str,
+        data_type: str,
+        src: str,
+        dsts: MutableSequence[str],
+    ) -> None:
+        self._append(Forward(data, port, src, dsts))
+
+    def recv(self, port: str, data_type: str, src: str, dst: str) -> None:
+        self._append(Recv(port, src, dst))
+
+    def send(self, data: str, port: str, data_type: str, src: str, dst: str) -> None:
+        self._append(Send(data, port, src, dst))
+
+    def send_batch(
+        self, sends: MutableSequence[tuple[str, str, str]], src: str, dst: str
+    ) -> None:
+        self._append(SendBatch([Send(data, port, src, dst) for data, port, _ in sends]))
+
+
+class LocationStats:
+    __slots__ = ("execs", "busy_time", "finish_time", "intervals")
+
+    def __init__(self):
+        self.execs: int = 0
+        self.busy_time: float = 0.0
+        self.finish_time: float = 0.0
+        self.intervals: MutableSequence[tuple[float, float]] = []
+
+
+class LinkStats:
+    __slots__ = ("transfers", "bytes", "busy_time", "wait_time")
+
+    def __init__(self):
+        self.transfers: int = 0
+        self.bytes: int = 0
+        self.busy_time: float = 0.0
+        self.wait_time: float = 0.0
+
+
+class SimulationResult:
+    __slots__ = ("makespan", "locations", "links")
+
+    def __init__(
+        self,
+        makespan: float,
+        locations: MutableMapping[str, LocationStats],
+        links: MutableMapping[tuple[str, str], LinkStats],
+    ):
+        self.makespan: float = makespan
+        self.locations: MutableMapping[str, LocationStats] = locations
+        self.links: MutableMapping[tuple[str, str], LinkStats] = links
+
+    def get_utilisation(self, location: str) -> float:
+        return (
+            self.locations[location].busy_time / self.makespan if self.makespan else 0.0
+        )
+
+    def write(self, output: TextIO = sys.stdout) -> None:
+        output.write(f"Predicted makespan: {self.makespan:.3f}\n\n")
+        rows = [("Location", "Execs", "Busy", "Utilisation", "Finish")]
+        for name, stats in sorted(self.locations.items()):
+            rows.append(
+                (
+                    name,
+                    str(stats.execs),
+                    f"{stats.busy_time:.3f}",
+                    f"{self.get_utilisation(name):.1%}",
+                    f"{stats.finish_time:.3f}",
+                )
+            )
+        write_table(rows, output)
+        if self.links:
+            output.write("\n")
+            rows = [("Link", "Transfers", "Bytes", "Busy", "Utilisation", "Contention")]
+            for (src, dst), stats in sorted(self.links.items()):
+                rows.append(
+                    (
+                        f"{src}->{dst}",
+                        str(stats.transfers),
+                        str(stats.bytes),
+                        f"{stats.busy_time:.3f}",
+                        f"{stats.busy_time / self.makespan if self.makespan else 0.0:.1%}",
+                        f"{stats.wait_time:.3f}",
+                    )
+                )
+            write_table(rows, output)
+
+
+def _get_busy_time(intervals: MutableSequence[tuple[float, float]]) -> float:
+    # Length of the union of (possibly overlapping) execution intervals
+    busy, current_start, current_end = 0.0, None, None
+    for start, end in sorted(intervals):
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                busy += current_end - current_start
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    if current_end is not None:
+        busy += current_end - current_start
+    return busy
+
+
+class _Simulation:
+    def __init__(
+        self,
+        traces: MutableMapping[str, Any],
+        datasets: MutableMapping[str, MutableSequence[str]],
+        cost_model: CostModel,
+    ):
+        self.traces: MutableMapping[str, Any] = traces
+        self.cost_model: CostModel = cost_model
+        self.counter = itertools.count()
+        self.queue: MutableSequence[tuple[float, int, Callable[[float], None]]] = []
+        # Time at which each `(location, port)` pair holds data, or the callbacks waiting for it
+        self.ports: MutableMapping[tuple[str, str], float | MutableSequence[Any]] = {
+            (location, port): 0.0
+            for location, ports in datasets.items()
+            for port in ports
+        }
+        # Pending sends and recvs for each `(port, src, dst)` rendezvous
+        self.sends: MutableMapping[tuple[str, str, str], MutableSequence[Any]] = {}
+        self.recvs: MutableMapping[tuple[str, str, str], MutableSequence[Any]] = {}
+        self.link_free: MutableMapping[tuple[str, str], float] = {}
+        self.locations: MutableMapping[str, LocationStats] = {
+            name: LocationStats() for name in traces
+        }
+        self.links: MutableMapping[tuple[str, str], LinkStats] = {}
+        self.terminated: set[str] = set()
+        # Free cores of each location, and the execs waiting for them in arrival order
+        self.cores: MutableMapping[str, int] = {
+            name: cost_model.get_cores(name) for name in traces
+        }
+        self.waiting: MutableMapping[
+            str, MutableSequence[tuple[int, Callable[[float], None]]]
+        ] = {name: [] for name in traces}
+
+    def _schedule(self, time: float, callback: Callable[[float], None]) -> None:
+        heapq.heappush(self.queue, (time, next(self.counter), callback))
+
+    def _set_port(self, location: str, port: str, time: float) -> None:
+        waiters = self.ports.get((location, port))
+        self.ports[(location, port)] = time
+        if isinstance(waiters, list):
+            for waiter in waiters:
+                self._schedule(time, waiter)
+
+    def _wait_ports(
+        self,
+        location: str,
+        ports: MutableSequence[str],
+        time: float,
+        callback: Callable[[float], None],
+    ) -> None:
+        missing = [
+            p
+            for p in ports
+            if (location, p) not in self.ports
+            or isinstance(self.ports[(location, p)], list)
+        ]
+        if not missing:
+            self._schedule(time, callback)
+            return
+        remaining = [len(missing)]
+
+        def _notify(t: float) -> None:
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                callback(t)
+
+        for port in missing:
+            self.ports.setdefault((location, port), []).append(_notify)
+
+    def _acquire(
+        self,
+        location: str,
+        cores: int,
+        time: float,
+        callback: Callable[[float], None],
+    ) -> None:
+        # Steps requiring more cores than the location has would never start
+        cores = min(cores, self.cost_model.get_cores(location))
+        if self.cores[location] >= cores:
+            self.cores[location] -= cores
+            self._schedule(time, callback)
+        else:
+            self.waiting[location].append((cores, callback))
+
+    def _release(self, location: str, cores: int, time: float) -> None:
+        self.cores[location] += min(cores, self.cost_model.get_cores(location))
+        # As in the generated programs, every waiting exec which fits is started
+        waiting = []
+        for request, callback in self.waiting[location]:
+            if self.cores[location] >= request:
+                self.cores[location] -= request
+                self._schedule(time, callback)
+            else:
+                waiting.append((request, callback))
+        self.waiting[location] = waiting
+
+    def _offer(self, send: Send, time: float, done: Callable[[float], None]) -> None:
+        # Matches a ready send with a pending recv, or leaves it for the next one
+        key = (send.port, send.src, send.dst)
+        if self.recvs.get(key):
+            recv_done = self.recvs[key].pop(0)
+            self._transfer(send, time, done, recv_done)
+        else:
+            self.sends.setdefault(key, []).append((send, done))
+
+    def _transfer(self, send: Send, time: float, send_done, recv_done) -> None:
+        size = self.cost_model.get_size([send.data])
+        link = (
+            Link()
+            if self.cost_model.is_shared(send.src, send.dst)
+            else self.cost_model.get_link(send.src, send.dst)
+        )
+        stats = self.links.setdefault((send.src, send.dst), LinkStats())
+        start = max(time, self.link_free.get((send.src, send.dst), 0.0))
+        occupancy = size / link.bandwidth
+        self.link_free[(send.src, send.dst)] = start + occupancy
+        stats.transfers += 1
+        stats.bytes += size
+        stats.busy_time += occupancy
+        stats.wait_time += start - time
+        end = start + occupancy + link.latency
+        self._schedule(end, send_done)
+        self._schedule(end, recv_done)
+
+    def _start(
+        self, node: Any, location: str, time: float, done: Callable[[float], None]
+    ) -> None:
+        if isinstance(node, Seq):
+            self._start_seq(node.children, 0, location, time, done)
+        elif isinstance(node, Par):
+            if not node.children:
+                self._schedule(time, done)
+                return
+            remaining = [len(node.children)]
+
+            def _join(t: float) -> None:
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    done(t)
+
+            for child in node.children:
+                self._start(child, location, time, _join)
+        elif isinstance(node, Exec):
+            cores = int(node.step.requirements.get("cores", 1))
+
+            def _ready(t: float) -> None:
+                # Cores are reserved only when the inputs are available
+                self._acquire(location, cores, t, _run)
+
+            def _run(t: float) -> None:
+                end = t + self.cost_model.get_runtime(node.step.name)
+                stats = self.locations[location]
+                stats.execs += 1
+                stats.intervals.append((t, end))
+                self._schedule(end, _complete)
+
+            def _complete(t: float) -> None:
+                self._release(location, cores, t)
+                for port in node.outputs:
+                    self._set_port(location, port, t)
+                done(t)
+
+            self._wait_ports(location, node.inputs, time, _ready)
+        elif isinstance(node, Send):
+            self._wait_ports(
+                location, [node.port], time, lambda t: self._offer(node, t, done)
+            )
+        elif isinstance(node, SendBatch):
+            remaining = [len(node.sends)]
+
+            def _join_sends(t: float) -> None:
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    done(t)
+
+            def _ready_batch(t: float) -> None:
+                # The batch is written on one connection once all its data are available
+                for send in node.sends:
+                    self._offer(send, t, _join_sends)
+
+            self._wait_ports(
+                location, [send.port for send in node.sends], time, _ready_batch
+            )
+        elif isinstance(node, Forward):
+            # Forwarded data are sent in background, so the trace goes on immediately
+            for dst in node.dsts:
+                self._start(
+                    Send(node.data, node.port, node.src, dst),
+                    location,
+                    time,
+                    lambda t: None,
+                )
+            self._schedule(time, done)
+        elif isinstance(node, Recv):
+            key = (node.port, node.src, node.dst)
+
+            def _received(t: float) -> None:
+                self._set_port(location, node.port, t)
+                done(t)
+
+            if self.sends.get(key):
+                send, send_done = self.sends[key].pop(0)
+                self._transfer(send, time, send_done, _received)
+            else:
+                self.recvs.setdefault(key, []).append(_received)
+        else:
+            raise Exception(f"Unsupported trace node {type(node).__name__}")
+
+    def _start_seq(
+        self,
+        children: MutableSequence[Any],
+        index: int,
+        location: str,
+        time: float,
+        done: Callable[[float], None],
+    ) -> None:
+        if index == len(children):
+            self._schedule(time, done)
+        else:
+            self._start(
+                children[index],
+                location,
+                time,
+                lambda t: self._start_seq(children, index + 1, location, t, done),
+            )
+
+    def run(self) -> SimulationResult:
+        for location, trace in self.traces.items():
+
+            def _terminate(t: float, location: str = location) -> None:
+                self.locations[location].finish_time = t
+                self.terminated.add(location)
+
+            self._start(trace, location, 0.0, _terminate)
+        while self.queue:
+            time, _, callback = heapq.heappop(self.queue)
+            callback(time)
+        if blocked := sorted(set(self.traces) - self.terminated):
+            pending = sorted(
+                f"recv({port},{src},{dst})"
+                for (port, src, dst), recvs in self.recvs.items()
+                if recvs
+            ) + sorted(
+                f"send({port},{src},{dst})"
+                for (port, src, dst), sends in self.sends.items()
+                if sends
+            )
+            raise Exception(
+                f"Simulation deadlocked on locations {blocked}. Pending operations: {pending}"
+            )
+        for stats in self.locations.values():
+            stats.busy_time = _get_busy_time(stats.intervals)
+        return SimulationResult(
+            makespan=max(
+                (stats.finish_time for stats in self.locations.values()), default=0.0
+            ),
+            locations=self.locations,
+            links=self.links,
+        )
+
+
+class Simulator:
+    def __init__(self, builder: TraceBuilder):
+        self.traces: MutableMapping[str, Any] = builder.traces
+        self.datasets: MutableMapping[str, MutableSequence[str]] = builder.datasets
+
+    def simulate(self, cost_model: CostModel) -> SimulationResult:
+        return _Simulation(self.traces, self.datasets, cost_model).run()
@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+from collections.abc import Iterable, MutableMapping, MutableSequence
+from typing import Any
+
+
+def merge(dumps: Iterable[MutableMapping[str, Any]]) -> MutableMapping[str, Any]:
+    # Each location becomes a process of the Chrome trace and each of its threads (or
+    # asyncio tasks) a thread. Timestamps are wall-clock microseconds, so locations on
+    # different hosts are aligned only as far as their clocks are synchronised
+    dumps = sorted(dumps, key=lambda d: d["location"])
+    origin = min((span["ts"] for dump in dumps for span in dump["spans"]), default=0)
+    events: MutableSequence[MutableMapping[str, Any]] = []
+    for pid, dump in enumerate(dumps):
+        events.append(
+            {
+                "name": "process_name",
+                "ph": "M",
+                "pid": pid,
+                "args": {"name": f"{dump['location']} ({dump['hostname']})"},
+            }
+        )
+        threads: MutableMapping[str, int] = {}
+        for span in sorted(dump["spans"], key=lambda s: s["ts"]):
+            if (tid := threads.get(span["thread"])) is None:
+                tid = threads[span["thread"]] = len(threads)
+                events.append(
+                    {
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": pid,
+                        "tid": tid,
+                        "args": {"name": span["thread"]},
+                    }
+                )
+            events.append(
+                {
+                    "name": span["name"],
+                    "cat": span["cat"],
+                    "ph": "X",
+                    "ts": span["ts"] - origin,
+                    "dur": span["dur"],
+                    "pid": pid,
+                    "tid": tid,
+                    "args": span["args"],
+                }
+            )
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
@@ -1,3 +1,4 @@
+from swirlc.compiler.asyncio import AsyncioTarget
 from swirlc.compiler.default import DefaultTarget
 
-targets = {"default": DefaultTarget}
+targets = {"asyncio": AsyncioTarget, "default": DefaultTarget}
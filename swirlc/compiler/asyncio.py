@@ -0,0 +1,663 @@
+from __future__ import annotations
+
+import os
+from collections.abc import MutableSequence
+
+from swirlc.antlr.SWIRLParser import SWIRLParser
+from swirlc.compiler.default import (
+    DefaultTarget,
+    cache_functions,
+    chunk_stream_classes,
+    configure_function,
+    constants,
+    journal_functions,
+    link_function,
+    logger_config,
+    metrics_class,
+    pack_string_function,
+    resource_pool_class,
+    step_functions,
+    tracer_class,
+    unlink_socket_function,
+)
+from swirlc.core.entity import Location, Step
+from swirlc.log_handler import logger
+
+imports = """from __future__ import annotations
+
+import asyncio
+import fcntl
+import glob
+import hashlib
+import json
+import logging
+import lzma
+import os
+import random
+import shutil
+import socket
+import struct
+import sys
+import tarfile
+import time
+import uuid
+import zlib
+
+from asyncio import Condition, Event, Lock, Queue
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from multiprocessing import resource_tracker, shared_memory
+from pathlib import Path
+from threading import Thread, active_count
+from typing import Any, Awaitable, Callable, MutableMapping, MutableSequence
+"""
+
+global_vars = """
+# Tasks which are not awaited by the trace, e.g., forwards, but must terminate before the program
+background: MutableSequence[asyncio.Task] = []
+channels: MutableMapping[str, tuple[asyncio.StreamWriter, tuple[Any, bool] | None]] = {}
+channel_locks: MutableMapping[str, Lock] = {}
+ports: MutableMapping[str, Any] = {}
+received: MutableMapping[tuple[str, str], Queue] = {}
+# Ports that each destination location already received in a previous run
+skipped: MutableMapping[str, MutableSequence[str]] = {}
+# Steps completed and data received in a previous run, replayed from the journal
+completed_execs: MutableMapping[str, Any] = {}
+journaled: MutableMapping[str, MutableSequence[tuple[str, Any]]] = {}
+journal: Any = None
+# The journal and the metrics are only written by the event loop thread
+journal_lock = nullcontext()
+metrics_lock = nullcontext()
+"""
+
+serve_function = """async def _serve(location: str) -> MutableSequence[asyncio.AbstractServer]:
+    servers = [await asyncio.start_server(_demux, *locations[location])]
+    if location in UNIX_SOCKETS:
+        # Locations on the same host communicate through Unix domain sockets
+        os.makedirs(os.path.dirname(UNIX_SOCKETS[location]), mode=0o700, exist_ok=True)
+        if os.path.exists(UNIX_SOCKETS[location]):
+            os.unlink(UNIX_SOCKETS[location])
+        servers.append(await asyncio.start_unix_server(_demux, UNIX_SOCKETS[location]))
+    return servers
+"""
+
+task_name_function = """def _task_name() -> str:
+    # Spans are grouped by task, as all of them run in the same thread
+    task = asyncio.current_task()
+    return task.get_name() if task else "main"
+"""
+
+stop_function = """async def _stop(servers: MutableSequence[asyncio.AbstractServer]):
+    for writer, _ in channels.values():
+        writer.close()
+        await writer.wait_closed()
+    # Servers are not waited, as peers keep their channels open until they terminate
+    for server in servers:
+        for sock in server.sockets:
+            if sock.family == socket.AF_UNIX:
+                _unlink_socket(sock.getsockname())
+        server.close()
+"""
+
+resources_class = """class _Resources(_ResourcePool):
+    @asynccontextmanager
+    async def reserve(self, step: str, requirements: MutableMapping[str, int]):
+        request = self._request(step, requirements)
+        async with self.condition:
+            if not self._fits(request):
+                logger.debug(f"Step {step} waits for resources")
+                await self.condition.wait_for(lambda: self._fits(request))
+            self._acquire(request)
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self._release(request)
+                self.condition.notify_all()
+"""
+
+exec_function = """async def _exec(step_name: str, step_display_name: str, input_port_names: MutableSequence[str], output_port_name: str, data_type: str, glob_regex: str | None, cmd: str, args: MutableSequence[tuple[str,bool]], requirements: MutableMapping[str, int]):
+    with tracer.span("exec", f"{step_display_name}-{step_name}", step=step_name) as span:
+        # Wait all the data
+        begin = time.perf_counter_ns()
+        for port_name in input_port_names:
+            await available_port_data[port_name].wait()
+        span["wait_us"] = (time.perf_counter_ns() - begin) // 1000
+        if _resume_exec(step_name, step_display_name, output_port_name):
+            span["resumed"] = True
+            if output_port_name:
+                available_port_data[output_port_name].set()
+            return
+        if CACHE_DIR:
+            # Hashing and copying data do not block the event loop
+            key = await asyncio.to_thread(_cache_key, input_port_names, data_type, glob_regex, cmd, args)
+            if await asyncio.to_thread(_cache_load, key, step_name, step_display_name, output_port_name, data_type):
+                span["cached"] = True
+                _journal({"type": "exec", "step": step_name, "value": ports.get(output_port_name)})
+                if output_port_name:
+                    available_port_data[output_port_name].set()
+                return
+        # Resources are reserved only when the step is ready to run, so that waiting steps do not hold them
+        async with resources.reserve(f"{step_display_name}-{step_name}", requirements):
+            metrics.add("swirl_steps_running", 1)
+            begin = time.perf_counter()
+            stdout = await _run(step_name, step_display_name, input_port_names, output_port_name, data_type, glob_regex, cmd, args)
+            metrics.set("swirl_step_duration_seconds", time.perf_counter() - begin, step=step_name)
+            metrics.add("swirl_steps_running", -1)
+        metrics.add("swirl_steps_completed_total", 1)
+        # Outputs are stored before being published, as the steps which consume them could modify them
+        if CACHE_DIR:
+            await asyncio.to_thread(_cache_store, key, ports[output_port_name] if data_type in ("file", "directory") else None, stdout)
+        _journal({"type": "exec", "step": step_name, "value": ports.get(output_port_name)})
+        if output_port_name:
+            available_port_data[output_port_name].set()
+
+
+async def _run(step_name: str, step_display_name: str, input_port_names: MutableSequence[str], output_port_name: str, data_type: str, glob_regex: str | None, cmd: str, args: MutableSequence[tuple[str,bool]]) -> bytes:
+    workdir = _prepare_workdir(step_name, input_port_names)
+    cmd = _format_command(step_name, step_display_name, cmd, args)
+    proc = await asyncio.create_subprocess_shell(cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, cwd=workdir)
+    stdout, stderr = await proc.communicate()
+    if proc.returncode != 0:
+        raise Exception(f"Step {step_display_name}-{step_name} failed with exit status {proc.returncode}: {stderr.decode('utf-8')}")
+    _collect_output(step_name, step_display_name, output_port_name, data_type, glob_regex, workdir, stdout)
+    return stdout
+"""
+
+init_dataset_function = """def _init_dataset(port_name: str, data: str):
+    ports[port_name] = data
+    available_port_data[port_name].set()
+"""
+
+channel_function = """async def _channel(src: str, dst: str) -> tuple[asyncio.StreamWriter, tuple[Any, bool] | None]:
+    # A single long-lived connection is opened towards each destination. Callers hold its lock
+    if dst not in channels:
+        delay = RETRY_DELAY
+        while True:
+            try:
+                if dst in UNIX_SOCKETS:
+                    reader, writer = await asyncio.open_unix_connection(UNIX_SOCKETS[dst])
+                else:
+                    reader, writer = await asyncio.open_connection(*locations[dst])
+                break
+            except OSError:
+                await asyncio.sleep(random.uniform(0, delay))
+                delay = min(2 * delay, RETRY_MAX_DELAY)
+        # The handshake carries the source location and the proposed codec, which the receiver accepts or refuses
+        mode = COMPRESSION.get(dst, "")
+        codec = AUTO_CODEC if mode == "auto" else mode
+        writer.write(_pack_string(src) + _pack_string(codec))
+        accepted = (await reader.readexactly(struct.unpack("!H", await reader.readexactly(2))[0])).decode("utf-8")
+        # The receiver also lists the ports it already received from a previous run
+        skipped[dst] = json.loads(await reader.readexactly(struct.unpack("!H", await reader.readexactly(2))[0]))
+        if codec and accepted != codec:
+            logger.warning(f"Location {dst} does not support codec {codec}: sending uncompressed data")
+        channels[dst] = (writer, (CODECS[accepted][0], mode == "auto") if accepted else None)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Opened channel to location {dst}" + (f" with codec {accepted}" if accepted else ""))
+    return channels[dst]
+"""
+
+bridge_functions = """class _StreamBridge:
+    # Lets worker threads use the chunk streams of the default runtime on the streams of the event loop
+    def __init__(self, reader: asyncio.StreamReader | None, writer: asyncio.StreamWriter | None):
+        self.reader: asyncio.StreamReader | None = reader
+        self.writer: asyncio.StreamWriter | None = writer
+        self.loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+
+    async def _write(self, data: bytes):
+        self.writer.write(data)
+        await self.writer.drain()
+
+    def sendall(self, data: bytes):
+        asyncio.run_coroutine_threadsafe(self._write(data), self.loop).result()
+
+
+def _recv_exact(conn: _StreamBridge, size: int) -> bytes:
+    return asyncio.run_coroutine_threadsafe(conn.reader.readexactly(size), conn.loop).result()
+"""
+
+archive_functions = """def _archive(path: str, arcname: str, writer: _ChunkWriter):
+    # The tree is written as a tar stream, without building the archive on disk
+    with tarfile.open(fileobj=writer, mode="w|", bufsize=CHUNK_SIZE) as tar:
+        tar.add(path, arcname=arcname)
+    writer.end()
+
+
+def _extract(reader: _ChunkReader, path: str):
+    with tarfile.open(fileobj=reader, mode="r|") as tar:
+        # Keep permissions and symlinks, but refuse members outside the destination
+        if hasattr(tarfile, "tar_filter"):
+            tar.extractall(path, filter="tar")
+        else:
+            tar.extractall(path)
+    # Consume what is left of the stream, e.g., the padding after the end of a tar archive
+    while reader.read(BUF_SIZE):
+        pass
+"""
+
+write_chunks_function = """def _copy_chunks(fd: Any, writer: _ChunkWriter):
+    while data := fd.read(CHUNK_SIZE):
+        writer.write(data)
+    writer.end()
+
+
+async def _write_chunks(writer: asyncio.StreamWriter, fd: Any, codec: tuple[Any, bool]):
+    # Reading and compressing run in a worker thread, without blocking the event loop
+    await asyncio.to_thread(_copy_chunks, fd, _ChunkWriter(_StreamBridge(None, writer), codec))
+"""
+
+send_frame_function = """async def _send_frame(writer: asyncio.StreamWriter, port: str, data_type: str, codec: tuple[Any, bool] | None, dst: str) -> int:
+    # Returns the size of the data copied to the receiver
+    port_name = port.encode("utf-8")
+    if data_type == "stdout":
+        name = b""
+    elif data_type in ("file", "directory"):
+        name = os.path.basename(ports[port]).encode("utf-8")
+    else:
+        raise Exception(f"Unsupported data type: {data_type}")
+    if dst in SHARED_FILESYSTEM and data_type != "stdout":
+        # Only the path is sent, as the receiver can access the data directly
+        payload = os.path.abspath(ports[port]).encode("utf-8")
+        writer.write(FRAME_HEADER.pack(len(port_name), len(name), len(payload), FLAG_PATH) + port_name + name + payload)
+        size = 0
+    elif dst in UNIX_SOCKETS and data_type == "stdout" and ports[port]:
+        # In-memory data are copied into a shared memory segment, which the receiver maps and releases
+        payload = ports[port].encode("utf-8")
+        shm = shared_memory.SharedMemory(create=True, size=len(payload))
+        resource_tracker.unregister(shm._name, "shared_memory")
+        shm.buf[:len(payload)] = payload
+        shm_name = shm.name.encode("utf-8")
+        shm.close()
+        writer.write(FRAME_HEADER.pack(len(port_name), 0, len(payload), FLAG_SHM) + port_name + struct.pack("!H", len(shm_name)) + shm_name)
+        size = len(payload)
+    elif data_type == "stdout":
+        payload = ports[port].encode("utf-8")
+        size = len(payload)
+        if codec:
+            writer.write(FRAME_HEADER.pack(len(port_name), 0, 0, FLAG_STREAM) + port_name)
+            await _write_chunks(writer, BytesIO(payload), codec)
+        else:
+            writer.write(FRAME_HEADER.pack(len(port_name), 0, len(payload), 0) + port_name + payload)
+    elif data_type == "directory":
+        # The tar stream is written by a worker thread, without blocking the event loop
+        writer.write(FRAME_HEADER.pack(len(port_name), len(name), 0, FLAG_TAR | FLAG_STREAM) + port_name + name)
+        chunks = _ChunkWriter(_StreamBridge(None, writer), codec)
+        await asyncio.to_thread(_archive, ports[port], name.decode("utf-8"), chunks)
+        size = chunks.size
+    else:
+        with open(ports[port], "rb") as fd:
+            size = os.fstat(fd.fileno()).st_size
+            if codec:
+                writer.write(FRAME_HEADER.pack(len(port_name), len(name), 0, FLAG_STREAM) + port_name + name)
+                await _write_chunks(writer, fd, codec)
+            else:
+                writer.write(FRAME_HEADER.pack(len(port_name), len(name), size, 0) + port_name + name)
+                await writer.drain()
+                # Files are copied by the kernel when the transport supports it
+                # (`sendfile` rejects an empty count)
+                if size:
+                    await asyncio.get_running_loop().sendfile(writer.transport, fd, 0, size)
+    await writer.drain()
+    return size
+"""
+
+send_function = """async def _send(port: str, data_type: str, src: str, dst: str):
+    with tracer.span("send", f"{port} -> {dst}", port=port, dst=dst) as span:
+        begin = time.perf_counter_ns()
+        await available_port_data[port].wait()
+        span["wait_us"] = (time.perf_counter_ns() - begin) // 1000
+        # Frames are written atomically, so that concurrent sends do not interleave
+        async with channel_locks.setdefault(dst, Lock()):
+            begin = time.perf_counter_ns()
+            writer, codec = await _channel(src, dst)
+            span["connect_us"] = (time.perf_counter_ns() - begin) // 1000
+            if _is_skipped(port, dst):
+                span["skipped"] = True
+                return
+            span["bytes"] = await _send_frame(writer, port, data_type, codec, dst)
+            metrics.add("swirl_sent_bytes_total", span["bytes"], peer=dst)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Sent data for port {port} to location {dst}")
+"""
+
+send_batch_function = """async def _send_batch(sends: MutableSequence[tuple[str, str]], src: str, dst: str):
+    with tracer.span("send", f"{', '.join(port for port, _ in sends)} -> {dst}", ports=[port for port, _ in sends], dst=dst, bytes=0) as span:
+        begin = time.perf_counter_ns()
+        for port, _ in sends:
+            await available_port_data[port].wait()
+        span["wait_us"] = (time.perf_counter_ns() - begin) // 1000
+        async with channel_locks.setdefault(dst, Lock()):
+            begin = time.perf_counter_ns()
+            writer, codec = await _channel(src, dst)
+            span["connect_us"] = (time.perf_counter_ns() - begin) // 1000
+            for port, data_type in sends:
+                if _is_skipped(port, dst):
+                    continue
+                span["bytes"] += await _send_frame(writer, port, data_type, codec, dst)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"Sent data for port {port} to location {dst}")
+        metrics.add("swirl_sent_bytes_total", span["bytes"], peer=dst)
+"""
+
+read_functions = """async def _read_file(reader: asyncio.StreamReader, fd: Any, size: int):
+    while size > 0:
+        if not (data := await reader.read(min(size, CHUNK_SIZE))):
+            raise Exception("Connection closed before the end of the transfer")
+        fd.write(data)
+        size -= len(data)
+
+
+async def _read_chunks(reader: asyncio.StreamReader, fd: Any, factory: Any):
+    decompressor = None
+    while length := struct.unpack("!I", await reader.readexactly(4))[0]:
+        data = await reader.readexactly(length & ~CHUNK_COMPRESSED)
+        if length & CHUNK_COMPRESSED:
+            if decompressor is None:
+                if factory is None:
+                    raise Exception("Received compressed data without a negotiated codec")
+                decompressor = factory()
+            data = decompressor.decompress(data)
+        fd.write(data)
+    if decompressor is not None and hasattr(decompressor, "flush"):
+        fd.write(decompressor.flush())
+"""
+
+demux_function = """async def _read_frames(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    src = (await reader.readexactly(struct.unpack("!H", await reader.readexactly(2))[0])).decode("utf-8")
+    codec = (await reader.readexactly(struct.unpack("!H", await reader.readexactly(2))[0])).decode("utf-8")
+    accepted = codec if codec in CODECS else ""
+    pending = journaled.pop(src, [])
+    writer.write(_pack_string(accepted) + _pack_string(json.dumps([port for port, _ in pending])))
+    for port, value in pending:
+        _deliver(src, port, value)
+    await writer.drain()
+    factory = CODECS[accepted][1] if accepted else None
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Accepted channel from location {src}" + (f" with codec {accepted}" if accepted else ""))
+    while True:
+        try:
+            header = await reader.readexactly(FRAME_HEADER.size)
+        except asyncio.IncompleteReadError as e:
+            if e.partial:
+                raise Exception(f"Channel from location {src} closed in the middle of a frame")
+            break
+        port_size, name_size, size, flags = FRAME_HEADER.unpack(header)
+        port = (await reader.readexactly(port_size)).decode("utf-8")
+        name = (await reader.readexactly(name_size)).decode("utf-8")
+        if name:
+            value = os.path.join(SCRATCH_DIR, f"rcv_{port}_{uuid.uuid4()}", name)
+            os.mkdir(os.path.dirname(value))
+        if flags & FLAG_SHM:
+            shm = shared_memory.SharedMemory(name=(await reader.readexactly(struct.unpack("!H", await reader.readexactly(2))[0])).decode("utf-8"))
+            value = bytes(shm.buf[:size]).decode("utf-8")
+            shm.close()
+            shm.unlink()
+        elif flags & FLAG_PATH:
+            method = _link((await reader.readexactly(size)).decode("utf-8"), value)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Linked data for port {port} from location {src} ({method})")
+        elif flags & FLAG_TAR:
+            # Archives are extracted by a worker thread as they arrive
+            await asyncio.to_thread(_extract, _ChunkReader(_StreamBridge(reader, None), factory), os.path.dirname(value))
+        elif name:
+            # Files are written as they arrive
+            with open(value, "wb") as fd:
+                if flags & FLAG_STREAM:
+                    await _read_chunks(reader, fd, factory)
+                else:
+                    await _read_file(reader, fd, size)
+        else:
+            buf = BytesIO()
+            if flags & FLAG_STREAM:
+                await _read_chunks(reader, buf, factory)
+            else:
+                await _read_file(reader, buf, size)
+            value = buf.getvalue().decode("utf-8")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Received data for port {port} from location {src}")
+        _journal({"type": "recv", "src": src, "port": port, "value": value})
+        _deliver(src, port, value)
+
+
+def _deliver(src: str, port: str, value: Any):
+    received.setdefault((src, port), Queue()).put_nowait(value)
+
+
+async def _demux(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        await _read_frames(reader, writer)
+    except asyncio.CancelledError:
+        # Peers keep their channels open until they terminate, so pending reads are cancelled on exit
+        pass
+    except Exception:
+        # Otherwise, the error would only be logged by the server, and the matching `_recv` would wait forever
+        _fail()
+    finally:
+        writer.close()
+"""
+
+recv_function = """async def _recv(port: str, data_type: str, src: str):
+    with tracer.span("recv", f"{port} <- {src}", port=port, src=src) as span:
+        begin = time.perf_counter_ns()
+        if (src, port) not in received or received[(src, port)].empty():
+            logger.debug(f"Waiting data for port {port} from location {src}")
+        ports[port] = await received.setdefault((src, port), Queue()).get()
+        span["wait_us"] = (time.perf_counter_ns() - begin) // 1000
+        if (tracer.enabled or metrics.enabled) and data_type != "directory":
+            span["bytes"] = os.path.getsize(ports[port]) if data_type == "file" else len(ports[port].encode("utf-8"))
+            metrics.add("swirl_received_bytes_total", span["bytes"], peer=src)
+        metrics.add("swirl_recv_wait_seconds_total", span["wait_us"] / 1e6, peer=src)
+    available_port_data[port].set()
+    if data_type == "file" and logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Received file '{ports[port]}' on port {port}")
+"""
+
+forward_function = """async def _forward(port: str, data_type: str, src: str, dsts: MutableSequence[str]):
+    await asyncio.gather(*(_send(port, data_type, src, dst) for dst in dsts))
+"""
+
+seq_function = """async def _seq(*steps: Callable[[], Awaitable[Any]]):
+    # Each operand of a sequence is created only when the previous one has terminated
+    for step in steps:
+        await step()
+"""
+
+spawn_function = """async def _spawn(coro: Awaitable[Any]):
+    background.append(asyncio.create_task(coro))
+"""
+
+supervise_function = """def _fail():
+    logger.exception("Trace failed")
+    tracer.dump()
+    # Cancelling pending transfers and steps could wait for peers which will never answer
+    os._exit(1)
+
+
+async def _supervise(trace: Awaitable[Any]):
+    try:
+        await trace
+    except Exception:
+        _fail()
+"""
+
+runtime = "\n".join(
+    [
+        imports,
+        constants,
+        global_vars,
+        logger_config,
+        tracer_class,
+        metrics_class,
+        task_name_function,
+        serve_function,
+        unlink_socket_function,
+        stop_function,
+        resource_pool_class,
+        resources_class,
+        exec_function,
+        step_functions,
+        cache_functions,
+        init_dataset_function,
+        channel_function,
+        pack_string_function,
+        chunk_stream_classes,
+        bridge_functions,
+        archive_functions,
+        write_chunks_function,
+        send_frame_function,
+        send_function,
+        send_batch_function,
+        link_function,
+        read_functions,
+        demux_function,
+        journal_functions,
+        recv_function,
+        forward_function,
+        seq_function,
+        spawn_function,
+        supervise_function,
+        configure_function,
+    ]
+)
+
+
+class AsyncioTarget(DefaultTarget):
+    # The trace of each location is compiled into a single coroutine, running in one thread:
+    # the `|` operator becomes an `asyncio.gather` of its operands and the `.` operator a
+    # sequence of awaits. Operands are collected in a stack of `(operator, operands)` frames
+    # and rendered when the location ends
+    runtime: str = runtime
+
+    def __init__(
+        self, outdir: str, fuse_execs: bool = False, formatting: str = "full"
+    ) -> None:
+        super().__init__(outdir, formatting=formatting)
+        if fuse_execs:
+            logger.warning("The asyncio target does not support fused execs")
+        self.frames: MutableSequence[tuple[int | None, MutableSequence]] = []
+
+    def _add(self, operand: str) -> None:
+        self.frames[-1][1].append(operand)
+
+    def _begin(self, op: int) -> None:
+        self.frames.append((op, []))
+
+    def _end(self) -> None:
+        self._add(self.frames.pop())
+
+    def _render(self, node: str | tuple[int | None, MutableSequence]) -> str:
+        if isinstance(node, str):
+            return node
+        op, operands = node
+        # Chains of the same operator are flattened
+        flattened = []
+        for operand in operands:
+            if isinstance(operand, tuple) and operand[0] == op:
+                flattened.extend(operand[1])
+            else:
+                flattened.append(operand)
+        if op == SWIRLParser.PAR:
+            return f"asyncio.gather({', '.join(self._render(o) for o in flattened)})"
+        else:
+            return f"_seq({', '.join(f'lambda: {self._render(o)}' for o in flattened)})"
+
+    def begin_choice(self) -> None:
+        raise NotImplementedError("Choice is not implemented yet")
+
+    def begin_location(self, location: Location) -> None:
+        self.current_location = location
+        self.frames = [(None, [])]
+        self.programs[self.current_location.name] = open(
+            os.path.join(self.outdir, f"{self.current_location.name}.py"), "w"
+        )
+        self._write_program_header()
+        self.programs[self.current_location.name].write(f"""async def main():
+    servers = await _serve("{location.name}")
+""")
+
+    def begin_par(self) -> None:
+        self._begin(SWIRLParser.PAR)
+
+    def begin_paren(self) -> None:
+        pass
+
+    def begin_seq(self) -> None:
+        self._begin(SWIRLParser.SEQ)
+
+    def end_location(self) -> None:
+        _, operands = self.frames.pop()
+        for operand in operands:
+            self.programs[self.current_location.name].write(f"""
+    await {self._render(operand)}""")
+        self.programs[self.current_location.name].write("""
+    await asyncio.gather(*background)
+    logger.info("Terminated trace")
+    await _stop(servers)""")
+        self._write_constants()
+        self.programs[self.current_location.name].write("""
+if __name__ == '__main__':
+    _open_journal("--resume" in sys.argv[1:])
+    tracer.enabled = "--trace" in sys.argv[1:]
+    if METRICS_PORT is not None:
+        _serve_metrics(METRICS_PORT)
+    try:
+        asyncio.run(_supervise(main()))
+    finally:
+        tracer.dump()
+""")
+        self.programs[self.current_location.name].close()
+        self.current_location = None
+
+    def end_par(self) -> None:
+        self._end()
+
+    def end_paren(self) -> None:
+        pass
+
+    def end_seq(self) -> None:
+        self._end()
+
+    def exec(
+        self,
+        step: Step,
+        flow: tuple[set[tuple[str, str]], set[tuple[str, str]]],
+        mapping: set[str],
+    ):
+        self._add(f"_exec({self._get_exec_args(step, flow)})")
+
+    def forward(
+        self,
+        data: str,
+        port: str,
+        data_type: str,
+        src: str,
+        dsts: MutableSequence[str],
+    ):
+        # The forward follows the `recv` predicate, but the trace does not wait for it
+        recv = self.frames[-1][1].pop()
+        self._add(
+            f"""_seq(lambda: {recv}, lambda: _spawn(_forward("{port}", "{data_type}", "{src}", {list(dsts)})))"""
+        )
+
+    def par(self) -> None:
+        pass
+
+    def recv(self, port: str, data_type: str, src: str, dst: str):
+        self.location_ports.add(port)
+        self._add(f"""_recv("{port}", "{data_type}", "{src}")""")
+
+    def send(self, data: str, port: str, data_type: str, src: str, dst: str):
+        self._add(f"""_send("{port}", "{data_type}", "{src}", "{dst}")""")
+
+    def send_batch(
+        self, sends: MutableSequence[tuple[str, str, str]], src: str, dst: str
+    ):
+        self._add(
+            f"""_send_batch({[(port, data_type) for _, port, data_type in sends]}, "{src}", "{dst}")"""
+        )
+
+    def seq(self) -> None:
+        pass
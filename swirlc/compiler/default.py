@@ -1,19 +1,32 @@
 from __future__ import annotations
 
+import hashlib
+import importlib.util
+import itertools
 import os
 import stat
 import sys
+import uuid
 from collections.abc import MutableMapping, MutableSequence
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import TextIO
 
-from black import WriteBack
-
 from swirlc.core.compiler import BaseCompiler
 from swirlc.core.entity import Data, DistributedWorkflow, Location, Port, Step, Workflow
 from swirlc.log_handler import logger
 from swirlc.version import VERSION
 
+DEFAULT_CHUNK_SIZE = 2**20
+
+# Compression codecs available to the generated programs, as expressions building a streaming
+# compressor and decompressor (objects with the `compress`/`flush` and `decompress` methods).
+# Further codecs can be plugged in by adding entries to this dictionary
+codecs: MutableMapping[str, tuple[str, str]] = {
+    "zlib": ("zlib.compressobj(1)", "zlib.decompressobj()"),
+    "lzma": ("lzma.LZMACompressor(preset=1)", "lzma.LZMADecompressor()"),
+}
+
 bash_header = f"""#!/bin/sh
 
 # This file was generated automatically using SWIRL v{VERSION},
@@ -29,32 +42,91 @@ python_header = f"""#!/usr/bin/env python
 
 imports = """from __future__ import annotations
 
+import fcntl
 import glob
+import hashlib
+import json
 import logging
+import lzma
 import os
+import random
+import selectors
+import shutil
+import signal
 import socket
+import struct
 import subprocess
+import sys
+import tarfile
 import time
 import uuid
+import zlib
 
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from io import BytesIO
-from threading import Condition, Event, Thread
+from multiprocessing import resource_tracker, shared_memory
+from pathlib import Path
+from threading import Condition, Event, Lock, Thread, active_count, current_thread, main_thread
 from typing import Any, MutableMapping, MutableSequence
 """
 
-global_vars = """
-
+constants = """
 BUF_SIZE = 8192
 
+# Frame header: port name length, file name length, payload size, flags
+FRAME_HEADER = struct.Struct("!HHQB")
+# The payload is a sequence of length-prefixed chunks, ended by an empty chunk
+FLAG_STREAM = 1
+# The payload is a tar archive of a directory
+FLAG_TAR = 2
+# The payload is the path of the data on a filesystem shared with the receiver
+FLAG_PATH = 4
+# The payload is the name of a shared memory segment holding the data
+FLAG_SHM = 8
+# Linux ioctl cloning a file (reflink) on copy-on-write filesystems
+FICLONE = 0x40049409
+# Chunk length bit marking compressed chunks
+CHUNK_COMPRESSED = 1 << 31
+# With the `auto` compression mode, data are sent uncompressed if a sample does not shrink below this ratio
+AUTO_RATIO = 0.9
+AUTO_CODEC = "zlib"
+# Connection attempts are retried with a capped exponential backoff and full jitter
+RETRY_DELAY = 0.005
+RETRY_MAX_DELAY = 1.0
+# Maximum number of spans kept in memory by the tracer
+TRACE_SIZE = 1 << 16
+"""
+
+global_vars = """
+channels: MutableMapping[str, socket.socket] = {}
+channel_codecs: MutableMapping[str, tuple[Any, bool] | None] = {}
+channel_locks: MutableMapping[str, Lock] = {}
+channels_lock: Lock = Lock()
 condition: Condition = Condition()
-connections: MutableMapping[str, MutableMapping[str, socket.socket]] = {}
 ports: MutableMapping[str, Any] = {}
-stopping: bool = False
+received: MutableMapping[str, MutableMapping[str, MutableSequence[Any]]] = {}
+# Ports that each destination location already received in a previous run
+skipped: MutableMapping[str, MutableSequence[str]] = {}
+# Steps completed and data received in a previous run, replayed from the journal
+completed_execs: MutableMapping[str, Any] = {}
+journaled: MutableMapping[str, MutableSequence[tuple[str, Any]]] = {}
+journal: Any = None
+journal_lock: Lock = Lock()
+# Errors raised by the threads of the trace, which terminate the location
+failures: MutableSequence[Exception] = []
+metrics_lock: Lock = Lock()
+# Writing to this pipe wakes up the accept loop when the trace terminates
+wakeup_r, wakeup_w = os.pipe()
+"""
 
+logger_config = """
 logger = logging.getLogger("swirlc")
 defaultStreamHandler = logging.StreamHandler()
+# Records are labelled with the location program, as most of them are emitted by the runtime module
 formatter = logging.Formatter(
-    fmt="%(asctime)s.%(msecs)03d %(filename)s %(levelname)-8s %(message)s",
+    fmt=f"%(asctime)s.%(msecs)03d {os.path.basename(sys.argv[0])} %(levelname)-8s %(message)s",
     datefmt="%Y-%m-%d %H:%M:%S",
 )
 defaultStreamHandler.setFormatter(formatter)
@@ -63,43 +135,260 @@ logger.setLevel(logging.DEBUG)
 logger.propagate = False
 """
 
-accept_function = """def _accept(sock: socket.socket):
-    while not stopping:
+unlink_socket_function = """def _unlink_socket(path: str):
+    os.unlink(path)
+    # The last colocated location to terminate removes the directory of the sockets
+    try:
+        os.rmdir(os.path.dirname(path))
+    except OSError:
+        pass
+"""
+
+accept_function = """def _accept(*socks: socket.socket):
+    with selectors.DefaultSelector() as selector:
+        for sock in socks:
+            selector.register(sock, selectors.EVENT_READ)
+        selector.register(wakeup_r, selectors.EVENT_READ)
+        while True:
+            events = selector.select()
+            if any(key.fd == wakeup_r for key, _ in events):
+                break
+            for key, _ in events:
+                conn, _ = key.fileobj.accept()
+                # Demultiplexers are daemons, as peers keep their channels open until they terminate
+                _thread(_demux, conn, daemon=True)
+    for sock in socks:
+        if sock.family == socket.AF_UNIX:
+            _unlink_socket(sock.getsockname())
+        sock.close()
+"""
+
+tracer_class = """class _Tracer:
+    def __init__(self, size: int):
+        self.enabled: bool = False
+        # Appending to a bounded deque is thread-safe, and drops the oldest spans when it is full
+        self.spans: deque = deque(maxlen=size)
+
+    @contextmanager
+    def span(self, cat: str, name: str, **args: Any):
+        # Callers add arguments to the span, e.g., the transferred bytes, through the yielded dictionary
+        if not self.enabled:
+            yield args
+            return
+        start = time.time_ns()
+        begin = time.perf_counter_ns()
         try:
-            conn, _ = sock.accept()
-            name, port = conn.recv(1024).decode("utf-8").split()
-            if logger.isEnabledFor(logging.DEBUG):
-                logger.debug(f"Accepted connection for port {port} from location {name}")
-            with condition:
-                connections.setdefault(name, {})[port] = conn
-                conn.send("ack".encode("utf-8"))
-                condition.notify_all()
-        except socket.timeout:
-            pass
-    sock.close()
+            yield args
+        finally:
+            self.spans.append((cat, name, start // 1000, (time.perf_counter_ns() - begin) // 1000, _task_name(), args))
+
+    def dump(self):
+        if not self.enabled:
+            return
+        path = os.path.join(OUT_DIR, f"{LOCATION}.trace.json")
+        with open(path, "w") as f:
+            json.dump({
+                "location": LOCATION,
+                "hostname": socket.gethostname(),
+                "spans": [{"cat": cat, "name": name, "ts": ts, "dur": dur, "thread": thread, "args": args} for cat, name, ts, dur, thread, args in self.spans],
+            }, f)
+        logger.info(f"Trace written to {path}")
+
+
+tracer = _Tracer(TRACE_SIZE)
 """
 
-exec_function = """def _exec(step_name: str, step_display_name: str, input_port_names: MutableSequence[str], output_port_name: str, data_type: str, glob_regex: str | None, cmd: str, args: MutableSequence[tuple[str,bool]]):
-    # Wait all the data
-    for port_name in input_port_names:
-        available_port_data[port_name].wait()
-    # Prepare working directory
+metrics_class = """class _Metrics:
+    # Type and description of the exposed metrics
+    METRICS = {
+        "swirl_sent_bytes_total": ("counter", "Bytes sent to each location"),
+        "swirl_received_bytes_total": ("counter", "Bytes received from each location"),
+        "swirl_recv_wait_seconds_total": ("counter", "Time spent waiting for data from each location"),
+        "swirl_steps_running": ("gauge", "Steps currently running"),
+        "swirl_steps_completed_total": ("counter", "Steps executed to completion"),
+        "swirl_step_duration_seconds": ("gauge", "Duration of each executed step"),
+        "swirl_active_threads": ("gauge", "Threads alive in the location process"),
+    }
+
+    def __init__(self):
+        self.enabled: bool = False
+        # Values are indexed by metric name and label string
+        self.values: MutableMapping[tuple[str, str], float] = {}
+
+    def add(self, name: str, value: float, **labels: str):
+        if self.enabled:
+            key = (name, ",".join(f'{k}="{v}"' for k, v in labels.items()))
+            with metrics_lock:
+                self.values[key] = self.values.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels: str):
+        if self.enabled:
+            key = (name, ",".join(f'{k}="{v}"' for k, v in labels.items()))
+            with metrics_lock:
+                self.values[key] = value
+
+    def render(self) -> str:
+        self.set("swirl_active_threads", active_count())
+        with metrics_lock:
+            values = dict(self.values)
+        lines = []
+        for name, (kind, description) in self.METRICS.items():
+            lines.extend([f"# HELP {name} {description}", f"# TYPE {name} {kind}"])
+            lines.extend(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}" for (metric, labels), value in values.items() if metric == name)
+        return "\\n".join(lines) + "\\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any):
+        logger.debug(f"Metrics request: {format % args}")
+
+
+def _serve_metrics(port: int) -> ThreadingHTTPServer:
+    # The endpoint is served by a daemon thread, which does not keep the location alive
+    server = ThreadingHTTPServer((locations[LOCATION][0], port), _MetricsHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    metrics.enabled = True
+    logger.info(f"Metrics exposed on http://{server.server_address[0]}:{server.server_address[1]}/metrics")
+    return server
+
+
+metrics = _Metrics()
+"""
+
+task_name_function = """def _task_name() -> str:
+    return current_thread().name
+"""
+
+stop_function = """def _stop():
+    os.write(wakeup_w, b"\\0")
+"""
+
+resource_pool_class = """class _ResourcePool:
+    # Bookkeeping shared by the runtimes, whose `_Resources` subclasses wait on the condition
+    def __init__(self, available: MutableMapping[str, int | None]):
+        # Unlimited resources are `None`
+        self.total: MutableMapping[str, int | None] = dict(available)
+        self.available: MutableMapping[str, int | None] = dict(available)
+        self.condition: Condition = Condition()
+
+    def _request(self, step: str, requirements: MutableMapping[str, int]) -> MutableMapping[str, int]:
+        request = {"steps": 1, **requirements}
+        for key, value in request.items():
+            if self.total.get(key) is not None and value > self.total[key]:
+                raise Exception(f"Step {step} requires {value} {key}, but only {self.total[key]} are available on the location")
+        return request
+
+    def _fits(self, request: MutableMapping[str, int]) -> bool:
+        return all(self.available.get(k) is None or self.available[k] >= v for k, v in request.items())
+
+    def _acquire(self, request: MutableMapping[str, int]):
+        for key, value in request.items():
+            if self.available.get(key) is not None:
+                self.available[key] -= value
+
+    def _release(self, request: MutableMapping[str, int]):
+        for key, value in request.items():
+            if self.available.get(key) is not None:
+                self.available[key] += value
+"""
+
+resources_class = """class _Resources(_ResourcePool):
+    @contextmanager
+    def reserve(self, step: str, requirements: MutableMapping[str, int]):
+        request = self._request(step, requirements)
+        with self.condition:
+            if not self._fits(request):
+                logger.debug(f"Step {step} waits for resources")
+                self.condition.wait_for(lambda: self._fits(request))
+            self._acquire(request)
+        try:
+            yield
+        finally:
+            with self.condition:
+                self._release(request)
+                self.condition.notify_all()
+"""
+
+exec_function = """def _exec(step_name: str, step_display_name: str, input_port_names: MutableSequence[str], output_port_name: str, data_type: str, glob_regex: str | None, cmd: str, args: MutableSequence[tuple[str,bool]], requirements: MutableMapping[str, int]):
+    with tracer.span("exec", f"{step_display_name}-{step_name}", step=step_name) as span:
+        # Wait all the data
+        begin = time.perf_counter_ns()
+        for port_name in input_port_names:
+            available_port_data[port_name].wait()
+        span["wait_us"] = (time.perf_counter_ns() - begin) // 1000
+        if _resume_exec(step_name, step_display_name, output_port_name):
+            span["resumed"] = True
+            if output_port_name:
+                available_port_data[output_port_name].set()
+            return
+        if CACHE_DIR:
+            key = _cache_key(input_port_names, data_type, glob_regex, cmd, args)
+            if _cache_load(key, step_name, step_display_name, output_port_name, data_type):
+                span["cached"] = True
+                _journal({"type": "exec", "step": step_name, "value": ports.get(output_port_name)})
+                if output_port_name:
+                    available_port_data[output_port_name].set()
+                return
+        # Resources are reserved only when the step is ready to run, so that waiting steps do not hold them
+        with resources.reserve(f"{step_display_name}-{step_name}", requirements):
+            metrics.add("swirl_steps_running", 1)
+            begin = time.perf_counter()
+            stdout = _run(step_name, step_display_name, input_port_names, output_port_name, data_type, glob_regex, cmd, args)
+            metrics.set("swirl_step_duration_seconds", time.perf_counter() - begin, step=step_name)
+            metrics.add("swirl_steps_running", -1)
+        metrics.add("swirl_steps_completed_total", 1)
+        # Outputs are stored before being published, as the steps which consume them could modify them
+        if CACHE_DIR:
+            _cache_store(key, ports[output_port_name] if data_type in ("file", "directory") else None, stdout)
+        _journal({"type": "exec", "step": step_name, "value": ports.get(output_port_name)})
+        if output_port_name:
+            available_port_data[output_port_name].set()
+
+
+def _run(step_name: str, step_display_name: str, input_port_names: MutableSequence[str], output_port_name: str, data_type: str, glob_regex: str | None, cmd: str, args: MutableSequence[tuple[str,bool]]) -> bytes:
+    workdir = _prepare_workdir(step_name, input_port_names)
+    cmd = _format_command(step_name, step_display_name, cmd, args)
+    result = subprocess.run(cmd, capture_output=True, shell=True, cwd=workdir)
+    if result.returncode != 0:
+        raise Exception(f"Step {step_display_name}-{step_name} failed with exit status {result.returncode}: {result.stderr.decode('utf-8')}")
+    _collect_output(step_name, step_display_name, output_port_name, data_type, glob_regex, workdir, result.stdout)
+    return result.stdout
+"""
+
+step_functions = """def _prepare_workdir(step_name: str, input_port_names: MutableSequence[str]) -> str:
     workdir = os.path.join(SCRATCH_DIR, f"exec_{step_name}_{uuid.uuid4()}")
     os.mkdir(workdir)
     for port_name in input_port_names:
-        os.symlink(os.path.abspath(ports[port_name]), os.path.join(workdir, os.path.basename(ports[port_name])))
-    # Execute command
+        # In-memory data, e.g., the stdout of another step, are not linked
+        if os.path.exists(ports[port_name]):
+            os.symlink(os.path.abspath(ports[port_name]), os.path.join(workdir, os.path.basename(ports[port_name])))
+    return workdir
+
+
+def _format_command(step_name: str, step_display_name: str, cmd: str, args: MutableSequence[tuple[str,bool]]) -> str:
     cmd = " ".join([cmd, *(ports[elem] if is_data else elem for elem, is_data in args)])
     if logger.isEnabledFor(logging.INFO):
         logger.info(f"Step {step_display_name}-{step_name} executes command '{cmd}'")
-    result = subprocess.run(cmd, capture_output=True, shell=True, cwd=workdir)
-    if result.returncode != 0:
-        raise Exception(f"Step {step_display_name}-{step_name} failed with exit status {result.returncode}: {result.stderr.decode('utf-8')}")
+    return cmd
+
+
+def _collect_output(step_name: str, step_display_name: str, output_port_name: str, data_type: str, glob_regex: str | None, workdir: str, stdout: bytes):
     if output_port_name:
         if data_type == "stdout":
-            ports[output_port_name] = result.stdout
+            ports[output_port_name] = stdout.decode("utf-8")
             if logger.isEnabledFor(logging.INFO):
-                logger.info(f"Step {step_display_name}-{step_name} result: '{result.stdout.decode().strip()}'")
+                logger.info(f"Step {step_display_name}-{step_name} result: '{stdout.decode().strip()}'")
         elif data_type in ("file", "directory"):
             res = [path for path in glob.glob(os.path.join(workdir, glob_regex))]
             if len(res) == 0:
@@ -112,10 +401,275 @@ exec_function = """def _exec(step_name: str, step_display_name: str, input_port_
                 raise Exception(f"Step {step_display_name}-{step_name} produced too many files or directories which match glob regex: {res}")
         else:
             raise Exception(f"Unsupported data type: {data_type}")
-        available_port_data[output_port_name].set()
     else:
         if logger.isEnabledFor(logging.INFO):
-            logger.info(f"Step {step_display_name}-{step_name} has not an output port. Result: '{result.stdout.decode().strip()}'")
+            logger.info(f"Step {step_display_name}-{step_name} has not an output port. Result: '{stdout.decode().strip()}'")
+"""
+
+cache_functions = """def _copy(src: str, dst: str):
+    # Cached data are never shared with steps: clone them on copy-on-write filesystems, or copy them
+    if os.path.isdir(src) and not os.path.islink(src):
+        shutil.copytree(src, dst, symlinks=True, copy_function=_copy)
+    elif os.path.islink(src):
+        os.symlink(os.readlink(src), dst)
+    else:
+        try:
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            shutil.copyfile(src, dst)
+        shutil.copystat(src, dst)
+
+
+def _digest(path: str) -> str:
+    if os.path.isdir(path) and not os.path.islink(path):
+        h = hashlib.sha256()
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(dirs + files):
+                entry = os.path.join(root, name)
+                h.update(os.path.relpath(entry, path).encode("utf-8") + b"\\0")
+                h.update(str(os.lstat(entry).st_mode).encode("utf-8") + b"\\0")
+                if os.path.islink(entry):
+                    h.update(os.readlink(entry).encode("utf-8") + b"\\0")
+                elif name in files:
+                    h.update(_digest(entry).encode("utf-8"))
+        return h.hexdigest()
+    # File contents are hashed only if their size or modification time changed since the last hash
+    st = os.stat(path)
+    memo = os.path.join(CACHE_DIR, "digests", hashlib.sha256(f"{os.path.realpath(path)}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}".encode("utf-8")).hexdigest())
+    try:
+        with open(memo) as f:
+            digest = f.read()
+        # Digests are evicted with the entries, in least recently used order
+        os.utime(memo)
+        return digest
+    except OSError:
+        pass
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while buf := f.read(CHUNK_SIZE):
+            h.update(buf)
+    os.makedirs(os.path.dirname(memo), exist_ok=True)
+    with open(memo, "w") as f:
+        f.write(h.hexdigest())
+    return h.hexdigest()
+
+
+def _cache_key(input_port_names: MutableSequence[str], data_type: str, glob_regex: str | None, cmd: str, args: MutableSequence[tuple[str,bool]]) -> str:
+    # Data are identified by their name and content, not by their path, which changes at each run
+    def _data(port_name: str) -> str:
+        if os.path.exists(ports[port_name]):
+            return f"{os.path.basename(ports[port_name])}:{_digest(ports[port_name])}"
+        return ports[port_name]
+
+    key = {
+        "cmd": cmd,
+        "args": [_data(elem) if is_data else elem for elem, is_data in args],
+        "inputs": sorted(_data(port_name) for port_name in input_port_names),
+        "type": data_type,
+        "glob": glob_regex,
+    }
+    return hashlib.sha256(json.dumps(key).encode("utf-8")).hexdigest()
+
+
+def _cache_load(key: str, step_name: str, step_display_name: str, output_port_name: str, data_type: str) -> bool:
+    entry = os.path.join(CACHE_DIR, "entries", key)
+    try:
+        with open(os.path.join(entry, "stdout"), "rb") as f:
+            stdout = f.read()
+        if data_type in ("file", "directory"):
+            name = os.listdir(os.path.join(entry, "data"))[0]
+            value = os.path.join(SCRATCH_DIR, f"exec_{step_name}_{uuid.uuid4()}", name)
+            os.mkdir(os.path.dirname(value))
+            _copy(os.path.join(entry, "data", name), value)
+        # Entries are evicted in least recently used order
+        os.utime(entry)
+    except (OSError, IndexError):
+        # The entry does not exist or it has been evicted meanwhile
+        return False
+    if output_port_name:
+        ports[output_port_name] = value if data_type in ("file", "directory") else stdout.decode("utf-8")
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(f"Step {step_display_name}-{step_name} restored from cache. Result: '{ports[output_port_name] if data_type in ('file', 'directory') else stdout.decode().strip()}'")
+    return True
+
+
+def _cache_store(key: str, path: str | None, stdout: bytes):
+    entry = os.path.join(CACHE_DIR, "entries", key)
+    if os.path.exists(entry):
+        return
+    # Entries are populated in a temporary directory and then atomically renamed
+    tmp = os.path.join(CACHE_DIR, "tmp", str(uuid.uuid4()))
+    os.makedirs(tmp)
+    with open(os.path.join(tmp, "stdout"), "wb") as f:
+        f.write(stdout)
+    if path is not None:
+        os.mkdir(os.path.join(tmp, "data"))
+        _copy(path, os.path.join(tmp, "data", os.path.basename(path)))
+    size = sum(os.lstat(os.path.join(root, name)).st_size for root, dirs, files in os.walk(tmp) for name in dirs + files)
+    with open(os.path.join(tmp, "size"), "w") as f:
+        f.write(str(size))
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    try:
+        os.rename(tmp, entry)
+    except OSError:
+        # Another step stored the same entry meanwhile
+        shutil.rmtree(tmp, ignore_errors=True)
+        return
+    if CACHE_SIZE is not None:
+        _cache_evict()
+
+
+def _cache_evict():
+    # Entries and file digests share the maximum size of the cache
+    items = []
+    for key in os.listdir(os.path.join(CACHE_DIR, "entries")):
+        entry = os.path.join(CACHE_DIR, "entries", key)
+        try:
+            with open(os.path.join(entry, "size")) as f:
+                items.append((os.stat(entry).st_mtime, int(f.read()), entry))
+        except (OSError, ValueError):
+            pass
+    if os.path.isdir(digests := os.path.join(CACHE_DIR, "digests")):
+        for name in os.listdir(digests):
+            try:
+                st = os.stat(memo := os.path.join(digests, name))
+                items.append((st.st_mtime, st.st_size, memo))
+            except OSError:
+                pass
+    total = sum(size for _, size, _ in items)
+    for _, size, path in sorted(items):
+        if total <= CACHE_SIZE:
+            break
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Evicted cache entry {os.path.basename(path)}")
+        else:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        total -= size
+"""
+
+journal_functions = """def _open_journal(resume: bool):
+    global journal
+    path = os.path.join(SCRATCH_DIR, f".swirl_{LOCATION}.journal")
+    if resume and os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # The last record may be truncated if the location died while writing it
+                    break
+                # Files and directories must have survived the failure
+                if isinstance(record["value"], str) and record["value"].startswith(SCRATCH_DIR) and not os.path.exists(record["value"]):
+                    continue
+                if record["type"] == "exec":
+                    completed_execs[record["step"]] = record["value"]
+                elif record["type"] == "recv":
+                    # Data are delivered when the sender connects, so that it can skip them
+                    journaled.setdefault(record["src"], []).append((record["port"], record["value"]))
+        logger.info(f"Resuming trace: {len(completed_execs)} completed steps and {sum(len(p) for p in journaled.values())} received data")
+    journal = open(path, "a" if resume else "w")
+
+
+def _journal(record: MutableMapping[str, Any]):
+    # Records are flushed to disk, so that they survive the failure of the location
+    with journal_lock:
+        journal.write(json.dumps(record) + "\\n")
+        journal.flush()
+        os.fsync(journal.fileno())
+
+
+def _resume_exec(step_name: str, step_display_name: str, output_port_name: str) -> bool:
+    if step_name not in completed_execs:
+        return False
+    if output_port_name:
+        ports[output_port_name] = completed_execs[step_name]
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(f"Step {step_display_name}-{step_name} completed in a previous run")
+    return True
+
+
+def _is_skipped(port: str, dst: str) -> bool:
+    if port in skipped.get(dst, []):
+        skipped[dst].remove(port)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Location {dst} received data for port {port} in a previous run")
+        return True
+    return False
+"""
+
+exec_batch_function = """def _exec_batch(steps: MutableSequence[tuple[str, str, MutableSequence[str], str, str, str | None, str, MutableSequence[tuple[str,bool]], MutableMapping[str, int]]]):
+    with tracer.span("exec", " + ".join(f"{step[1]}-{step[0]}" for step in steps), steps=[step[0] for step in steps]) as span:
+        produced = {step[3] for step in steps if step[3]}
+        # A batch is skipped only if all its steps completed in a previous run
+        if all(step[0] in completed_execs for step in steps):
+            span["resumed"] = True
+            begin = time.perf_counter_ns()
+            for port_name in {port_name for step in steps for port_name in step[2] if port_name not in produced}:
+                available_port_data[port_name].wait()
+            span["wait_us"] = (time.perf_counter_ns() - begin) // 1000
+            for step in steps:
+                _resume_exec(step[0], step[1], step[3])
+            for port_name in produced:
+                available_port_data[port_name].set()
+        else:
+            _run_batch(steps, produced, span)
+
+
+def _run_batch(steps: MutableSequence[tuple[str, str, MutableSequence[str], str, str, str | None, str, MutableSequence[tuple[str,bool]], MutableMapping[str, int]]], produced: set[str], span: MutableMapping[str, Any]):
+    # Prepare a working directory shared by all the steps
+    workdir = os.path.join(SCRATCH_DIR, f"exec_{steps[0][0]}_{uuid.uuid4()}")
+    os.mkdir(workdir)
+    # All the commands run in a single shell, which reads them one at a time from a pipe and reports on its
+    # stdout the exit status of each step. Each step waits only for its own inputs, and its arguments are built
+    # as in `_run`, from the outputs of the previous steps
+    script_r, script_w = os.pipe()
+    shell = subprocess.Popen(["/bin/sh", f"/dev/fd/{script_r}"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=workdir, pass_fds=(script_r,))
+    os.close(script_r)
+    span["wait_us"] = 0
+    try:
+        with os.fdopen(script_w, "w") as script:
+            for step_name, step_display_name, input_port_names, output_port_name, data_type, glob_regex, cmd, args, requirements in steps:
+                begin = time.perf_counter_ns()
+                for port_name in input_port_names:
+                    if port_name not in produced:
+                        available_port_data[port_name].wait()
+                        # In-memory data, e.g., the stdout of another step, are not linked
+                        link = os.path.join(workdir, os.path.basename(ports[port_name]))
+                        if os.path.exists(ports[port_name]) and not os.path.lexists(link):
+                            os.symlink(os.path.abspath(ports[port_name]), link)
+                span["wait_us"] += (time.perf_counter_ns() - begin) // 1000
+                with resources.reserve(f"{step_display_name}-{step_name}", requirements):
+                    metrics.add("swirl_steps_running", 1)
+                    begin = time.perf_counter()
+                    cmd = _format_command(step_name, step_display_name, cmd, args)
+                    # The command is terminated by a newline, as it may end with the raw stdout of another step
+                    script.write(f"{{ {cmd}\\n}} > .swirl_{step_name}.out 2> .swirl_{step_name}.err\\necho $?\\n")
+                    script.flush()
+                    if (status := shell.stdout.readline().decode("utf-8").strip()) != "0":
+                        # An empty status means that the shell itself failed, e.g., on a syntax error
+                        returncode = int(status) if status else shell.wait()
+                        err = os.path.join(workdir, f".swirl_{step_name}.err")
+                        stderr = Path(err).read_bytes() if os.path.exists(err) else shell.stderr.read()
+                        raise Exception(f"Step {step_display_name}-{step_name} failed with exit status {returncode}: {stderr.decode('utf-8')}")
+                    metrics.set("swirl_step_duration_seconds", time.perf_counter() - begin, step=step_name)
+                    metrics.add("swirl_steps_running", -1)
+                metrics.add("swirl_steps_completed_total", 1)
+                with open(os.path.join(workdir, f".swirl_{step_name}.out"), "rb") as f:
+                    _collect_output(step_name, step_display_name, output_port_name, data_type, glob_regex, workdir, f.read())
+                # Outputs are published as soon as each step terminates, as later steps may wait for data
+                # which other locations compute from them
+                _journal({"type": "exec", "step": step_name, "value": ports.get(output_port_name)})
+                if output_port_name:
+                    available_port_data[output_port_name].set()
+    finally:
+        shell.communicate()
 """
 
 init_dataset_function = """def _init_dataset(port_name: str, data: str):
@@ -123,81 +677,370 @@ init_dataset_function = """def _init_dataset(port_name: str, data: str):
     available_port_data[port_name].set()
 """
 
-send_function = """def _send(port: str, data_type: str, src: str, dst: str):
-    while True:
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect(locations[dst])
-            break
-        except socket.error:
-            time.sleep(1)
-    sock.send(f"{src} {port}".encode("utf-8"))
-    sock.recv(BUF_SIZE)
-    if data_type == "stout":
-        sock.send(ports[port])
+channel_function = """def _channel(src: str, dst: str) -> tuple[socket.socket, Lock, tuple[Any, bool] | None]:
+    # A single long-lived connection is opened towards each destination
+    with channels_lock:
+        lock = channel_locks.setdefault(dst, Lock())
+    with lock:
+        if dst not in channels:
+            delay = RETRY_DELAY
+            while True:
+                if dst in UNIX_SOCKETS:
+                    # Locations on the same host communicate through Unix domain sockets
+                    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                    try:
+                        sock.connect(UNIX_SOCKETS[dst])
+                        break
+                    except OSError:
+                        sock.close()
+                else:
+                    try:
+                        sock = socket.create_connection(locations[dst])
+                        break
+                    except OSError:
+                        pass
+                time.sleep(random.uniform(0, delay))
+                delay = min(2 * delay, RETRY_MAX_DELAY)
+            # The handshake carries the source location and the proposed codec, which the receiver accepts or refuses
+            mode = COMPRESSION.get(dst, "")
+            codec = AUTO_CODEC if mode == "auto" else mode
+            sock.sendall(_pack_string(src) + _pack_string(codec))
+            accepted = _recv_exact(sock, struct.unpack("!H", _recv_exact(sock, 2))[0]).decode("utf-8")
+            # The receiver also lists the ports it already received from a previous run
+            skipped[dst] = json.loads(_recv_exact(sock, struct.unpack("!H", _recv_exact(sock, 2))[0]))
+            if codec and accepted != codec:
+                logger.warning(f"Location {dst} does not support codec {codec}: sending uncompressed data")
+            channel_codecs[dst] = (CODECS[accepted][0], mode == "auto") if accepted else None
+            channels[dst] = sock
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Opened channel to location {dst}" + (f" with codec {accepted}" if accepted else ""))
+    return channels[dst], lock, channel_codecs[dst]
+"""
+
+pack_string_function = """def _pack_string(value: str) -> bytes:
+    data = value.encode("utf-8")
+    return struct.pack("!H", len(data)) + data
+"""
+
+send_frame_function = """def _send_frame(sock: socket.socket, port: str, data_type: str, codec: tuple[Any, bool] | None, dst: str) -> int:
+    # Returns the size of the data copied to the receiver
+    if dst in SHARED_FILESYSTEM and data_type in ("file", "directory"):
+        # Only the path is sent, as the receiver can access the data directly
+        name = os.path.basename(ports[port]).encode("utf-8")
+        payload = os.path.abspath(ports[port]).encode("utf-8")
+        port_name = port.encode("utf-8")
+        sock.sendall(FRAME_HEADER.pack(len(port_name), len(name), len(payload), FLAG_PATH) + port_name + name + payload)
+        return 0
+    if dst in UNIX_SOCKETS and data_type == "stdout" and ports[port]:
+        # In-memory data are copied into a shared memory segment, which the receiver maps and releases
+        payload = ports[port].encode("utf-8")
+        shm = shared_memory.SharedMemory(create=True, size=len(payload))
+        resource_tracker.unregister(shm._name, "shared_memory")
+        shm.buf[:len(payload)] = payload
+        name = shm.name.encode("utf-8")
+        shm.close()
+        port_name = port.encode("utf-8")
+        sock.sendall(FRAME_HEADER.pack(len(port_name), 0, len(payload), FLAG_SHM) + port_name + struct.pack("!H", len(name)) + name)
+        return len(payload)
+    if data_type == "stdout":
+        name = b""
+        payload = ports[port].encode("utf-8")
+        size = len(payload)
     elif data_type == "file":
-        sock.send(os.path.basename(ports[port]).encode("utf-8"))
-        sock.recv(BUF_SIZE)
-        fd = open(ports[port], "rb")
-        while True:
-            buf = fd.read(BUF_SIZE)
-            if not buf:
-                break
-            sock.sendall(buf)
-        fd.close()
+        name = os.path.basename(ports[port]).encode("utf-8")
+        size = os.path.getsize(ports[port])
     elif data_type == "directory":
-        raise NotImplementedError(f"Recv directories not implemented yet")
+        name = os.path.basename(ports[port]).encode("utf-8")
+        size = 0
     else:
         raise Exception(f"Unsupported data type: {data_type}")
+    flags = FLAG_STREAM if codec or data_type == "directory" else 0
+    if data_type == "directory":
+        flags |= FLAG_TAR
+    port_name = port.encode("utf-8")
+    sock.sendall(FRAME_HEADER.pack(len(port_name), len(name), 0 if flags & FLAG_STREAM else size, flags) + port_name + name)
+    if not flags & FLAG_STREAM:
+        if data_type == "stdout":
+            sock.sendall(payload)
+        else:
+            # Files are copied by the kernel, without passing through user space
+            # (`sendfile` rejects an empty count)
+            if size:
+                with open(ports[port], "rb") as fd:
+                    sock.sendfile(fd, count=size)
+        return size
+    writer = _ChunkWriter(sock, codec)
+    if data_type == "directory":
+        # The tree is written as a tar stream, without building the archive on disk
+        with tarfile.open(fileobj=writer, mode="w|", bufsize=CHUNK_SIZE) as tar:
+            tar.add(ports[port], arcname=name.decode("utf-8"))
+    elif data_type == "file":
+        with open(ports[port], "rb") as fd:
+            while buf := fd.read(CHUNK_SIZE):
+                writer.write(buf)
+    else:
+        writer.write(payload)
+    writer.end()
+    return writer.size
+"""
+
+send_function = """def _send(port: str, data_type: str, src: str, dst: str):
+    with tracer.span("send", f"{port} -> {dst}", port=port, dst=dst) as span:
+        begin = time.perf_counter_ns()
+        available_port_data[port].wait()
+        span["wait_us"] = (time.perf_counter_ns() - begin) // 1000
+        begin = time.perf_counter_ns()
+        sock, lock, codec = _channel(src, dst)
+        span["connect_us"] = (time.perf_counter_ns() - begin) // 1000
+        # Frames are written atomically, so that concurrent sends do not interleave
+        with lock:
+            if _is_skipped(port, dst):
+                span["skipped"] = True
+                return
+            span["bytes"] = _send_frame(sock, port, data_type, codec, dst)
+            metrics.add("swirl_sent_bytes_total", span["bytes"], peer=dst)
     if logger.isEnabledFor(logging.DEBUG):
         logger.debug(f"Sent data for port {port} to location {dst}")
-    sock.close()
 """
 
-recv_function = """def _recv(port: str, data_type: str, src: str) -> Any:
+send_batch_function = """def _send_batch(sends: MutableSequence[tuple[str, str]], src: str, dst: str):
+    with tracer.span("send", f"{', '.join(port for port, _ in sends)} -> {dst}", ports=[port for port, _ in sends], dst=dst, bytes=0) as span:
+        begin = time.perf_counter_ns()
+        for port, _ in sends:
+            available_port_data[port].wait()
+        span["wait_us"] = (time.perf_counter_ns() - begin) // 1000
+        begin = time.perf_counter_ns()
+        sock, lock, codec = _channel(src, dst)
+        span["connect_us"] = (time.perf_counter_ns() - begin) // 1000
+        with lock:
+            for port, data_type in sends:
+                if _is_skipped(port, dst):
+                    continue
+                span["bytes"] += _send_frame(sock, port, data_type, codec, dst)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"Sent data for port {port} to location {dst}")
+        metrics.add("swirl_sent_bytes_total", span["bytes"], peer=dst)
+"""
+
+chunk_stream_classes = """class _ChunkWriter:
+    def __init__(self, sock: socket.socket, codec: tuple[Any, bool] | None = None):
+        self.sock: socket.socket = sock
+        self.factory: Any = codec[0] if codec else None
+        self.compressor: Any = self.factory() if codec else None
+        self.auto: bool = codec is not None and codec[1]
+        self.size: int = 0
+
+    def _write_chunk(self, data: bytes, compressed: bool):
+        if data:
+            self.sock.sendall(struct.pack("!I", len(data) | (CHUNK_COMPRESSED if compressed else 0)))
+            self.sock.sendall(data)
+
+    def end(self):
+        if self.compressor is not None:
+            self._write_chunk(self.compressor.flush(), True)
+        self.sock.sendall(struct.pack("!I", 0))
+
+    def write(self, data: bytes) -> int:
+        if self.auto:
+            # Sample the first chunk to detect incompressible data
+            self.auto = False
+            probe = self.factory()
+            if len(probe.compress(data) + probe.flush()) > AUTO_RATIO * len(data):
+                self.compressor = None
+        if self.compressor is not None:
+            self._write_chunk(self.compressor.compress(data), True)
+        else:
+            self._write_chunk(data, False)
+        self.size += len(data)
+        return len(data)
+
+
+class _ChunkReader:
+    def __init__(self, conn: socket.socket, factory: Any = None):
+        self.conn: socket.socket = conn
+        self.factory: Any = factory
+        self.decompressor: Any = None
+        self.buffer: bytearray = bytearray()
+        self.eof: bool = False
+
+    def read(self, size: int = -1) -> bytes:
+        while not self.eof and (size < 0 or len(self.buffer) < size):
+            if not (length := struct.unpack("!I", _recv_exact(self.conn, 4))[0]):
+                self.eof = True
+                if self.decompressor is not None and hasattr(self.decompressor, "flush"):
+                    self.buffer += self.decompressor.flush()
+            elif length & CHUNK_COMPRESSED:
+                if self.decompressor is None:
+                    if self.factory is None:
+                        raise Exception("Received compressed data without a negotiated codec")
+                    self.decompressor = self.factory()
+                self.buffer += self.decompressor.decompress(_recv_exact(self.conn, length & ~CHUNK_COMPRESSED))
+            else:
+                self.buffer += _recv_exact(self.conn, length)
+        size = len(self.buffer) if size < 0 else min(size, len(self.buffer))
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+"""
+
+link_function = """def _link(src: str, dst: str) -> str:
+    # Prefer a hard link, then a copy-on-write clone, and fall back to a symbolic link
+    if not os.path.isdir(src):
+        try:
+            os.link(src, dst)
+            return "hardlink"
+        except OSError:
+            pass
+        try:
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return "reflink"
+        except OSError:
+            if os.path.exists(dst):
+                os.remove(dst)
+    os.symlink(src, dst)
+    return "symlink"
+"""
+
+recv_exact_function = """def _recv_exact(conn: socket.socket, size: int) -> bytes:
     buf = BytesIO()
-    with condition:
-        while connections.setdefault(src, {}).get(port) is None:
-            logger.debug(f"Waiting connection for port {port} from location {src}")
-            condition.wait()
+    while size > 0:
+        if not (data := conn.recv(min(size, BUF_SIZE))):
+            raise Exception("Connection closed before the end of the transfer")
+        buf.write(data)
+        size -= len(data)
+    return buf.getvalue()
+"""
+
+recv_file_function = """def _recv_file(conn: socket.socket, size: int, fd: Any, view: memoryview):
+    # Data are received in a pre-allocated buffer, avoiding a new bytes object per chunk
+    while size > 0:
+        if not (n := conn.recv_into(view, min(size, len(view)))):
+            raise Exception("Connection closed before the end of the transfer")
+        fd.write(view[:n])
+        size -= n
+"""
+
+demux_function = """def _demux(conn: socket.socket):
+    src = _recv_exact(conn, struct.unpack("!H", _recv_exact(conn, 2))[0]).decode("utf-8")
+    codec = _recv_exact(conn, struct.unpack("!H", _recv_exact(conn, 2))[0]).decode("utf-8")
+    accepted = codec if codec in CODECS else ""
+    pending = journaled.pop(src, [])
+    conn.sendall(_pack_string(accepted) + _pack_string(json.dumps([port for port, _ in pending])))
+    for port, value in pending:
+        _deliver(src, port, value)
+    factory = CODECS[accepted][1] if accepted else None
     if logger.isEnabledFor(logging.DEBUG):
-        logger.debug(f"Received connection for port {port} from location {src}")
-    if data_type == "stdout":
-        while True:
-            if not (data := connections[src][port].recv(BUF_SIZE)):
-                break
-            buf.write(data)
+        logger.debug(f"Accepted channel from location {src}" + (f" with codec {accepted}" if accepted else ""))
+    conn.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, CHUNK_SIZE)
+    view = memoryview(bytearray(CHUNK_SIZE))
+    while header := conn.recv(FRAME_HEADER.size, socket.MSG_WAITALL):
+        if len(header) < FRAME_HEADER.size:
+            raise Exception(f"Channel from location {src} closed in the middle of a frame")
+        port_size, name_size, size, flags = FRAME_HEADER.unpack(header)
+        port = _recv_exact(conn, port_size).decode("utf-8")
+        name = _recv_exact(conn, name_size).decode("utf-8")
+        if name:
+            value = os.path.join(SCRATCH_DIR, f"rcv_{port}_{uuid.uuid4()}", name)
+            os.mkdir(os.path.dirname(value))
+        if flags & FLAG_SHM:
+            shm = shared_memory.SharedMemory(name=_recv_exact(conn, struct.unpack("!H", _recv_exact(conn, 2))[0]).decode("utf-8"))
+            value = bytes(shm.buf[:size]).decode("utf-8")
+            shm.close()
+            shm.unlink()
+        elif flags & FLAG_PATH:
+            method = _link(_recv_exact(conn, size).decode("utf-8"), value)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Linked data for port {port} from location {src} ({method})")
+        elif flags & FLAG_STREAM:
+            reader = _ChunkReader(conn, factory)
+            if flags & FLAG_TAR:
+                with tarfile.open(fileobj=reader, mode="r|") as tar:
+                    # Keep permissions and symlinks, but refuse members outside the destination
+                    if hasattr(tarfile, "tar_filter"):
+                        tar.extractall(os.path.dirname(value), filter="tar")
+                    else:
+                        tar.extractall(os.path.dirname(value))
+            elif name:
+                with open(value, "wb") as fd:
+                    while data := reader.read(CHUNK_SIZE):
+                        fd.write(data)
+            else:
+                value = reader.read().decode("utf-8")
+            # Consume what is left of the stream, e.g., the padding after the end of a tar archive
+            while reader.read(BUF_SIZE):
+                pass
+        elif name:
+            with open(value, "wb") as fd:
+                _recv_file(conn, size, fd, view)
+        else:
+            value = _recv_exact(conn, size).decode("utf-8")
         if logger.isEnabledFor(logging.DEBUG):
             logger.debug(f"Received data for port {port} from location {src}")
-        buf.seek(0)
-        ports[port] = buf.read().decode("utf-8")
-        available_port_data[port].set()
-    elif data_type == "file":
-        filename = connections[src][port].recv(1024).decode()
-        connections[src][port].send("ack".encode("utf-8"))
-        filepath = os.path.join(SCRATCH_DIR, f"rcv_{port}_{uuid.uuid4()}", filename)
-        os.mkdir(os.path.dirname(filepath))
-        fd = open(filepath, "wb")
-        while True:
-            if not (data := connections[src][port].recv(BUF_SIZE)):
-                break
-            fd.write(data)
-        fd.close()
-        ports[port] = filepath
-        available_port_data[port].set()
+        _journal({"type": "recv", "src": src, "port": port, "value": value})
+        _deliver(src, port, value)
+    conn.close()
+"""
+
+deliver_function = """def _deliver(src: str, port: str, value: Any):
+    with condition:
+        received.setdefault(src, {}).setdefault(port, []).append(value)
+        condition.notify_all()
+"""
+
+recv_function = """def _recv(port: str, data_type: str, src: str) -> Any:
+    with tracer.span("recv", f"{port} <- {src}", port=port, src=src) as span:
+        begin = time.perf_counter_ns()
+        with condition:
+            while not received.get(src, {}).get(port):
+                logger.debug(f"Waiting data for port {port} from location {src}")
+                condition.wait()
+            ports[port] = received[src][port].pop(0)
+        span["wait_us"] = (time.perf_counter_ns() - begin) // 1000
+        if (tracer.enabled or metrics.enabled) and data_type != "directory":
+            span["bytes"] = os.path.getsize(ports[port]) if data_type == "file" else len(ports[port].encode("utf-8"))
+            metrics.add("swirl_received_bytes_total", span["bytes"], peer=src)
+        metrics.add("swirl_recv_wait_seconds_total", span["wait_us"] / 1e6, peer=src)
+    available_port_data[port].set()
+    if data_type == "file" and logger.isEnabledFor(logging.DEBUG):
         logger.debug(f"Received file '{ports[port]}' on port {port}")
-    elif data_type == "directory":
-        raise NotImplementedError(f"Recv directories not implemented yet")
-    else:
-        raise Exception(f"Unsupported data type: {data_type}")
-    connections[src][port].close()
-    connections[src][port] = None
 """
 
-thread_function = """def _thread(f, *args) -> Thread:
-    thread = Thread(target=f, args=args)
+forward_function = """def _forward(port: str, data_type: str, src: str, dsts: MutableSequence[str]):
+    _wait([_thread(_send, port, data_type, src, dst) for dst in dsts])
+"""
+
+thread_function = """def _thread(f, *args, daemon: bool = False) -> Thread:
+    def target():
+        try:
+            f(*args)
+        except Exception as e:
+            # The error is raised again in the main thread, otherwise the location would hang
+            failures.append(e)
+            signal.pthread_kill(main_thread().ident, signal.SIGUSR1)
+
+    # Threads are named after their function, as in the traces
+    target.__name__ = f.__name__
+    thread = Thread(target=target, daemon=daemon)
     thread.start()
     return thread
+
+
+def _raise_failure(signum: int, frame: Any):
+    raise failures[0]
+"""
+
+configure_function = """# Settings defined by each location program
+SETTINGS = ("locations", "available_port_data", "CODECS", "COMPRESSION", "SHARED_FILESYSTEM", "UNIX_SOCKETS", "LOCATION", "resources", "OUT_DIR", "SCRATCH_DIR", "CHUNK_SIZE", "CACHE_DIR", "CACHE_SIZE", "METRICS_PORT")
+
+
+def _configure(settings: MutableMapping[str, Any]):
+    # The runtime functions read the settings of the location from the runtime module globals
+    globals().update({name: settings[name] for name in SETTINGS})
+
+
+# Location programs import all the runtime names, including the private ones
+__all__ = [name for name in dir() if not name.startswith("__") and name != "annotations"]
 """
 
 wait_function = """def _wait(threads: MutableSequence[Thread]):
@@ -205,22 +1048,65 @@ wait_function = """def _wait(threads: MutableSequence[Thread]):
         t.join()
 """
 
-preamble = "\n".join(
+# The runtime is written once in the `swirlc_runtime` module, imported by all the location programs
+runtime = "\n".join(
     [
-        python_header,
         imports,
+        constants,
         global_vars,
+        logger_config,
+        unlink_socket_function,
         accept_function,
+        tracer_class,
+        metrics_class,
+        task_name_function,
+        stop_function,
+        resource_pool_class,
+        resources_class,
         exec_function,
+        step_functions,
+        cache_functions,
+        exec_batch_function,
         init_dataset_function,
+        channel_function,
+        pack_string_function,
+        send_frame_function,
         send_function,
+        send_batch_function,
+        chunk_stream_classes,
+        link_function,
+        recv_exact_function,
+        recv_file_function,
+        demux_function,
+        deliver_function,
+        journal_functions,
         recv_function,
+        forward_function,
         thread_function,
         wait_function,
+        configure_function,
     ]
 )
 
 
+def _format_file(path: str, fast: bool) -> None:
+    # Runs in a worker process, so that the generated programs are formatted in parallel
+    import black
+
+    black.format_file_in_place(
+        Path(path),
+        fast=fast,
+        mode=black.mode.Mode(
+            target_versions={black.mode.TargetVersion.PY310}, line_length=88
+        ),
+        write_back=black.WriteBack.YES,
+    )
+
+
+def _get_unix_socket(socket_dir: str, location: Location) -> str:
+    return os.path.join(socket_dir, f"{location.port}.sock")
+
+
 class ThreadStack:
     def __init__(self):
         self.stack: MutableSequence[set[str]] = [set()]
@@ -243,9 +1129,20 @@ class ThreadStack:
 
 
 class DefaultTarget(BaseCompiler):
-    def __init__(self, outdir: str) -> None:
+    runtime: str = runtime
+
+    def __init__(
+        self, outdir: str, fuse_execs: bool = False, formatting: str = "full"
+    ) -> None:
         super().__init__(outdir)
         self.current_location: Location | None = None
+        # Generated programs are formatted with black, skipping its AST safety check if
+        # `formatting` is `fast`, or they are left as they are if it is `none`
+        self.formatting: str = formatting
+        # If `fuse_execs` is True, consecutive `exec` predicates in a sequence are
+        # buffered and then executed by a single shell
+        self.fuse_execs: bool = fuse_execs
+        self.pending_execs: MutableSequence[str] = []
         self.functions = []
         self.function_counter = 0
         self.location_ports = set()
@@ -256,10 +1153,35 @@ class DefaultTarget(BaseCompiler):
         self.programs: MutableMapping[str, TextIO] = {}
         self.workflow: DistributedWorkflow | None = None
         self.thread_stacks: MutableMapping[str, ThreadStack] = {}
+        # Unix domain sockets live in a directory of their own, so that they do not
+        # collide with the ones of other workflows on the same host
+        self.socket_dir: str = f"/tmp/swirlc-{uuid.uuid4().hex}"
+
+    def _get_colocated(self, location: Location) -> MutableSequence[Location]:
+        # Locations on the same host as the given one, including itself
+        if location.connection_type == "docker":
+            return []
+        colocated = [
+            loc
+            for loc in self.workflow.locations.values()
+            if loc.hostname == location.hostname and loc.connection_type != "docker"
+        ]
+        return colocated if len(colocated) > 1 else []
 
     def _get_indentation(self):
         return " " * 4 if self.parallel_step_counter > 0 else ""
 
+    def _flush_execs(self) -> None:
+        if len(self.pending_execs) == 1:
+            self.programs[self.current_location.name].write(f"""
+    {self._get_indentation()}_exec({self.pending_execs[0]})""")
+        elif self.pending_execs:
+            self.programs[self.current_location.name].write(
+                f"""
+    {self._get_indentation()}_exec_batch([{", ".join(f"({e})" for e in self.pending_execs)}])"""
+            )
+        self.pending_execs.clear()
+
     def _get_thread(self, location: str) -> str:
         return self.thread_stacks.setdefault(location, ThreadStack()).add_thread()
 
@@ -275,21 +1197,32 @@ class DefaultTarget(BaseCompiler):
 
     def begin_location(self, location: Location) -> None:
         self.current_location = location
+        self.thread_stacks.setdefault(location.name, ThreadStack())
         self.programs[self.current_location.name] = open(
             os.path.join(self.outdir, f"{self.current_location.name}.py"), "w"
         )
-        self.programs[self.current_location.name].write(preamble)
+        self._write_program_header()
         location = self.workflow.locations[self.current_location.name]
         self.programs[self.current_location.name].write(f"""def main():
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock.bind(locations["{location.name}"])
-    sock.settimeout(3)
     sock.listen({len(self.workflow.locations) - 1})
-
-    _thread(_accept, sock)
+""")
+        if self._get_colocated(location):
+            self.programs[self.current_location.name].write(f"""
+    os.makedirs(os.path.dirname(UNIX_SOCKETS["{location.name}"]), mode=0o700, exist_ok=True)
+    if os.path.exists(UNIX_SOCKETS["{location.name}"]):
+        os.unlink(UNIX_SOCKETS["{location.name}"])
+    unix_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    unix_sock.bind(UNIX_SOCKETS["{location.name}"])
+    unix_sock.listen({len(self._get_colocated(location)) - 1})
+""")
+        self.programs[self.current_location.name].write(f"""
+    _thread(_accept, sock{", unix_sock" if self._get_colocated(location) else ""})
 """)
 
     def begin_par(self) -> None:
+        self._flush_execs()
         if self.parallel_step_counter == 0 and not self.parathetized:
             self.programs[self.current_location.name].write(f"""
     def f{self.function_counter}():""")
@@ -298,16 +1231,59 @@ class DefaultTarget(BaseCompiler):
         self.parallel_step_counter += 1
 
     def begin_paren(self) -> None:
+        self._flush_execs()
         if self.parallel_step_counter > 1:
             self.parathetized = True
 
     def begin_workflow(self, workflow: Workflow) -> None:
         self.workflow = workflow
+        with open(os.path.join(self.outdir, "swirlc_runtime.py"), "w") as f:
+            f.write(python_header)
+            f.write(self.runtime)
+            f.write(f'\nRUNTIME_VERSION = "{self._get_runtime_version()}"\n')
 
     def choice(self):
+        self._flush_execs()
         raise NotImplementedError("Choice is not implemented yet")
 
-    def end_location(self) -> None:
+    def _get_runtime_version(self) -> str:
+        # Location programs refuse a runtime generated by another compiler version or target
+        return (
+            f"{VERSION}+{hashlib.sha256(self.runtime.encode('utf-8')).hexdigest()[:12]}"
+        )
+
+    def _format_programs(self) -> None:
+        if self.formatting == "none":
+            return
+        if importlib.util.find_spec("black") is None:
+            logger.warning(
+                "`black` package not found. Install black to obtain pretty-printed output files."
+            )
+            return
+        paths = [
+            os.path.join(self.outdir, f"{name}.py")
+            for name in ["swirlc_runtime", *self.programs]
+        ]
+        with ProcessPoolExecutor(
+            max_workers=min(len(paths), os.cpu_count() or 1)
+        ) as pool:
+            list(
+                pool.map(
+                    _format_file, paths, itertools.repeat(self.formatting == "fast")
+                )
+            )
+
+    def _write_program_header(self) -> None:
+        self.programs[self.current_location.name].write(f"""{python_header}
+import swirlc_runtime
+from swirlc_runtime import *
+
+if swirlc_runtime.RUNTIME_VERSION != "{self._get_runtime_version()}":
+    raise Exception(f"Location {self.current_location.name} requires the SWIRL runtime {self._get_runtime_version()}, but found {{swirlc_runtime.RUNTIME_VERSION}}")
+
+""")
+
+    def _write_constants(self) -> None:
         out_dir = (
             f'str(Path("{self.current_location.outdir}").expanduser().absolute())'
             if self.current_location.outdir
@@ -318,10 +1294,11 @@ class DefaultTarget(BaseCompiler):
             if self.current_location.workdir
             else "os.getcwd()"
         )
-        self.programs[self.current_location.name].write("""
-    logger.info("Terminated trace")
-    global stopping
-    stopping = True""")
+        cache_dir = (
+            f'str(Path("{self.current_location.cache_dir}").expanduser().absolute())'
+            if self.current_location.cache_dir
+            else None
+        )
         locations = ",\n".join(
             [
                 f"\t'{name}': ('{location.hostname}', {location.port})"
@@ -334,6 +1311,28 @@ class DefaultTarget(BaseCompiler):
                 for _ in range(len(self.location_ports))
             ]
         )
+        for dst, mode in self.current_location.compression.items():
+            if mode != "auto" and mode not in codecs:
+                raise Exception(
+                    f"Unsupported compression codec `{mode}` from location {self.current_location.name} to {dst}"
+                )
+        shared_filesystem = {
+            loc.name
+            for loc in self.workflow.locations.values()
+            if loc.shared_filesystem is not None
+            and loc.shared_filesystem == self.current_location.shared_filesystem
+            and loc.name != self.current_location.name
+        }
+        unix_sockets = {
+            loc.name: _get_unix_socket(self.socket_dir, loc)
+            for loc in self._get_colocated(self.current_location)
+        }
+        codec_entries = ",\n".join(
+            [
+                f"\t'{name}': (lambda: {compressor}, lambda: {decompressor})"
+                for name, (compressor, decompressor) in codecs.items()
+            ]
+        )
         self.programs[self.current_location.name].write(f"""
 locations = {{
 {locations}
@@ -342,34 +1341,54 @@ available_port_data = {{
 {ports}
 }}
 
+CODECS = {{
+{codec_entries}
+}}
+COMPRESSION = {dict(self.current_location.compression)}
+SHARED_FILESYSTEM = {shared_filesystem}
+UNIX_SOCKETS = {unix_sockets}
+LOCATION = "{self.current_location.name}"
+
+resources = _Resources({{"cores": {self.current_location.resources.get("cores", "os.cpu_count() or 1")}, "memory": {self.current_location.resources.get("memory")}, "steps": {self.current_location.resources.get("maxConcurrentSteps")}}})
+
 OUT_DIR = {out_dir}
 SCRATCH_DIR = {scratch_dir}
+CHUNK_SIZE = {self.current_location.chunk_size or DEFAULT_CHUNK_SIZE}
+CACHE_DIR = {cache_dir}
+CACHE_SIZE = {self.current_location.cache_size}
+METRICS_PORT = {self.current_location.metrics_port}
+
+_configure(globals())
 """)
+
+    def end_location(self) -> None:
+        self._flush_execs()
+        self.programs[self.current_location.name].write("""
+    logger.info("Terminated trace")
+    _stop()""")
+        self._write_constants()
         self.programs[self.current_location.name].write("""
 if __name__ == '__main__':
-    main()
+    _open_journal("--resume" in sys.argv[1:])
+    tracer.enabled = "--trace" in sys.argv[1:]
+    if METRICS_PORT is not None:
+        _serve_metrics(METRICS_PORT)
+    signal.signal(signal.SIGUSR1, _raise_failure)
+    try:
+        main()
+    except Exception:
+        logger.exception("Trace failed")
+        tracer.dump()
+        # Threads waiting for data which will never arrive would keep the location alive
+        os._exit(1)
+    finally:
+        tracer.dump()
 """)
         self.programs[self.current_location.name].close()
-
-        try:
-            import black
-
-            black.format_file_in_place(
-                Path(self.outdir, f"{self.current_location.name}.py"),
-                fast=False,
-                mode=black.mode.Mode(
-                    target_versions={black.mode.TargetVersion.PY310}, line_length=88
-                ),
-                write_back=WriteBack.YES,
-            )
-        except ImportError:
-            logger.warning(
-                "`black` package not found. Install black to obtain pretty-printed output files."
-            )
-
         self.current_location = None
 
     def end_par(self) -> None:
+        self._flush_execs()
         self.parallel_step_counter -= 1
         if (
             self.thread_stacks[self.current_location.name].get_group()
@@ -393,6 +1412,7 @@ if __name__ == '__main__':
     _wait([{', '.join(thread_stack.get_group())}])""")
 
     def end_paren(self):
+        self._flush_execs()
         self.parathetized = False
         if self.thread_stacks[self.current_location.name].get_group():
             self.programs[self.current_location.name].write(
@@ -403,36 +1423,59 @@ if __name__ == '__main__':
 
     def end_workflow(self) -> None:
         script_name = "run.sh"
-        copy_traces = " &\n".join(
-            [
-                loc.get_copy_command(f"{loc.name}.py", f"{loc.hostname}:{loc.workdir}")
-                for loc in self.workflow.locations.values()
-                if loc.get_copy_command(
-                    f"{loc.name}.py", f"{loc.hostname}:{loc.workdir}"
-                )
-            ]
-        )
+        # The runtime is copied once to each host and working directory
+        # Locations without a trace have no program to run
+        locations = [
+            loc for loc in self.workflow.locations.values() if loc.name in self.programs
+        ]
+        hosts = {
+            (loc.connection_type, loc.hostname, loc.workdir): loc for loc in locations
+        }
+        copy_commands = [
+            loc.get_copy_command("swirlc_runtime.py", f"{loc.hostname}:{loc.workdir}")
+            for loc in hosts.values()
+        ] + [
+            loc.get_copy_command(f"{loc.name}.py", f"{loc.hostname}:{loc.workdir}")
+            for loc in locations
+        ]
+        copy_traces = " &\n".join([command for command in copy_commands if command])
         if copy_traces:
             copy_traces += " &\nwait"
-        commands = (
-            " &\n".join(
-                [
-                    loc.get_command(f"python {loc.name}.py")
-                    for loc in self.workflow.locations.values()
-                ]
-            )
-            + " &"
+        commands = "\n".join(
+            [
+                loc.get_command(f"python {loc.name}.py$OPTIONS") + ' &\nPIDS="$PIDS $!"'
+                for loc in locations
+            ]
         )
         with open(os.path.join(self.outdir, script_name), "w") as f:
             f.write(f"""{bash_header}
 
 trap "echo Force termination; pkill -P $$" INT
 
+# With the --resume option, each location skips the work completed by a previous run.
+# With the --trace option, each location writes a trace of its execution
+OPTIONS=""
+for option in "$@"; do
+    case "$option" in
+        --resume|--trace) OPTIONS="$OPTIONS $option" ;;
+        *) echo "Unknown option: $option"; exit 1 ;;
+    esac
+done
+
 {copy_traces}
 
 # Start workflow execution
 {commands}
-wait
+
+# The workflow fails if any location fails
+STATUS=0
+for pid in $PIDS; do
+    wait "$pid" || STATUS=1
+done
+if [ "$STATUS" -ne 0 ]; then
+    echo "Workflow execution failed"
+    exit 1
+fi
 echo "Workflow execution terminated"
 """)
         usr_permissions = stat.S_IRUSR | stat.S_IWUSR | stat.S_IXUSR
@@ -440,26 +1483,50 @@ echo "Workflow execution terminated"
         os.chmod(
             os.path.join(self.outdir, script_name), usr_permissions | grp_permissions
         )
+        self._format_programs()
 
-    def exec(
+    def _get_exec_args(
         self,
         step: Step,
         flow: tuple[set[tuple[str, str]], set[tuple[str, str]]],
-        mapping: set[str],
-    ):
+    ) -> str:
         arguments = [
             (arg.name if isinstance(arg, Port) else arg, isinstance(arg, Port))
             for arg in step.arguments
         ]
 
+        requirements = {"cores": 1, "memory": 0, **step.requirements}
         if output_port_name := next(iter(flow[1]))[0] if flow[1] else "":
             self.location_ports.add(output_port_name)
+        return f""""{step.name}", "{step.display_name}", {[port_name for port_name, _ in flow[0]]}, "{output_port_name}", "{step.processors[output_port_name].type if output_port_name else ""}", "{step.processors[output_port_name].glob if output_port_name else ""}", "{step.command}", {arguments}, {requirements}"""
+
+    def exec(
+        self,
+        step: Step,
+        flow: tuple[set[tuple[str, str]], set[tuple[str, str]]],
+        mapping: set[str],
+    ):
+        self.pending_execs.append(self._get_exec_args(step, flow))
+        if not self.fuse_execs:
+            self._flush_execs()
+
+    def forward(
+        self,
+        data: str,
+        port: str,
+        data_type: str,
+        src: str,
+        dsts: MutableSequence[str],
+    ):
+        self._flush_execs()
+        # The forwarding thread is not joined, so that it does not delay the trace
         self.programs[self.current_location.name].write(
             f"""
-    {self._get_indentation()}_exec("{step.name}", "{step.display_name}", {[port_name for port_name, _ in flow[0]]}, "{output_port_name}", "{step.processors[output_port_name].type if output_port_name else ""}", "{step.processors[output_port_name].glob if output_port_name else ""}", "{step.command}", {arguments})"""
+    {self._get_indentation()}_thread(_forward, "{port}", "{data_type}", "{src}", {list(dsts)})"""
         )
 
     def par(self) -> None:
+        self._flush_execs()
         if (
             self.thread_stacks[self.current_location.name].get_group()
             and not self.parathetized
@@ -477,6 +1544,7 @@ echo "Workflow execution terminated"
             self.function_counter += 1
 
     def recv(self, port: str, data_type: str, src: str, dst: str):
+        self._flush_execs()
         self.location_ports.add(port)
         self.programs[self.current_location.name].write(
             f"""
@@ -484,11 +1552,21 @@ echo "Workflow execution terminated"
         )
 
     def send(self, data: str, port: str, data_type: str, src: str, dst: str):
+        self._flush_execs()
         self.programs[self.current_location.name].write(
             f"""
     {self._get_indentation()}{self._get_thread(self.current_location.name)} = _thread(_send, "{port}", "{data_type}", "{src}", "{dst}")"""
         )
 
+    def send_batch(
+        self, sends: MutableSequence[tuple[str, str, str]], src: str, dst: str
+    ):
+        self._flush_execs()
+        self.programs[self.current_location.name].write(
+            f"""
+    {self._get_indentation()}{self._get_thread(self.current_location.name)} = _thread(_send_batch, {[(port, data_type) for _, port, data_type in sends]}, "{src}", "{dst}")"""
+        )
+
     def seq(self):
         if (
             self.current_location.name in self.thread_stacks.keys()
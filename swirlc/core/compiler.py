@@ -17,12 +17,13 @@ from swirlc.core.entity import (
     Step,
     Workflow,
 )
+from swirlc.core.optimizer import SendBatch, TraceOptimizer
 
 
 class BaseCompiler:
-    def __init__(self, outdir: str) -> None:
-        self.outdir: str = outdir
-        if not os.path.exists(self.outdir):
+    def __init__(self, outdir: str | None = None) -> None:
+        self.outdir: str | None = outdir
+        if self.outdir is not None and not os.path.exists(self.outdir):
             raise Exception(f"Output directory `{self.outdir}` does not exist")
 
     def begin_choice(self) -> None:
@@ -101,6 +102,17 @@ class BaseCompiler:
         """Process the `exec` predicate."""
         pass
 
+    def forward(
+        self,
+        data: str,
+        port: str,
+        data_type: str,
+        src: str,
+        dsts: MutableSequence[str],
+    ) -> Any:
+        """Forward the data received on a port to other locations, without blocking the trace."""
+        pass
+
     def par(self) -> None:
         """After processing the first operand, but before processing the right operand of a par operator."""
         pass
@@ -113,6 +125,13 @@ class BaseCompiler:
         """Process the `send` predicate."""
         pass
 
+    def send_batch(
+        self, sends: MutableSequence[tuple[str, str, str]], src: str, dst: str
+    ) -> Any:
+        """Process a group of concurrent `send` predicates with the same source and destination."""
+        for data, port, data_type in sends:
+            self.send(data, port, data_type, src, dst)
+
     def seq(self) -> Any:
         """After processing the first operand, but before processing the right operand of a seq operator."""
         pass
@@ -123,10 +142,12 @@ class CompileVisitor(SWIRLVisitor, ABC):
         self,
         compiler: BaseCompiler,
         metadata: MutableMapping[str, Any],
+        optimizer: TraceOptimizer | None = None,
     ) -> None:
         super().__init__()
         self.compiler: BaseCompiler = compiler
         self.metadata: MutableMapping[str, Any] = metadata
+        self.optimizer: TraceOptimizer | None = optimizer
         self.workflow: DistributedWorkflow = DistributedWorkflow()
         for name, settings in self.metadata["locations"].items():
             self.workflow.add_location(
@@ -139,27 +160,51 @@ class CompileVisitor(SWIRLVisitor, ABC):
                     connection_type=settings.get("connectionType", None),
                     workdir=settings.get("workdir", None),
                     outdir=settings.get("outdir", None),
+                    chunk_size=settings.get("chunkSize", None),
+                    shared_filesystem=settings.get("sharedFilesystem", None),
+                    resources=settings.get("resources", None),
+                    cache_dir=settings.get("cache", {}).get("path", None),
+                    cache_size=settings.get("cache", {}).get("maxSize", None),
+                    metrics_port=settings.get("metrics", {}).get("port", None),
                 )
             )
+        # Links settings take precedence over the source location ones
+        links = {
+            (link.get("src"), link.get("dst")): link
+            for link in self.metadata.get("links", [])
+            if "compression" in link
+        }
+        for src in self.workflow.locations.values():
+            for dst in self.workflow.locations:
+                if dst == src.name:
+                    continue
+                for key in ((src.name, dst), (src.name, None), (None, dst)):
+                    if key in links:
+                        mode = links[key]["compression"]
+                        break
+                else:
+                    mode = self.metadata["locations"][src.name].get(
+                        "compression", links.get((None, None), {}).get("compression")
+                    )
+                if mode and mode != "none":
+                    src.compression[dst] = mode
 
     def visitDataSet(self, ctx: SWIRLParser.DataSetContext):
+        location = self.workflow.locations[utils.get_name(ctx.parentCtx.name())]
         dataset = []
         for d in ctx.dataPair():
             port_name, data_name = utils.get_pair(d)
-            dataset.append(
-                (
-                    port_name,
-                    Data(
-                        data_name,
-                        self.metadata["dependencies"][data_name]["type"],
-                        self.metadata["dependencies"][data_name]["value"],
-                    ),
-                )
+            data = Data(
+                data_name,
+                self.metadata["dependencies"][data_name]["type"],
+                self.metadata["dependencies"][data_name]["value"],
             )
-            port = self.workflow.ports.setdefault(
-                port_name, Port(port_name, port_name, set())
+            location.data[data_name] = data
+            dataset.append((port_name, data))
+            self.workflow.add_port_data(
+                self.workflow.ports.get(port_name, Port(port_name, port_name, set())),
+                data_name,
             )
-            port.data.add(data_name)
         self.compiler.begin_dataset(dataset)
         val = self.visitChildren(ctx)
         self.compiler.end_dataset()
@@ -193,6 +238,7 @@ class CompileVisitor(SWIRLVisitor, ABC):
                     )
                     for port_name, value in outdata_patterns.items()
                 },
+                requirements=step_metadata.get("requirements", None),
             )
             self.workflow.add_step(step)
             for port_name, _ in inputs:
@@ -216,7 +262,7 @@ class CompileVisitor(SWIRLVisitor, ABC):
                 )
                 self.workflow.add_output_port(step, port)
             for data_name, port_name in data_port.items():
-                self.workflow.ports[port_name].data.add(data_name)
+                self.workflow.add_port_data(self.workflow.ports[port_name], data_name)
 
             if any(
                 "valueFrom" in arg
@@ -241,7 +287,15 @@ class CompileVisitor(SWIRLVisitor, ABC):
                 for arg in step_metadata["arguments"]
             ]
         for loc in mapping:
-            self.workflow.map(self.workflow.steps[name], self.workflow.locations[loc])
+            location = self.workflow.locations[loc]
+            # Requirements exceeding the declared resources would make the step fail at
+            # runtime. Locations which do not declare them are checked when they run
+            for key, value in self.workflow.steps[name].requirements.items():
+                if (total := location.resources.get(key)) is not None and value > total:
+                    raise Exception(
+                        f"Step {name} requires {value} {key}, but location {loc} declares only {total}"
+                    )
+            self.workflow.map(self.workflow.steps[name], location)
         return self.compiler.exec(self.workflow.steps[name], flow, mapping)
 
     def visitRecv(self, ctx: SWIRLParser.RecvContext):
@@ -272,7 +326,16 @@ class CompileVisitor(SWIRLVisitor, ABC):
             raise ValueError(
                 f"From port {port} did not find data source (nor dataset nor step outputs)"
             )
-        return self.compiler.recv(port, data_type, src, dst)
+        if self.optimizer is None:
+            return self.compiler.recv(port, data_type, src, dst)
+        pred = ctx.parentCtx.parentCtx
+        val = self.compiler.recv(
+            port, data_type, self.optimizer.sources.get(pred, src), dst
+        )
+        if pred in self.optimizer.forwards:
+            data, dsts = self.optimizer.forwards[pred]
+            self.compiler.forward(data, port, data_type, dst, dsts)
+        return val
 
     def visitSend(self, ctx: SWIRLParser.SendContext):
         data = utils.get_name(ctx.data())
@@ -283,8 +346,70 @@ class CompileVisitor(SWIRLVisitor, ABC):
             data, port, self.metadata["dependencies"][data]["type"], src, dst
         )
 
+    def _visit_operands(
+        self,
+        op: int,
+        operands: MutableSequence[SWIRLParser.TraceContext | SendBatch],
+    ) -> None:
+        # Operands are visited as a left-associative chain, as the parser builds them
+        if len(operands) == 1:
+            if isinstance(operands[0], SendBatch):
+                self.visitSendBatch(operands[0])
+            else:
+                self.visit(operands[0])
+            return
+        if op == SWIRLParser.PAR:
+            begin, sep, end = (
+                self.compiler.begin_par,
+                self.compiler.par,
+                self.compiler.end_par,
+            )
+        elif op == SWIRLParser.SEQ:
+            begin, sep, end = (
+                self.compiler.begin_seq,
+                self.compiler.seq,
+                self.compiler.end_seq,
+            )
+        elif op == SWIRLParser.CHOICE:
+            begin, sep, end = (
+                self.compiler.begin_choice,
+                self.compiler.choice,
+                self.compiler.end_choice,
+            )
+        else:
+            raise Exception(f"Unsupported operator {SWIRLParser.literalNames[op]}")
+        begin()
+        self._visit_operands(op, operands[:-1])
+        sep()
+        self._visit_operands(op, operands[-1:])
+        end()
+
+    def visitSendBatch(self, batch: SendBatch):
+        return self.compiler.send_batch(
+            [
+                (
+                    (data := utils.get_name(send.data())),
+                    utils.get_name(send.port()),
+                    self.metadata["dependencies"][data]["type"],
+                )
+                for send in batch.sends
+            ],
+            batch.src,
+            batch.dst,
+        )
+
     def visitTraceOp(self, ctx: SWIRLParser.TraceOpContext):
-        if ctx.op.type == SWIRLParser.PAR:
+        if self.optimizer is not None:
+            operands = self.optimizer.get_operands(ctx)
+            if len(operands) == 1 and ctx.op.type == SWIRLParser.PAR:
+                # A parallel composition reduced to a single operand must still be
+                # joined before the rest of the trace
+                self.compiler.begin_par()
+                self._visit_operands(ctx.op.type, operands)
+                self.compiler.end_par()
+            else:
+                self._visit_operands(ctx.op.type, operands)
+        elif ctx.op.type == SWIRLParser.PAR:
             self.compiler.begin_par()
             self.visit(ctx.trace(0))
             self.compiler.par()
@@ -312,6 +437,8 @@ class CompileVisitor(SWIRLVisitor, ABC):
         return val
 
     def visitWorkflow(self, ctx: SWIRLParser.WorkflowContext):
+        if self.optimizer is not None:
+            self.optimizer.visit(ctx)
         self.compiler.begin_workflow(self.workflow)
         val = self.visitChildren(ctx)
         self.compiler.end_workflow()
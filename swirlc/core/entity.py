@@ -1,11 +1,17 @@
 from __future__ import annotations
 
-from collections.abc import MutableMapping, MutableSequence
+from array import array
+from collections.abc import (
+    Iterable,
+    Mapping,
+    MutableMapping,
+    MutableSequence,
+    Sequence,
+)
 from pathlib import PurePath
+from types import MappingProxyType
 from typing import Any
 
-from swirlc.core.utils import flatten_list
-
 
 class Data:
     __slots__ = ("name", "type", "value")
@@ -26,6 +32,13 @@ class Location:
         "outdir",
         "hostname",
         "port",
+        "chunk_size",
+        "compression",
+        "shared_filesystem",
+        "resources",
+        "cache_dir",
+        "cache_size",
+        "metrics_port",
     )
 
     def __init__(
@@ -38,6 +51,13 @@ class Location:
         port: str | None = None,
         workdir: str | None = None,
         outdir: str | None = None,
+        chunk_size: int | None = None,
+        compression: MutableMapping[str, str] | None = None,
+        shared_filesystem: str | None = None,
+        resources: MutableMapping[str, int] | None = None,
+        cache_dir: str | None = None,
+        cache_size: int | None = None,
+        metrics_port: int | None = None,
     ):
         self.data: MutableMapping[str, Any] = data
         self.display_name: str = display_name
@@ -47,6 +67,17 @@ class Location:
         self.port: str | None = port
         self.outdir: str | None = str(PurePath(outdir)) if outdir else outdir
         self.workdir: str | None = str(PurePath(workdir)) if workdir else workdir
+        self.chunk_size: int | None = chunk_size
+        # Compression mode of the data sent to each destination location
+        self.compression: MutableMapping[str, str] = compression or {}
+        self.shared_filesystem: str | None = shared_filesystem
+        # Cores, memory (in MiB) and concurrent steps available on the location
+        self.resources: MutableMapping[str, int] = resources or {}
+        # Content-addressed store of the step results, disabled if `cache_dir` is None
+        self.cache_dir: str | None = cache_dir
+        self.cache_size: int | None = cache_size
+        # Port of the HTTP endpoint exposing the runtime metrics, disabled if None
+        self.metrics_port: int | None = metrics_port
 
     def get_command(self, cmd: str) -> str:
         if self.connection_type == "ssh":
@@ -108,6 +139,7 @@ class Step:
         "command",
         "arguments",
         "processors",
+        "requirements",
     )
 
     def __init__(
@@ -117,57 +149,88 @@ class Step:
         command: str | None = None,
         arguments: MutableSequence[str | Port] | None = None,
         processors: MutableMapping[str, Processor] | None = None,
+        requirements: MutableMapping[str, int] | None = None,
     ):
         self.name: str = name
         self.display_name: str = display_name
         self.command: str | None = command
         self.arguments: MutableSequence[str | Port] | None = arguments
         self.processors: MutableMapping[str, Processor] | None = processors
+        # Cores and memory (in MiB) needed by each execution of the step
+        self.requirements: MutableMapping[str, int] = requirements or {}
 
 
 class Workflow:
-    __slots__ = ("steps", "ports", "dependencies", "__location")
+    __slots__ = ("steps", "ports", "inputs", "outputs", "_data_views", "__location")
 
     def __init__(self):
         self.steps: MutableMapping[str, Step] = {}
         self.ports: MutableMapping[str, Port] = {}
-        self.dependencies: set[tuple[str, str]] = set()
+        # Adjacency indexes of the step-port graph: each step or port name is
+        # mapped to the names of its input (backward) and output (forward) nodes
+        self.inputs: MutableMapping[str, set[str]] = {}
+        self.outputs: MutableMapping[str, set[str]] = {}
+        # Formatted `(port,data)` pairs of each step, keyed by step name and
+        # direction (`True` for outputs), invalidated when ports or data change
+        self._data_views: MutableMapping[tuple[str, bool], MutableSequence[str]] = {}
         self.__location: Location = Location(name="l", display_name="local", data={})
 
+    @property
+    def dependencies(self) -> set[tuple[str, str]]:
+        return {(src, dst) for src, dsts in self.outputs.items() for dst in dsts}
+
+    def _add_dependency(self, src: str, dst: str) -> None:
+        self.outputs.setdefault(src, set()).add(dst)
+        self.inputs.setdefault(dst, set()).add(src)
+        self._data_views.pop((src, True), None)
+        self._data_views.pop((dst, False), None)
+
+    def _get_data(self, step: Step, output: bool) -> MutableSequence[str]:
+        if (view := self._data_views.get((step.name, output))) is None:
+            ports = (
+                self.get_output_ports(step) if output else self.get_input_ports(step)
+            )
+            view = self._data_views[(step.name, output)] = sorted(
+                f"({p.name},{d})" for p in ports for d in p.data
+            )
+        return view
+
     def add_input_port(self, step: Step, port: Port):
         if port.name not in self.ports:
             self.ports[port.name] = port
-        self.dependencies.add((port.name, step.name))
+        self._add_dependency(port.name, step.name)
 
     def add_output_port(self, step: Step, port: Port):
         if port.name not in self.ports:
             self.ports[port.name] = port
-        self.dependencies.add((step.name, port.name))
+        self._add_dependency(step.name, port.name)
+
+    def add_port_data(self, port: Port, data: str) -> None:
+        if port.name not in self.ports:
+            self.ports[port.name] = port
+        self.ports[port.name].data.add(data)
+        for step in self.outputs.get(port.name, ()):
+            self._data_views.pop((step, False), None)
+        for step in self.inputs.get(port.name, ()):
+            self._data_views.pop((step, True), None)
 
     def add_step(self, step: Step) -> None:
         self.steps[step.name] = step
 
+    def freeze(self) -> FrozenWorkflow:
+        return FrozenWorkflow(self)
+
     def get_input_data(self, step: Step) -> MutableSequence[str]:
-        return sorted(
-            flatten_list(
-                [f"({p.name},{d})" for p in self.get_input_ports(step) for d in p.data]
-            )
-        )
+        return self._get_data(step, output=False)
 
     def get_input_locations(self, port: Port) -> MutableSequence[Location]:
         return [self.__location]
 
     def get_input_ports(self, step: Step) -> MutableSequence[Port]:
-        return sorted(
-            [self.ports[d[0]] for d in self.dependencies if d[1] == step.name],
-            key=lambda port: port.name,
-        )
+        return [self.ports[n] for n in sorted(self.inputs.get(step.name, ()))]
 
     def get_input_steps(self, port: Port) -> MutableSequence[Step]:
-        return sorted(
-            [self.steps[d[0]] for d in self.dependencies if d[1] == port.name],
-            key=lambda step: step.name,
-        )
+        return [self.steps[n] for n in sorted(self.inputs.get(port.name, ()))]
 
     def get_locations(self) -> MutableSequence[Location]:
         return [self.__location]
@@ -176,72 +239,357 @@ class Workflow:
         return sorted(self.steps.values(), key=lambda step: step.name)
 
     def get_output_data(self, step: Step) -> MutableSequence[str]:
-        return sorted(
-            flatten_list(
-                [f"({p.name},{d})" for p in self.get_output_ports(step) for d in p.data]
-            )
-        )
+        return self._get_data(step, output=True)
 
     def get_output_locations(self, port: Port) -> MutableSequence[Location]:
         return [self.__location]
 
     def get_output_ports(self, step: Step) -> MutableSequence[Port]:
-        return sorted(
-            [self.ports[d[1]] for d in self.dependencies if d[0] == step.name],
-            key=lambda port: port.name,
-        )
+        return [self.ports[n] for n in sorted(self.outputs.get(step.name, ()))]
 
     def get_output_steps(self, port: Port) -> MutableSequence[Step]:
-        return sorted(
-            [self.steps[d[1]] for d in self.dependencies if d[0] == port.name],
-            key=lambda step: step.name,
-        )
+        return [self.steps[n] for n in sorted(self.outputs.get(port.name, ()))]
 
     def get_step_locations(self, step: Step) -> MutableSequence[Location]:
         return [self.__location]
 
 
 class DistributedWorkflow(Workflow):
-    __slots__ = ("locations", "mapping")
+    __slots__ = (
+        "locations",
+        "step_locations",
+        "location_steps",
+        "_sorted_locations",
+        "_location_views",
+        "_step_views",
+        "_port_views",
+    )
 
     def __init__(self):
         super().__init__()
         self.locations: MutableMapping[str, Location] = {}
-        self.mapping: set[tuple[str, str]] = set()
+        # Bidirectional indexes of the step-location mapping
+        self.step_locations: MutableMapping[str, set[str]] = {}
+        self.location_steps: MutableMapping[str, set[str]] = {}
+        # Sorted views returned by the `get_*` methods, computed lazily and
+        # invalidated on mutation. They are shared, so callers must not modify them
+        self._sorted_locations: MutableSequence[Location] | None = None
+        self._location_views: MutableMapping[str, MutableSequence[Location]] = {}
+        self._step_views: MutableMapping[str, MutableSequence[Step]] = {}
+        self._port_views: MutableMapping[
+            tuple[str, bool], MutableSequence[Location]
+        ] = {}
+
+    @property
+    def mapping(self) -> set[tuple[str, str]]:
+        return {
+            (step, location)
+            for step, locations in self.step_locations.items()
+            for location in locations
+        }
+
+    def _add_dependency(self, src: str, dst: str) -> None:
+        super()._add_dependency(src, dst)
+        self._port_views.clear()
+
+    def _get_port_locations(
+        self, port: Port, output: bool
+    ) -> MutableSequence[Location]:
+        if (view := self._port_views.get((port.name, output))) is None:
+            steps = (self.outputs if output else self.inputs).get(port.name, ())
+            view = self._port_views[(port.name, output)] = sorted(
+                (
+                    self.locations[loc]
+                    for step in steps
+                    for loc in self.step_locations.get(step, ())
+                ),
+                key=lambda loc: loc.name,
+            )
+        return view
 
     def add_location(self, location: Location) -> None:
         self.locations[location.name] = location
+        self._sorted_locations = None
 
     def map(self, step: Step, location: Location) -> None:
-        self.mapping.add((step.name, location.name))
+        self.step_locations.setdefault(step.name, set()).add(location.name)
+        self.location_steps.setdefault(location.name, set()).add(step.name)
+        self._location_views.pop(step.name, None)
+        self._step_views.pop(location.name, None)
+        self._port_views.clear()
 
     def get_input_locations(self, port: Port) -> MutableSequence[Location]:
-        return sorted(
-            flatten_list(
-                [list(self.get_step_locations(s)) for s in self.get_input_steps(port)]
-            ),
-            key=lambda loc: loc.name,
-        )
+        return self._get_port_locations(port, output=False)
 
     def get_locations(self) -> MutableSequence[Location]:
-        return sorted(self.locations.values(), key=lambda loc: loc.name)
+        if self._sorted_locations is None:
+            self._sorted_locations = sorted(
+                self.locations.values(), key=lambda loc: loc.name
+            )
+        return self._sorted_locations
 
     def get_location_steps(self, location: Location) -> MutableSequence[Step]:
-        return sorted(
-            [self.steps[m[0]] for m in self.mapping if m[1] == location.name],
-            key=lambda step: step.name,
-        )
+        if (view := self._step_views.get(location.name)) is None:
+            view = self._step_views[location.name] = [
+                self.steps[n]
+                for n in sorted(self.location_steps.get(location.name, ()))
+            ]
+        return view
 
     def get_output_locations(self, port: Port) -> MutableSequence[Location]:
-        return sorted(
-            flatten_list(
-                [list(self.get_step_locations(s)) for s in self.get_output_steps(port)]
-            ),
-            key=lambda loc: loc.name,
-        )
+        return self._get_port_locations(port, output=True)
 
     def get_step_locations(self, step: Step) -> MutableSequence[Location]:
-        return sorted(
-            [self.locations[m[1]] for m in self.mapping if m[0] == step.name],
-            key=lambda loc: loc.name,
+        if (view := self._location_views.get(step.name)) is None:
+            view = self._location_views[step.name] = [
+                self.locations[n]
+                for n in sorted(self.step_locations.get(step.name, ()))
+            ]
+        return view
+
+
+def _to_csr(rows: Iterable[Iterable[int]]) -> tuple[array, array]:
+    offsets, indices = array("I", [0]), array("I")
+    for row in rows:
+        indices.extend(row)
+        offsets.append(len(indices))
+    return offsets, indices
+
+
+class _Relation:
+    # CSR pair of `(offsets, indices)` arrays, mapping each row id to the ids of its
+    # related entities in `table`
+    __slots__ = ("offsets", "indices", "table")
+
+    def __init__(self, rows: Iterable[Iterable[int]], table: Sequence[Any]):
+        self.offsets, indices = _to_csr(rows)
+        self.indices: memoryview = memoryview(indices)
+        self.table: Sequence[Any] = table
+
+    def __getitem__(self, row: int) -> _Row:
+        return _Row(self.indices[self.offsets[row] : self.offsets[row + 1]], self.table)
+
+
+class _Row(Sequence):
+    # Read-only view of a CSR row, which resolves entity ids on access
+    __slots__ = ("indices", "table")
+
+    def __init__(self, indices: memoryview, table: Sequence[Any]):
+        self.indices: memoryview = indices
+        self.table: Sequence[Any] = table
+
+    def __getitem__(self, index: int | slice) -> Any:
+        if isinstance(index, slice):
+            return [self.table[i] for i in self.indices[index]]
+        return self.table[self.indices[index]]
+
+    def __iter__(self):
+        return map(self.table.__getitem__, self.indices)
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+
+class FrozenWorkflow:
+    # Immutable snapshot of a `Workflow`, which exposes the same query interface.
+    # Steps, ports, locations and data pairs are interned to integer ids, assigned in
+    # name order, and each relation is stored as a CSR pair of `(offsets, indices)`
+    # arrays. Queries return views of the rows, which resolve entities on access.
+    __slots__ = (
+        "steps",
+        "ports",
+        "locations",
+        "_step_ids",
+        "_port_ids",
+        "_location_ids",
+        "_step_table",
+        "_port_table",
+        "_location_table",
+        "_data_table",
+        "_input_ports",
+        "_output_ports",
+        "_input_steps",
+        "_output_steps",
+        "_step_locations",
+        "_location_steps",
+        "_input_locations",
+        "_output_locations",
+        "_input_data",
+        "_output_data",
+    )
+
+    def __init__(self, workflow: Workflow):
+        self._step_table: tuple[Step, ...] = tuple(
+            sorted(workflow.steps.values(), key=lambda step: step.name)
+        )
+        self._port_table: tuple[Port, ...] = tuple(
+            sorted(workflow.ports.values(), key=lambda port: port.name)
+        )
+        self._location_table: tuple[Location, ...] = tuple(workflow.get_locations())
+        self._step_ids: Mapping[str, int] = {
+            s.name: i for i, s in enumerate(self._step_table)
+        }
+        self._port_ids: Mapping[str, int] = {
+            p.name: i for i, p in enumerate(self._port_table)
+        }
+        self._location_ids: Mapping[str, int] = {
+            loc.name: i for i, loc in enumerate(self._location_table)
+        }
+        self.steps: Mapping[str, Step] = MappingProxyType(
+            {s.name: s for s in self._step_table}
+        )
+        self.ports: Mapping[str, Port] = MappingProxyType(
+            {p.name: p for p in self._port_table}
+        )
+        self.locations: Mapping[str, Location] = MappingProxyType(
+            {loc.name: loc for loc in self._location_table}
+        )
+        # Relations are built from the indexes of the workflow rather than from its
+        # getters, which would fill its caches with views the snapshot does not need
+        steps, ports = self._step_table, self._port_table
+        step_ids, port_ids = self._step_ids, self._port_ids
+        self._input_ports: _Relation = _Relation(
+            (
+                sorted(port_ids[n] for n in workflow.inputs.get(s.name, ()))
+                for s in steps
+            ),
+            ports,
+        )
+        self._output_ports: _Relation = _Relation(
+            (
+                sorted(port_ids[n] for n in workflow.outputs.get(s.name, ()))
+                for s in steps
+            ),
+            ports,
+        )
+        self._input_steps: _Relation = _Relation(
+            (
+                sorted(step_ids[n] for n in workflow.inputs.get(p.name, ()))
+                for p in ports
+            ),
+            steps,
+        )
+        self._output_steps: _Relation = _Relation(
+            (
+                sorted(step_ids[n] for n in workflow.outputs.get(p.name, ()))
+                for p in ports
+            ),
+            steps,
+        )
+        if isinstance(workflow, DistributedWorkflow):
+            # Ids follow the name order, so sorting ids sorts entities by name
+            self._step_locations: _Relation = _Relation(
+                (
+                    sorted(
+                        self._location_ids[n]
+                        for n in workflow.step_locations.get(s.name, ())
+                    )
+                    for s in steps
+                ),
+                self._location_table,
+            )
+            self._location_steps: _Relation = _Relation(
+                (
+                    sorted(
+                        step_ids[n] for n in workflow.location_steps.get(loc.name, ())
+                    )
+                    for loc in self._location_table
+                ),
+                steps,
+            )
+            self._input_locations: _Relation = _Relation(
+                (
+                    sorted(
+                        i
+                        for n in workflow.inputs.get(p.name, ())
+                        for i in self._step_locations[step_ids[n]].indices
+                    )
+                    for p in ports
+                ),
+                self._location_table,
+            )
+            self._output_locations: _Relation = _Relation(
+                (
+                    sorted(
+                        i
+                        for n in workflow.outputs.get(p.name, ())
+                        for i in self._step_locations[step_ids[n]].indices
+                    )
+                    for p in ports
+                ),
+                self._location_table,
+            )
+        else:
+            # A plain workflow runs all its steps on a single local location
+            self._step_locations = _Relation(([0] for _ in steps), self._location_table)
+            self._location_steps = _Relation([range(len(steps))], steps)
+            self._input_locations = _Relation(
+                ([0] for _ in ports), self._location_table
+            )
+            self._output_locations = _Relation(
+                ([0] for _ in ports), self._location_table
+            )
+        # Data pairs are shared by the output ports of a step and the input ports of
+        # the steps reading them, so each one is stored once
+        self._data_table: tuple[str, ...] = tuple(
+            sorted({f"({p.name},{d})" for p in ports for d in p.data})
+        )
+        data_ids = {d: i for i, d in enumerate(self._data_table)}
+        self._input_data: _Relation = _Relation(
+            (
+                sorted(
+                    data_ids[f"({p.name},{d})"]
+                    for p in self._input_ports[i]
+                    for d in p.data
+                )
+                for i in range(len(steps))
+            ),
+            self._data_table,
+        )
+        self._output_data: _Relation = _Relation(
+            (
+                sorted(
+                    data_ids[f"({p.name},{d})"]
+                    for p in self._output_ports[i]
+                    for d in p.data
+                )
+                for i in range(len(steps))
+            ),
+            self._data_table,
         )
+
+    def freeze(self) -> FrozenWorkflow:
+        return self
+
+    def get_input_data(self, step: Step) -> Sequence[str]:
+        return self._input_data[self._step_ids[step.name]]
+
+    def get_input_locations(self, port: Port) -> Sequence[Location]:
+        return self._input_locations[self._port_ids[port.name]]
+
+    def get_input_ports(self, step: Step) -> Sequence[Port]:
+        return self._input_ports[self._step_ids[step.name]]
+
+    def get_input_steps(self, port: Port) -> Sequence[Step]:
+        return self._input_steps[self._port_ids[port.name]]
+
+    def get_locations(self) -> Sequence[Location]:
+        return self._location_table
+
+    def get_location_steps(self, location: Location) -> Sequence[Step]:
+        return self._location_steps[self._location_ids[location.name]]
+
+    def get_output_data(self, step: Step) -> Sequence[str]:
+        return self._output_data[self._step_ids[step.name]]
+
+    def get_output_locations(self, port: Port) -> Sequence[Location]:
+        return self._output_locations[self._port_ids[port.name]]
+
+    def get_output_ports(self, step: Step) -> Sequence[Port]:
+        return self._output_ports[self._step_ids[step.name]]
+
+    def get_output_steps(self, port: Port) -> Sequence[Step]:
+        return self._output_steps[self._port_ids[port.name]]
+
+    def get_step_locations(self, step: Step) -> Sequence[Location]:
+        return self._step_locations[self._step_ids[step.name]]
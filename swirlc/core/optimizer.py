@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+from collections.abc import Iterable, MutableMapping, MutableSequence
+
+from swirlc.antlr.SWIRLParser import SWIRLParser
+from swirlc.core import utils
+
+
+class SendBatch:
+    __slots__ = ("sends", "src", "dst")
+
+    def __init__(self, sends: MutableSequence[SWIRLParser.SendContext]):
+        self.sends: MutableSequence[SWIRLParser.SendContext] = sends
+        self.src: str = utils.get_name(sends[0].src())
+        self.dst: str = utils.get_name(sends[0].dst())
+
+
+def _get_send(ctx: SWIRLParser.TraceContext) -> SWIRLParser.SendContext | None:
+    if isinstance(ctx, SWIRLParser.TracePredContext):
+        return ctx.pred().send()
+    return None
+
+
+def get_operands(
+    ctx: SWIRLParser.TraceOpContext,
+) -> MutableSequence[SWIRLParser.TraceContext]:
+    # Operands of a maximal chain of the same (left-associative) operator. Operands
+    # enclosed in brackets are not flattened
+    operands = []
+    while (
+        isinstance(ctx.trace(0), SWIRLParser.TraceOpContext)
+        and ctx.trace(0).op.type == ctx.op.type
+    ):
+        operands.append(ctx.trace(1))
+        ctx = ctx.trace(0)
+    operands.extend([ctx.trace(1), ctx.trace(0)])
+    return operands[::-1]
+
+
+def _get_preds(
+    ctx: SWIRLParser.TraceContext,
+) -> Iterable[SWIRLParser.TracePredContext]:
+    # Predicates in the branches of a choice are not guaranteed to be executed
+    if isinstance(ctx, SWIRLParser.TracePredContext):
+        yield ctx
+    elif isinstance(ctx, SWIRLParser.TraceParenContext):
+        yield from _get_preds(ctx.trace())
+    elif ctx.op.type != SWIRLParser.CHOICE:
+        yield from _get_preds(ctx.trace(0))
+        yield from _get_preds(ctx.trace(1))
+
+
+def _get_available_ports(ctx: SWIRLParser.TraceContext) -> set[str]:
+    # Ports whose data are available when a trace starts: the dataset of its location and
+    # the outputs of the traces which precede it in a sequence
+    ports = set()
+    while isinstance(ctx.parentCtx, SWIRLParser.TraceContext):
+        if (
+            isinstance(ctx.parentCtx, SWIRLParser.TraceOpContext)
+            and ctx.parentCtx.op.type == SWIRLParser.SEQ
+            and ctx.parentCtx.trace(1) is ctx
+        ):
+            for pred in _get_preds(ctx.parentCtx.trace(0)):
+                if exec_ctx := pred.pred().exec():
+                    ports.update(port for port, _ in utils.get_flow(exec_ctx)[1])
+                elif recv := pred.pred().recv():
+                    ports.add(utils.get_name(recv.port()))
+        ctx = ctx.parentCtx
+    ports.update(utils.get_pair(el)[0] for el in ctx.parentCtx.dataSet().dataPair())
+    return ports
+
+
+def _is_initial(ctx: SWIRLParser.TracePredContext) -> bool:
+    # A predicate is initial if it is not preceded by anything in its location trace
+    while isinstance(ctx.parentCtx, SWIRLParser.TraceContext):
+        if (
+            isinstance(ctx.parentCtx, SWIRLParser.TraceOpContext)
+            and ctx.parentCtx.op.type == SWIRLParser.SEQ
+            and ctx.parentCtx.trace(1) is ctx
+        ):
+            return False
+        ctx = ctx.parentCtx
+    return True
+
+
+class TraceOptimizer:
+    def __init__(
+        self,
+        batch_sends: bool = True,
+        remove_duplicates: bool = True,
+        broadcast: bool = True,
+    ):
+        self.batch_sends: bool = batch_sends
+        self.remove_duplicates: bool = remove_duplicates
+        self.broadcast: bool = broadcast
+        self.removed: set[SWIRLParser.TracePredContext] = set()
+        # Broadcast trees: the location which actually sends the data to each `recv`
+        # predicate, and the locations to which the received data must be forwarded
+        self.sources: MutableMapping[SWIRLParser.TracePredContext, str] = {}
+        self.forwards: MutableMapping[
+            SWIRLParser.TracePredContext, tuple[str, MutableSequence[str]]
+        ] = {}
+
+    def _find_broadcasts(self, ctx: SWIRLParser.WorkflowContext) -> None:
+        sends: MutableMapping[
+            tuple[str, str, str], MutableMapping[str, SWIRLParser.TracePredContext]
+        ] = {}
+        recvs: MutableMapping[tuple[str, str, str], SWIRLParser.TracePredContext] = {}
+        for location in ctx.location():
+            for pred in _get_preds(location.trace()):
+                if pred in self.removed:
+                    continue
+                if send := pred.pred().send():
+                    sends.setdefault(
+                        (
+                            utils.get_name(send.data()),
+                            utils.get_name(send.port()),
+                            utils.get_name(send.src()),
+                        ),
+                        {},
+                    ).setdefault(utils.get_name(send.dst()), pred)
+                elif recv := pred.pred().recv():
+                    recvs.setdefault(
+                        (
+                            utils.get_name(recv.port()),
+                            utils.get_name(recv.src()),
+                            utils.get_name(recv.dst()),
+                        ),
+                        pred,
+                    )
+        for (data, port, src), targets in sends.items():
+            # Only the locations that receive the data before doing anything else can
+            # forward it, otherwise the rewritten traces could deadlock
+            dsts = [
+                dst
+                for dst in targets
+                if dst != src
+                and (port, src, dst) in recvs
+                and _is_initial(recvs[(port, src, dst)])
+            ]
+            # Binomial tree rooted in the source location (node 0): the parent of
+            # node `i` is obtained by clearing the highest set bit of `i`. With less
+            # than three destinations, the tree is a plain one-to-many send
+            if len(dsts) < 3:
+                continue
+            nodes = [src] + dsts
+            for i in range(1, len(nodes)):
+                parent = i & ~(1 << (i.bit_length() - 1))
+                if parent != 0:
+                    self.removed.add(targets[nodes[i]])
+                    self.sources[recvs[(port, src, nodes[i])]] = nodes[parent]
+                    self.forwards.setdefault(
+                        recvs[(port, src, nodes[parent])], (data, [])
+                    )[1].append(nodes[i])
+
+    def _find_duplicates(self, ctx: SWIRLParser.WorkflowContext) -> None:
+        # The `send` and `recv` predicates of each `(port, src, dst)` channel
+        sends: MutableMapping[
+            tuple[str, str, str], MutableSequence[SWIRLParser.TracePredContext]
+        ] = {}
+        recvs: MutableMapping[
+            tuple[str, str, str], MutableSequence[SWIRLParser.TracePredContext]
+        ] = {}
+        for location in ctx.location():
+            for pred in _get_preds(location.trace()):
+                if send := pred.pred().send():
+                    sends.setdefault(
+                        (
+                            utils.get_name(send.port()),
+                            utils.get_name(send.src()),
+                            utils.get_name(send.dst()),
+                        ),
+                        [],
+                    ).append(pred)
+                elif recv := pred.pred().recv():
+                    recvs.setdefault(
+                        (
+                            utils.get_name(recv.port()),
+                            utils.get_name(recv.src()),
+                            utils.get_name(recv.dst()),
+                        ),
+                        [],
+                    ).append(pred)
+        for key, preds in sends.items():
+            # Receivers cannot tell which data a `recv` matches, so the communications
+            # of a channel are duplicates only if all its sends carry the same data,
+            # and each removed `send` is paired with a removed `recv`
+            if (
+                len({utils.get_name(p.pred().send().data()) for p in preds}) == 1
+                and len(preds) == len(recvs.get(key, ())) > 1
+            ):
+                self.removed.update(preds[1:])
+                self.removed.update(recvs[key][1:])
+
+    def get_operands(
+        self, ctx: SWIRLParser.TraceOpContext
+    ) -> MutableSequence[SWIRLParser.TraceContext | SendBatch]:
+        operands = [op for op in get_operands(ctx) if not self.is_empty(op)]
+        if self.batch_sends and ctx.op.type == SWIRLParser.PAR:
+            # A batch waits for the data of all its ports before sending them, so only
+            # the ports available when the chain starts can be batched. Otherwise, the
+            # batch could wait for data which the receiver must produce first
+            available = _get_available_ports(ctx)
+            groups: MutableMapping[tuple[str, str], MutableSequence[int]] = {}
+            for i, operand in enumerate(operands):
+                if (send := _get_send(operand)) and utils.get_name(
+                    send.port()
+                ) in available:
+                    groups.setdefault(
+                        (utils.get_name(send.src()), utils.get_name(send.dst())), []
+                    ).append(i)
+            batches = {
+                indices[0]: SendBatch([_get_send(operands[i]) for i in indices])
+                for indices in groups.values()
+                if len(indices) > 1
+            }
+            batched = {
+                i for indices in groups.values() if len(indices) > 1 for i in indices
+            }
+            operands = [
+                batches.get(i, operand)
+                for i, operand in enumerate(operands)
+                if i in batches or i not in batched
+            ]
+        return operands
+
+    def is_empty(self, ctx: SWIRLParser.TraceContext) -> bool:
+        if isinstance(ctx, SWIRLParser.TracePredContext):
+            return ctx in self.removed
+        elif isinstance(ctx, SWIRLParser.TraceParenContext):
+            return self.is_empty(ctx.trace())
+        else:
+            return self.is_empty(ctx.trace(0)) and self.is_empty(ctx.trace(1))
+
+    def visit(self, ctx: SWIRLParser.WorkflowContext) -> None:
+        if self.remove_duplicates:
+            self._find_duplicates(ctx)
+        if self.broadcast:
+            self._find_broadcasts(ctx)
@@ -47,6 +47,20 @@ def _add_step(step, steps, workflow, dependencies):
                 steps[step.name]["outputs"][port_name]["glob"] = processor.glob
 
 
+def _get_dataset_sends(workflow, location):
+    copying_dataset = set()
+    for data in location.data.values():
+        for port in workflow.ports.values():
+            if data.name in port.data:
+                for send in (
+                    f"send({data.name}->{port.name},{location.name},{out_loc.name})"
+                    for out_loc in workflow.get_output_locations(port)
+                    if out_loc.name != location.name
+                ):
+                    copying_dataset.add(send)
+    return copying_dataset
+
+
 class AbstractTranslator:
     @abstractmethod
     def _translate(self) -> Workflow: ...
@@ -54,15 +68,22 @@ class AbstractTranslator:
     def translate(
         self, workflow_output: TextIO = sys.stdout, metadata_output: TextIO = sys.stdout
     ):
-        workflow = self._translate()
+        workflow = self._translate().freeze()
 
         # Dictionaries to generate metadata file
         dependencies = {}
         locations = {}
         steps = {}
         version = "v1.0"
-        nof_locations = len(workflow.get_locations())
-        for i, location in enumerate(workflow.get_locations()):
+        # Skip locations without any work, which would produce an empty trace
+        active_locations = [
+            location
+            for location in workflow.get_locations()
+            if workflow.get_location_steps(location)
+            or _get_dataset_sends(workflow, location)
+        ]
+        nof_locations = len(active_locations)
+        for i, location in enumerate(active_locations):
             trace_recvs = set()
             datapair = []
             for data in sorted(location.data.keys()):
@@ -77,16 +98,7 @@ class AbstractTranslator:
                 dependencies[data_name] = {"type": data.type, "value": data.value}
 
             # Add send data from dataset to other locations
-            copying_dataset = set()
-            for data in location.data.values():
-                for port in workflow.ports.values():
-                    if data.name in port.data:
-                        for send in (
-                            f"send({data.name}->{port.name},{location.name},{out_loc.name})"
-                            for out_loc in workflow.get_output_locations(port)
-                            if out_loc.name != location.name
-                        ):
-                            copying_dataset.add(send)
+            copying_dataset = _get_dataset_sends(workflow, location)
             parallel_dataset_send = (
                 f"({' | '.join(copying_dataset)}) | " if copying_dataset else ""
             )
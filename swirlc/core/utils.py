@@ -1,5 +1,8 @@
 from __future__ import annotations
 
+from collections.abc import MutableSequence
+from typing import TextIO
+
 import antlr4
 
 from swirlc.antlr.SWIRLParser import SWIRLParser
@@ -7,11 +10,16 @@ from swirlc.antlr.SWIRLParser import SWIRLParser
 
 def flatten_list(ll: list) -> list:
     ret = []
-    for i in ll:
-        if isinstance(i, (list, set)):
-            ret.extend(flatten_list(i))
-        else:
+    # Explicit stack of iterators, to avoid recursion and copies of nested lists
+    stack = [iter(ll)]
+    while stack:
+        for i in stack[-1]:
+            if isinstance(i, (list, set)):
+                stack.append(iter(i))
+                break
             ret.append(i)
+        else:
+            stack.pop()
     return ret
 
 
@@ -30,3 +38,12 @@ def get_pair(ctx: SWIRLParser.DataPairContext) -> tuple[str, str]:
 
 def get_name(el: antlr4.ParserRuleContext) -> str:
     return el.ID().getText()
+
+
+def write_table(rows: MutableSequence[tuple[str, ...]], output: TextIO) -> None:
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    for row in rows:
+        line = "  ".join(
+            cell.ljust(width) for cell, width in zip(row, widths, strict=True)
+        )
+        output.write(f"{line.rstrip()}\n")
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import json
 import os
 import sys
 
@@ -7,14 +8,41 @@ import antlr4
 
 import swirlc.compiler
 import swirlc.translator
+from swirlc.analysis import critical_path, trace
+from swirlc.analysis.cost import CostModel
+from swirlc.analysis.placement import PlacementTranslator
+from swirlc.analysis.simulator import Simulator, TraceBuilder
 from swirlc.antlr.SWIRLLexer import SWIRLLexer
 from swirlc.antlr.SWIRLParser import SWIRLParser
 from swirlc.config.validator import SwirlValidator
-from swirlc.core.compiler import CompileVisitor
+from swirlc.core.compiler import BaseCompiler, CompileVisitor
+from swirlc.core.optimizer import TraceOptimizer
+from swirlc.core.translator import AbstractTranslator
 from swirlc.log_handler import logger
 from swirlc.parser import parser
 
 
+def _parse(path: str) -> SWIRLParser.WorkflowContext:
+    with open(path) as f:
+        code = f.read()
+    lexer = SWIRLLexer(antlr4.InputStream(code))
+    tokens = antlr4.CommonTokenStream(lexer)
+    return SWIRLParser(tokens).workflow()
+
+
+def _translate(translator: AbstractTranslator, outdir: str | None) -> None:
+    if outdir:
+        if not os.path.isdir(outdir):
+            raise Exception(f"Output directory `{outdir}` does not exist")
+        with (
+            open(os.path.join(outdir, "workflow.swirl"), "w") as workflow_output,
+            open(os.path.join(outdir, "metadata.yml"), "w") as metadata_output,
+        ):
+            translator.translate(workflow_output, metadata_output)
+    else:
+        translator.translate(sys.stdout, sys.stdout)
+
+
 def main(args):
     try:
         args = parser.parse_args(args)
@@ -22,40 +50,68 @@ def main(args):
             from swirlc.version import VERSION
 
             print(f"swirlc version {VERSION}")
+        elif args.context == "analyze":
+            config = SwirlValidator().validate_file(args.metadata)
+            # Build the workflow model with a target which does not generate code
+            visitor = CompileVisitor(compiler=BaseCompiler(), metadata=config)
+            visitor.visit(_parse(args.workflow))
+            critical_path.analyze(visitor.workflow.freeze(), CostModel(config)).write(
+                sys.stdout
+            )
         elif args.context == "compile":
             config = SwirlValidator().validate_file(args.metadata)
-            with open(args.workflow) as f:
-                code = f.read()
             if args.target in swirlc.compiler.targets:
-                target = swirlc.compiler.targets[args.target](args.outdir)
-                lexer = SWIRLLexer(antlr4.InputStream(code))
-                tokens = antlr4.CommonTokenStream(lexer)
-                tree = SWIRLParser(tokens).workflow()
-                visitor = CompileVisitor(compiler=target, metadata=config)
-                visitor.visit(tree)
+                target = swirlc.compiler.targets[args.target](
+                    args.outdir, fuse_execs=args.fuse_execs, formatting=args.format
+                )
+                visitor = CompileVisitor(
+                    compiler=target,
+                    metadata=config,
+                    optimizer=TraceOptimizer() if args.optimize else None,
+                )
+                visitor.visit(_parse(args.workflow))
             else:
                 raise Exception(f"Target `{args.target}` not supported")
+        elif args.context == "place":
+            config = SwirlValidator().validate_file(args.metadata)
+            visitor = CompileVisitor(compiler=BaseCompiler(), metadata=config)
+            visitor.visit(_parse(args.workflow))
+            translator = PlacementTranslator(visitor.workflow.freeze(), config)
+            _translate(translator, args.outdir)
+            logger.info(
+                f"Placed {len(translator.placement.mapping)} steps: predicted makespan "
+                f"{translator.placement.makespan:.3f}, "
+                f"{translator.placement.transferred_bytes} bytes moved across locations"
+            )
+        elif args.context == "simulate":
+            config = SwirlValidator().validate_file(args.metadata)
+            builder = TraceBuilder()
+            visitor = CompileVisitor(
+                compiler=builder,
+                metadata=config,
+                optimizer=TraceOptimizer() if args.optimize else None,
+            )
+            visitor.visit(_parse(args.workflow))
+            Simulator(builder).simulate(CostModel(config)).write(sys.stdout)
+        elif args.context == "trace-merge":
+            if not os.path.isdir(args.outdir):
+                raise Exception(f"Output directory `{args.outdir}` does not exist")
+            dumps = []
+            for path in args.traces:
+                with open(path) as f:
+                    dumps.append(json.load(f))
+            with open(os.path.join(args.outdir, "trace.json"), "w") as f:
+                json.dump(trace.merge(dumps), f)
+            logger.info(
+                f"Merged {sum(len(dump['spans']) for dump in dumps)} spans from "
+                f"{len(dumps)} locations into {os.path.join(args.outdir, 'trace.json')}"
+            )
         elif args.context == "translate":
             if args.language in swirlc.translator.translator_classes.keys():
                 translator = swirlc.translator.translator_classes[args.language](
                     args.workflow
                 )
-                if args.outdir:
-                    if not os.path.isdir(args.outdir):
-                        raise Exception(
-                            f"Output directory `{args.outdir}` does not exist"
-                        )
-                    with (
-                        open(
-                            os.path.join(args.outdir, "workflow.swirl"), "w"
-                        ) as workflow_output,
-                        open(
-                            os.path.join(args.outdir, "metadata.yml"), "w"
-                        ) as metadata_output,
-                    ):
-                        translator.translate(workflow_output, metadata_output)
-                else:
-                    translator.translate(sys.stdout, sys.stdout)
+                _translate(translator, args.outdir)
             else:
                 raise Exception(
                     f"Translator from `{args.language}` to SWIRL not supported"
@@ -9,6 +9,24 @@ import swirlc.translator
 parser = argparse.ArgumentParser(description="SWIRL command line")
 subparsers = parser.add_subparsers(dest="context")
 
+# Swirl analyze
+analyze_parser = subparsers.add_parser(
+    "analyze",
+    help="Compute the critical path and the slack of each step of a SWIRL workflow",
+)
+analyze_parser.add_argument(
+    "workflow",
+    metavar="SWIRL_FILE",
+    type=str,
+    help="Path to the SWIRL file describing the workflow execution",
+)
+analyze_parser.add_argument(
+    "metadata",
+    metavar="METADATA_FILE",
+    type=str,
+    help="Path to the metadata file. Step runtimes, data sizes and links are used as estimates",
+)
+
 # Swirl compile
 compile_parser = subparsers.add_parser(
     "compile", help="Compile a swirl file into a target workflow execution program"
@@ -37,6 +55,91 @@ compile_parser.add_argument(
     help="Output directory path. It will be create a set of files: `run.sh` and `l*.py`",
     default=os.getcwd(),
 )
+compile_parser.add_argument(
+    "--fuse-execs",
+    action="store_true",
+    help="Run consecutive steps on the same location in a single shell with a shared working directory",
+)
+compile_parser.add_argument(
+    "--format",
+    type=str,
+    default="full",
+    choices=["none", "fast", "full"],
+    help="Format the generated programs with black (`fast` skips its safety check). Default: full",
+)
+compile_parser.add_argument(
+    "--optimize",
+    action="store_true",
+    help="Batch concurrent sends between the same pair of locations, remove duplicate communications and broadcast data sent to many locations",
+)
+
+# Swirl place
+place_parser = subparsers.add_parser(
+    "place",
+    help="Compute a new step-to-location mapping for a SWIRL workflow and emit the resulting SWIRL workflow",
+)
+place_parser.add_argument(
+    "workflow",
+    metavar="SWIRL_FILE",
+    type=str,
+    help="Path to the SWIRL file describing the workflow execution",
+)
+place_parser.add_argument(
+    "metadata",
+    metavar="METADATA_FILE",
+    type=str,
+    help="Path to the metadata file. Step runtimes, data sizes, location cores and links are used as estimates",
+)
+place_parser.add_argument(
+    "--outdir",
+    "-o",
+    type=str,
+    help="Output directory path. It will be create two files: `workflow.swirl` and `metadata.yml`",
+    default=os.getcwd(),
+)
+
+# Swirl simulate
+simulate_parser = subparsers.add_parser(
+    "simulate",
+    help="Predict the makespan, location utilisation and link contention of a SWIRL workflow",
+)
+simulate_parser.add_argument(
+    "workflow",
+    metavar="SWIRL_FILE",
+    type=str,
+    help="Path to the SWIRL file describing the workflow execution",
+)
+simulate_parser.add_argument(
+    "metadata",
+    metavar="METADATA_FILE",
+    type=str,
+    help="Path to the metadata file. Step runtimes, data sizes and links are used as estimates",
+)
+simulate_parser.add_argument(
+    "--optimize",
+    action="store_true",
+    help="Simulate the traces optimised as by the `compile --optimize` command",
+)
+
+# Swirl trace-merge
+trace_merge_parser = subparsers.add_parser(
+    "trace-merge",
+    help="Merge the traces written by each location into a single Chrome trace",
+)
+trace_merge_parser.add_argument(
+    "traces",
+    metavar="TRACE_FILE",
+    type=str,
+    nargs="+",
+    help="Path to the trace files written by the locations executed with the `--trace` option",
+)
+trace_merge_parser.add_argument(
+    "--outdir",
+    "-o",
+    type=str,
+    help="Output directory path. It will be create a `trace.json` file",
+    default=os.getcwd(),
+)
 
 # Swirl translator
 translate_parser = subparsers.add_parser(
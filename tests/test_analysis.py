@@ -0,0 +1,304 @@
+import json
+import math
+import os
+import tempfile
+
+from ruamel.yaml import YAML
+
+from swirlc.analysis.cost import CostModel
+from swirlc.analysis.critical_path import analyze
+from swirlc.analysis.simulator import (
+    Exec,
+    Par,
+    Recv,
+    Send,
+    SendBatch,
+    Seq,
+    Simulator,
+    TraceBuilder,
+)
+from swirlc.core.compiler import BaseCompiler, CompileVisitor
+from swirlc.core.entity import Step
+from swirlc.core.optimizer import TraceOptimizer
+from swirlc.main import _parse, main
+from tests.test_compiler import _EXAMPLES_PATH
+
+
+def _get_metadata():
+    with open(_EXAMPLES_PATH / "example1" / "config.yml") as f:
+        metadata = YAML(typ="safe").load(f)
+    metadata["steps"]["s1"]["runtime"] = 10
+    metadata["steps"]["s2"]["runtime"] = 5
+    metadata["steps"]["s3"]["runtime"] = 2
+    metadata["dependencies"]["d1"]["size"] = 1000
+    metadata["dependencies"]["d2"]["size"] = 100
+    metadata["links"] = [
+        {"src": "ld", "dst": "l1", "latency": 1, "bandwidth": 100},
+        {"latency": 1, "bandwidth": 1000},
+    ]
+    return metadata
+
+
+def test_critical_path():
+    """Test the critical path analysis on the `example1` workflow."""
+    metadata = _get_metadata()
+    visitor = CompileVisitor(compiler=BaseCompiler(), metadata=metadata)
+    visitor.visit(_parse(str(_EXAMPLES_PATH / "example1" / "example1.swirl")))
+    result = analyze(visitor.workflow.freeze(), CostModel(metadata))
+    assert [step.name for step in result.path] == ["s1", "s2"]
+    assert math.isclose(result.makespan, 26)
+    assert math.isclose(result.timings["s2"].earliest_start, 21)
+    assert math.isclose(result.timings["s3"].earliest_start, 11.1)
+    assert math.isclose(result.timings["s3"].slack, 12.9)
+    assert math.isclose(result.timings["s1"].slack, 0)
+
+
+def test_analyze_command(capsys):
+    """Test the `swirlc analyze` command."""
+    with tempfile.TemporaryDirectory() as workdir:
+        metadata_path = os.path.join(workdir, "config.yml")
+        with open(metadata_path, "w") as f:
+            YAML(typ="safe").dump(_get_metadata(), f)
+        assert (
+            main(
+                [
+                    "analyze",
+                    str(_EXAMPLES_PATH / "example1" / "example1.swirl"),
+                    metadata_path,
+                ]
+            )
+            == 0
+        )
+    stdout = capsys.readouterr().out
+    assert "Makespan: 26.000" in stdout
+    assert "Critical path: s1 -> s2" in stdout
+
+
+def test_simulate():
+    """Test the simulator on the `example1` workflow and on a contended link."""
+    metadata = _get_metadata()
+    builder = TraceBuilder()
+    CompileVisitor(compiler=builder, metadata=metadata).visit(
+        _parse(str(_EXAMPLES_PATH / "example1" / "example1.swirl"))
+    )
+    result = Simulator(builder).simulate(CostModel(metadata))
+    assert math.isclose(result.makespan, 26)
+    assert math.isclose(result.get_utilisation("ld"), 10 / 26)
+    assert math.isclose(result.locations["l2"].finish_time, 13.1)
+    assert result.links[("ld", "l1")].bytes == 1000
+    # Two concurrent sends on the same link are serialised
+    metadata = {
+        "version": "v1.0",
+        "steps": {},
+        "locations": {
+            "l1": {"hostname": "127.0.0.1", "port": 8080},
+            "l2": {"hostname": "127.0.0.1", "port": 8081},
+        },
+        "dependencies": {
+            "d1": {"type": "file", "value": "a.txt", "size": 100},
+            "d2": {"type": "file", "value": "b.txt", "size": 100},
+        },
+        "links": [{"latency": 0, "bandwidth": 100}],
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        trace_path = os.path.join(workdir, "workflow.swirl")
+        with open(trace_path, "w") as f:
+            f.write(
+                "<l1, {(p1,d1),(p2,d2)}, send(d1->p1,l1,l2) | send(d2->p2,l1,l2)> |\n"
+                "<l2, {}, recv(p1,l1,l2) | recv(p2,l1,l2)>"
+            )
+        builder = TraceBuilder()
+        CompileVisitor(compiler=builder, metadata=metadata).visit(_parse(trace_path))
+    result = Simulator(builder).simulate(CostModel(metadata))
+    assert math.isclose(result.makespan, 2)
+    assert math.isclose(result.links[("l1", "l2")].wait_time, 1)
+
+
+def test_simulate_broadcast():
+    """Test that the optimizer rewrites a one-to-many send into a binomial tree."""
+    with open(_EXAMPLES_PATH / "example3" / "config.yml") as f:
+        metadata = YAML(typ="safe").load(f)
+    metadata["dependencies"]["d1"]["size"] = 100
+    metadata["links"] = [{"latency": 0, "bandwidth": 100}]
+    builder = TraceBuilder()
+    CompileVisitor(
+        compiler=builder, metadata=metadata, optimizer=TraceOptimizer()
+    ).visit(_parse(str(_EXAMPLES_PATH / "example3" / "example3.swirl")))
+    result = Simulator(builder).simulate(CostModel(metadata))
+    assert sorted(result.links) == [
+        ("l1", "l3"),
+        ("ld", "l1"),
+        ("ld", "l2"),
+        ("ld", "l4"),
+    ]
+    assert math.isclose(result.locations["l3"].finish_time, 2)
+
+
+def test_simulate_send_batch():
+    """Test that a batch of sends starts once all its data are available."""
+    metadata = {
+        "steps": {"s1": {"runtime": 5}},
+        "dependencies": {"d1": {"size": 100}, "d2": {"size": 100}},
+        "links": [{"latency": 0, "bandwidth": 100}],
+    }
+    builder = TraceBuilder()
+    builder.datasets = {"l1": ["p1"]}
+    l1, l2 = Seq(), Seq()
+    l1.children.append(Par())
+    l1.children[0].children.extend(
+        [
+            Exec(Step("s1", "s1"), [], ["p2"]),
+            SendBatch([Send("d1", "p1", "l1", "l2"), Send("d2", "p2", "l1", "l2")]),
+        ]
+    )
+    l2.children.append(Par())
+    l2.children[0].children.extend([Recv("p1", "l1", "l2"), Recv("p2", "l1", "l2")])
+    builder.traces = {"l1": l1, "l2": l2}
+    result = Simulator(builder).simulate(CostModel(metadata))
+    # Both transfers wait for `s1`, and are then served in order on the link
+    assert math.isclose(result.makespan, 7)
+    assert math.isclose(result.links[("l1", "l2")].wait_time, 1)
+
+
+def test_simulate_cores():
+    """Test that concurrent steps do not exceed the cores of their location."""
+    with open(_EXAMPLES_PATH / "example5" / "config.yml") as f:
+        metadata = YAML(typ="safe").load(f)
+    metadata["steps"]["s1"]["runtime"] = 1
+    metadata["steps"]["s2"]["runtime"] = 1
+    metadata["steps"]["s3"]["runtime"] = 2
+    builder = TraceBuilder()
+    CompileVisitor(compiler=builder, metadata=metadata).visit(
+        _parse(str(_EXAMPLES_PATH / "example5" / "example5.swirl"))
+    )
+    result = Simulator(builder).simulate(CostModel(metadata))
+    # `s3` needs both cores, so it waits for `s1` and `s2` to terminate
+    assert math.isclose(result.makespan, 3)
+    assert math.isclose(result.get_utilisation("l1"), 1)
+
+
+def test_simulate_duplicates():
+    """Test that only communications duplicated on both ends are removed."""
+    metadata = {
+        "version": "v1.0",
+        "steps": {},
+        "locations": {
+            "l1": {"hostname": "127.0.0.1", "port": 8080},
+            "l2": {"hostname": "127.0.0.1", "port": 8081},
+        },
+        "dependencies": {
+            "d1": {"type": "file", "value": "a.txt", "size": 100},
+            "d2": {"type": "file", "value": "b.txt", "size": 100},
+        },
+    }
+    for data, transfers in ((("d1", "d1"), 1), (("d1", "d2"), 2)):
+        with tempfile.TemporaryDirectory() as workdir:
+            trace_path = os.path.join(workdir, "workflow.swirl")
+            with open(trace_path, "w") as f:
+                f.write(
+                    "<l1, {(p1,d1),(p1,d2)}, "
+                    f"send({data[0]}->p1,l1,l2) | send({data[1]}->p1,l1,l2)> |\n"
+                    "<l2, {}, recv(p1,l1,l2) | recv(p1,l1,l2)>"
+                )
+            builder = TraceBuilder()
+            CompileVisitor(
+                compiler=builder,
+                metadata=metadata,
+                optimizer=TraceOptimizer(batch_sends=False),
+            ).visit(_parse(trace_path))
+        result = Simulator(builder).simulate(CostModel(metadata))
+        assert result.links[("l1", "l2")].transfers == transfers
+
+
+def test_place_command():
+    """Test the `swirlc place` command on the `example1` workflow."""
+    with tempfile.TemporaryDirectory() as workdir:
+        metadata_path = os.path.join(workdir, "config.yml")
+        with open(metadata_path, "w") as f:
+            YAML(typ="safe").dump(_get_metadata(), f)
+        outdir = os.path.join(workdir, "placed")
+        os.mkdir(outdir)
+        assert (
+            main(
+                [
+                    "place",
+                    str(_EXAMPLES_PATH / "example1" / "example1.swirl"),
+                    metadata_path,
+                    "--outdir",
+                    outdir,
+                ]
+            )
+            == 0
+        )
+        # `s2` is co-located with `s1` to avoid the slow `ld->l1` link
+        with open(os.path.join(outdir, "workflow.swirl")) as f:
+            trace = f.read()
+        assert "exec(s2,{(p2,d1)}->{},{ld})" in trace
+        assert "<l1," not in trace
+        # Placed workflows preserve the estimates and can be simulated and compiled
+        with open(os.path.join(outdir, "metadata.yml")) as f:
+            metadata = YAML(typ="safe").load(f)
+        assert metadata["steps"]["s1"]["runtime"] == 10
+        builder = TraceBuilder()
+        CompileVisitor(compiler=builder, metadata=metadata).visit(
+            _parse(os.path.join(outdir, "workflow.swirl"))
+        )
+        result = Simulator(builder).simulate(CostModel(metadata))
+        assert math.isclose(result.makespan, 15)
+        assert (
+            main(
+                [
+                    "compile",
+                    os.path.join(outdir, "workflow.swirl"),
+                    os.path.join(outdir, "metadata.yml"),
+                    "--outdir",
+                    outdir,
+                ]
+            )
+            == 0
+        )
+
+
+def test_trace_merge_command():
+    """Test that the `swirlc trace-merge` command aligns the spans of all locations."""
+    dumps = {
+        "l1": [
+            ("exec", "s1", 1000, 500, "MainThread"),
+            ("send", "p1 -> l2", 1500, 10, "t1"),
+        ],
+        "l2": [("recv", "p1 <- l1", 1200, 320, "MainThread")],
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        paths = []
+        for location, spans in dumps.items():
+            paths.append(os.path.join(workdir, f"{location}.trace.json"))
+            with open(paths[-1], "w") as f:
+                json.dump(
+                    {
+                        "location": location,
+                        "hostname": "localhost",
+                        "spans": [
+                            {
+                                "cat": cat,
+                                "name": name,
+                                "ts": ts,
+                                "dur": dur,
+                                "thread": thread,
+                                "args": {},
+                            }
+                            for cat, name, ts, dur, thread in spans
+                        ],
+                    },
+                    f,
+                )
+        assert main(["trace-merge", *paths, "--outdir", workdir]) == 0
+        with open(os.path.join(workdir, "trace.json")) as f:
+            events = json.load(f)["traceEvents"]
+    spans = {e["name"]: e for e in events if e["ph"] == "X"}
+    assert spans["s1"]["ts"] == 0 and spans["p1 <- l1"]["ts"] == 200
+    assert spans["s1"]["pid"] == spans["p1 -> l2"]["pid"] != spans["p1 <- l1"]["pid"]
+    assert spans["s1"]["tid"] != spans["p1 -> l2"]["tid"]
+    assert {e["args"]["name"] for e in events if e["name"] == "process_name"} == {
+        "l1 (localhost)",
+        "l2 (localhost)",
+    }
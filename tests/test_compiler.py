@@ -1,6 +1,9 @@
 from __future__ import annotations
 
 import contextlib
+import importlib.util
+import json
+import logging
 import os
 import pathlib
 import re
@@ -8,8 +11,12 @@ import shutil
 import signal
 import socket
 import subprocess
+import sys
 import tempfile
-from collections.abc import MutableSequence
+import time
+import urllib.request
+from collections.abc import MutableMapping, MutableSequence
+from typing import Any
 
 from ruamel.yaml import YAML
 
@@ -36,11 +43,22 @@ def _reserve_port(reserved_sockets: MutableSequence[socket.socket]) -> int:
     return tcp.getsockname()[1]
 
 
-def _compile(trace_file: str, config_file: str, outdir: str | None = None) -> None:
+def _compile(
+    trace_file: str,
+    config_file: str,
+    outdir: str | None = None,
+    extra_args: MutableSequence[str] | None = None,
+) -> None:
     with contextlib.ExitStack() as stack:
         if outdir is None:
             outdir = stack.enter_context(tempfile.TemporaryDirectory())
-        assert main(["compile", trace_file, config_file, "--outdir", outdir]) == 0
+        assert (
+            main(
+                ["compile", trace_file, config_file, "--outdir", outdir]
+                + (extra_args or [])
+            )
+            == 0
+        )
 
 
 def _compile_and_run(
@@ -50,8 +68,13 @@ def _compile_and_run(
     expected_stdout: str | None = None,
     expected_stderr_patterns: MutableSequence[str] | None = None,
     extra_files_to_copy: MutableSequence[str] | None = None,
+    extra_args: MutableSequence[str] | None = None,
+    config_filename: str = "config.yml",
+    location_settings: MutableMapping[str, Any] | None = None,
+    resume: bool = False,
+    run_args: MutableSequence[str] | None = None,
     timeout: int = 15,
-) -> None:
+) -> str:
     example_dir = _EXAMPLES_PATH / example_name
 
     with tempfile.TemporaryDirectory() as workdir:
@@ -59,15 +82,17 @@ def _compile_and_run(
 
         with sockets_contextmanager() as reserved_sockets:
             _update_config_metadata(
-                src_path=str(example_dir / "config.yml"),
+                src_path=str(example_dir / config_filename),
                 dst_path=config_file,
                 reserved_sockets=reserved_sockets,
+                location_settings=location_settings,
             )
 
             _compile(
                 trace_file=str(example_dir / trace_filename),
                 config_file=config_file,
                 outdir=workdir,
+                extra_args=extra_args,
             )
             for file in expected_generated_files:
                 assert os.path.exists(
@@ -79,23 +104,27 @@ def _compile_and_run(
                         str(example_dir / file),
                         os.path.join(workdir, file),
                     )
-        process = subprocess.Popen(
-            ["./run.sh"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            cwd=workdir,
-        )
-        try:
-            stdout, stderr = process.communicate(timeout=timeout)
-        except subprocess.TimeoutExpired:
-            process.send_signal(signal.SIGINT)
-            stdout, stderr = process.communicate()
-            raise AssertionError(
-                f"The compiled program timed out (SIGINT sent). stdout: {stdout}\nstderr: {stderr}"
+        # With `resume`, the workflow is run again in the same directory and the
+        # expected output is checked against the resumed run
+        run_args = ["./run.sh", *(run_args or [])]
+        for args in [run_args] + ([run_args + ["--resume"]] if resume else []):
+            process = subprocess.Popen(
+                args,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                cwd=workdir,
             )
+            try:
+                stdout, stderr = process.communicate(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                process.send_signal(signal.SIGINT)
+                stdout, stderr = process.communicate()
+                raise AssertionError(
+                    f"The compiled program timed out (SIGINT sent). stdout: {stdout}\nstderr: {stderr}"
+                )
 
-        assert process.returncode == 0, f"Program crashed! Stderr: {stderr}"
+            assert process.returncode == 0, f"Program crashed! Stderr: {stderr}"
         if expected_stdout is not None:
             assert (
                 stdout.strip() == expected_stdout
@@ -107,14 +136,19 @@ def _compile_and_run(
                 assert (
                     match
                 ), f"Missing expected log: '{formatted_pattern}'\n\nFull stderr was:\n{stderr}"
+        return stderr
 
 
 def _update_config_metadata(
-    src_path: str, dst_path: str, reserved_sockets: MutableSequence[socket.socket]
+    src_path: str,
+    dst_path: str,
+    reserved_sockets: MutableSequence[socket.socket],
+    location_settings: MutableMapping[str, Any] | None = None,
 ) -> None:
     """
     Copy the metadata from the source to a new working directory.
-    In the copied metadata, an available port is assigned to each location.
+    In the copied metadata, an available port is assigned to each location,
+    and the optional `location_settings` are added to each location.
 
     Important: The caller is responsible for iterating through `reserved_sockets`
     and closing them to free the ports once the setup is complete.
@@ -125,6 +159,7 @@ def _update_config_metadata(
 
     for _, settings in config_data["locations"].items():
         settings["port"] = _reserve_port(reserved_sockets)
+        settings.update(location_settings or {})
 
     assert not os.path.exists(dst_path), f"Destination path {dst_path} already exists"
 
@@ -143,7 +178,13 @@ def test_example2() -> None:
     _compile_and_run(
         example_name="example2",
         trace_filename="example2.swirl",
-        expected_generated_files=["run.sh", "ld.py", "l1.py", "l2.py"],
+        expected_generated_files=[
+            "run.sh",
+            "swirlc_runtime.py",
+            "ld.py",
+            "l1.py",
+            "l2.py",
+        ],
         extra_files_to_copy=["world.txt"],
         expected_stdout="Workflow execution terminated",
         expected_stderr_patterns=[
@@ -152,3 +193,751 @@ def test_example2() -> None:
             r"Step ThirdStep-s3 has not an output port\. Result: 'Hello'",
         ],
     )
+
+
+def test_example2_cache() -> None:
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for target in ("default", "asyncio"):
+            for hit in (False, True):
+                _compile_and_run(
+                    example_name="example2",
+                    trace_filename="example2.swirl",
+                    expected_generated_files=["run.sh", "ld.py", "l1.py", "l2.py"],
+                    extra_files_to_copy=["world.txt"],
+                    extra_args=["--target", target],
+                    location_settings={"cache": {"path": cache_dir}},
+                    expected_stdout="Workflow execution terminated",
+                    expected_stderr_patterns=(
+                        [
+                            r"Step FirstStep-s1 restored from cache\. Result: '{workdir}/.*/hello\.txt'",
+                            r"Step SecondStep-s2 restored from cache\. Result: 'Hello'",
+                            r"Step ThirdStep-s3 restored from cache\. Result: 'Hello'",
+                        ]
+                        if hit
+                        else [
+                            r"Step SecondStep-s2 has not an output port\. Result: 'Hello'"
+                        ]
+                    ),
+                )
+            shutil.rmtree(cache_dir)
+            os.mkdir(cache_dir)
+
+
+def test_example2_cache_eviction() -> None:
+    # With a tiny maximum size, all the entries and file digests are evicted
+    with tempfile.TemporaryDirectory() as cache_dir:
+        _compile_and_run(
+            example_name="example2",
+            trace_filename="example2.swirl",
+            expected_generated_files=["run.sh", "ld.py", "l1.py", "l2.py"],
+            extra_files_to_copy=["world.txt"],
+            location_settings={"cache": {"path": cache_dir, "maxSize": 1}},
+            expected_stdout="Workflow execution terminated",
+        )
+        assert os.listdir(os.path.join(cache_dir, "entries")) == []
+        assert os.listdir(os.path.join(cache_dir, "digests")) == []
+
+
+def test_example2_resume() -> None:
+    for target in ("default", "asyncio"):
+        _compile_and_run(
+            example_name="example2",
+            trace_filename="example2.swirl",
+            expected_generated_files=["run.sh", "ld.py", "l1.py", "l2.py"],
+            extra_files_to_copy=["world.txt"],
+            extra_args=["--target", target],
+            resume=True,
+            expected_stdout="Workflow execution terminated",
+            expected_stderr_patterns=[
+                r"Step FirstStep-s1 completed in a previous run",
+                r"Step SecondStep-s2 completed in a previous run",
+                r"Step ThirdStep-s3 completed in a previous run",
+            ],
+        )
+
+
+def test_example2_resume_failure() -> None:
+    example_dir = _EXAMPLES_PATH / "example2"
+    for target in ("default", "asyncio"):
+        with tempfile.TemporaryDirectory() as workdir:
+            yaml = YAML(typ="safe")
+            with open(example_dir / "config.yml") as f:
+                config = yaml.load(f)
+            # Step s2 fails until the marker file is created
+            marker = os.path.join(workdir, "marker")
+            config["steps"]["s2"]["command"] = f"test -e {marker} && cat"
+            with open(os.path.join(workdir, "src.yml"), "w") as f:
+                yaml.dump(config, f)
+            config_file = os.path.join(workdir, "config.yml")
+            with sockets_contextmanager() as reserved_sockets:
+                _update_config_metadata(
+                    os.path.join(workdir, "src.yml"), config_file, reserved_sockets
+                )
+                _compile(
+                    str(example_dir / "example2.swirl"),
+                    config_file,
+                    workdir,
+                    ["--target", target],
+                )
+            shutil.copyfile(
+                example_dir / "world.txt", os.path.join(workdir, "world.txt")
+            )
+            process = subprocess.run(
+                ["./run.sh"], capture_output=True, text=True, cwd=workdir, timeout=15
+            )
+            assert process.returncode != 0
+            assert "Step SecondStep-s2 failed" in process.stderr
+            pathlib.Path(marker).touch()
+            process = subprocess.run(
+                ["./run.sh", "--resume", "--trace"],
+                capture_output=True,
+                text=True,
+                cwd=workdir,
+                timeout=15,
+            )
+            assert process.returncode == 0, f"Program crashed! Stderr: {process.stderr}"
+            # Only the failed step is executed again
+            for step in ("FirstStep-s1", "ThirdStep-s3"):
+                assert f"Step {step} completed in a previous run" in process.stderr
+            assert (
+                "Step SecondStep-s2 completed in a previous run" not in process.stderr
+            )
+            assert "Step SecondStep-s2 has not an output port" in process.stderr
+            # Transfers are not performed again, as receivers already hold the data
+            with open(os.path.join(workdir, "ld.trace.json")) as f:
+                sends = [s for s in json.load(f)["spans"] if s["cat"] == "send"]
+            assert {s["args"]["dst"] for s in sends} == {"l1", "l2"}
+            assert all(s["args"].get("skipped") for s in sends)
+
+
+def test_example2_trace() -> None:
+    for target in ("default", "asyncio"):
+        _compile_and_run(
+            example_name="example2",
+            trace_filename="example2.swirl",
+            expected_generated_files=["run.sh", "ld.py", "l1.py", "l2.py"],
+            extra_files_to_copy=["world.txt"],
+            extra_args=["--target", target],
+            run_args=["--trace"],
+            expected_stdout="Workflow execution terminated",
+            expected_stderr_patterns=[
+                r"Trace written to {workdir}/ld\.trace\.json",
+                r"Trace written to {workdir}/l1\.trace\.json",
+                r"Trace written to {workdir}/l2\.trace\.json",
+            ],
+        )
+
+
+def test_example2_metrics() -> None:
+    for target in ("default", "asyncio"):
+        _compile_and_run(
+            example_name="example2",
+            trace_filename="example2.swirl",
+            expected_generated_files=["run.sh", "ld.py", "l1.py", "l2.py"],
+            extra_files_to_copy=["world.txt"],
+            extra_args=["--target", target],
+            location_settings={"metrics": {"port": 0}},
+            expected_stdout="Workflow execution terminated",
+            expected_stderr_patterns=[
+                r"l1\.py INFO     Metrics exposed on http://127\.0\.0\.1:\d+/metrics",
+                r"Step SecondStep-s2 has not an output port\. Result: 'Hello'",
+            ],
+        )
+
+
+def test_metrics_endpoint() -> None:
+    """Scrape the metrics endpoint of a generated program loaded in this process."""
+    logger = logging.getLogger("swirlc")
+    handlers, level, propagate = list(logger.handlers), logger.level, logger.propagate
+    with tempfile.TemporaryDirectory() as workdir:
+        config_file = os.path.join(workdir, "config.yml")
+        with sockets_contextmanager() as reserved_sockets:
+            _update_config_metadata(
+                src_path=str(_EXAMPLES_PATH / "example2" / "config.yml"),
+                dst_path=config_file,
+                reserved_sockets=reserved_sockets,
+                location_settings={"metrics": {"port": 0}},
+            )
+        _compile(
+            str(_EXAMPLES_PATH / "example2" / "example2.swirl"), config_file, workdir
+        )
+        spec = importlib.util.spec_from_file_location(
+            "l1", os.path.join(workdir, "l1.py")
+        )
+        program = importlib.util.module_from_spec(spec)
+        sys.path.insert(0, workdir)
+        try:
+            spec.loader.exec_module(program)
+        finally:
+            sys.path.remove(workdir)
+            sys.modules.pop("swirlc_runtime", None)
+        server = program._serve_metrics(0)
+        try:
+            program.metrics.add("swirl_sent_bytes_total", 10, peer="l2")
+            program.metrics.add("swirl_sent_bytes_total", 5, peer="l2")
+            program.metrics.add("swirl_steps_running", 1)
+            with urllib.request.urlopen(
+                f"http://127.0.0.1:{server.server_address[1]}/metrics"
+            ) as response:
+                assert response.headers["Content-Type"].startswith("text/plain")
+                lines = response.read().decode("utf-8").splitlines()
+        finally:
+            server.shutdown()
+            server.server_close()
+            os.close(program.wakeup_r)
+            os.close(program.wakeup_w)
+            logger.handlers, logger.propagate = handlers, propagate
+            logger.setLevel(level)
+    assert "# TYPE swirl_sent_bytes_total counter" in lines
+    assert 'swirl_sent_bytes_total{peer="l2"} 15' in lines
+    assert "swirl_steps_running 1" in lines
+    assert any(line.startswith("swirl_active_threads ") for line in lines)
+
+
+def test_accept_stop() -> None:
+    """The accepting thread of a generated program returns as soon as it is stopped."""
+    logger = logging.getLogger("swirlc")
+    handlers, level, propagate = list(logger.handlers), logger.level, logger.propagate
+    with tempfile.TemporaryDirectory() as workdir:
+        config_file = os.path.join(workdir, "config.yml")
+        with sockets_contextmanager() as reserved_sockets:
+            _update_config_metadata(
+                src_path=str(_EXAMPLES_PATH / "example2" / "config.yml"),
+                dst_path=config_file,
+                reserved_sockets=reserved_sockets,
+            )
+            _compile(
+                str(_EXAMPLES_PATH / "example2" / "example2.swirl"),
+                config_file,
+                workdir,
+            )
+        spec = importlib.util.spec_from_file_location(
+            "l1", os.path.join(workdir, "l1.py")
+        )
+        program = importlib.util.module_from_spec(spec)
+        sys.path.insert(0, workdir)
+        try:
+            spec.loader.exec_module(program)
+        finally:
+            sys.path.remove(workdir)
+            sys.modules.pop("swirlc_runtime", None)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(("127.0.0.1", 0))
+        sock.listen()
+        try:
+            thread = program._thread(program._accept, sock)
+            time.sleep(0.1)
+            assert thread.is_alive()
+            # No connection ever arrives: only the wakeup pipe can unblock the selector
+            program._stop()
+            thread.join(timeout=1)
+            assert not thread.is_alive()
+            assert sock.fileno() == -1
+        finally:
+            sock.close()
+            os.close(program.wakeup_r)
+            os.close(program.wakeup_w)
+            logger.handlers, logger.propagate = handlers, propagate
+            logger.setLevel(level)
+
+
+def test_late_peer() -> None:
+    """Senders retry with backoff until their peer starts listening."""
+    example_dir = _EXAMPLES_PATH / "example2"
+    for target in ("default", "asyncio"):
+        with tempfile.TemporaryDirectory() as workdir:
+            config_file = os.path.join(workdir, "config.yml")
+            with sockets_contextmanager() as reserved_sockets:
+                _update_config_metadata(
+                    str(example_dir / "config.yml"), config_file, reserved_sockets
+                )
+                _compile(
+                    str(example_dir / "example2.swirl"),
+                    config_file,
+                    workdir,
+                    ["--target", target],
+                )
+            shutil.copyfile(
+                example_dir / "world.txt", os.path.join(workdir, "world.txt")
+            )
+            processes = {}
+            try:
+                for location in ("ld", "l2", "l1"):
+                    if location == "l1":
+                        # Location ld sends its data to l1 before it starts
+                        time.sleep(2)
+                        assert processes["ld"].poll() is None
+                    processes[location] = subprocess.Popen(
+                        [sys.executable, f"{location}.py"],
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.PIPE,
+                        text=True,
+                        cwd=workdir,
+                    )
+                for location, process in processes.items():
+                    _, stderr = process.communicate(timeout=15)
+                    assert (
+                        process.returncode == 0
+                    ), f"Location {location} crashed! Stderr: {stderr}"
+            finally:
+                for process in processes.values():
+                    process.kill()
+                    process.communicate()
+            assert "Step SecondStep-s2 has not an output port" in stderr
+
+
+def test_runtime_version() -> None:
+    """Location programs refuse a runtime module generated by another compilation."""
+    with tempfile.TemporaryDirectory() as workdir:
+        _compile(
+            str(_EXAMPLES_PATH / "example2" / "example2.swirl"),
+            str(_EXAMPLES_PATH / "example2" / "config.yml"),
+            workdir,
+        )
+        with open(os.path.join(workdir, "swirlc_runtime.py")) as f:
+            runtime = f.read()
+        assert "def _exec(" in runtime
+        with open(os.path.join(workdir, "l1.py")) as f:
+            assert "def _exec(" not in f.read()
+        with open(os.path.join(workdir, "swirlc_runtime.py"), "w") as f:
+            f.write(re.sub(r'RUNTIME_VERSION = ".*"', 'RUNTIME_VERSION = "0"', runtime))
+        result = subprocess.run(
+            [sys.executable, "l1.py"], capture_output=True, text=True, cwd=workdir
+        )
+        assert result.returncode != 0
+        assert "Location l1 requires the SWIRL runtime" in result.stderr
+
+
+def test_unix_socket_dir() -> None:
+    """Each compilation places the Unix domain sockets of its locations in its own directory."""
+    for target in ("default", "asyncio"):
+        with tempfile.TemporaryDirectory() as workdir:
+            config_file = os.path.join(workdir, "config.yml")
+            socket_dirs = []
+            with sockets_contextmanager() as reserved_sockets:
+                _update_config_metadata(
+                    src_path=str(_EXAMPLES_PATH / "example2" / "config.yml"),
+                    dst_path=config_file,
+                    reserved_sockets=reserved_sockets,
+                )
+                for outdir in ("first", "second"):
+                    os.mkdir(os.path.join(workdir, outdir))
+                    _compile(
+                        str(_EXAMPLES_PATH / "example2" / "example2.swirl"),
+                        config_file,
+                        os.path.join(workdir, outdir),
+                        ["--target", target],
+                    )
+                    with open(os.path.join(workdir, outdir, "l1.py")) as f:
+                        paths = re.findall(r"\"(/tmp/swirlc-[^\"]*)\"", f.read())
+                    socket_dirs.append({os.path.dirname(path) for path in paths})
+            assert len(socket_dirs[0]) == 1
+            assert socket_dirs[0] != socket_dirs[1]
+            # The directory is removed once all the colocated locations terminate
+            shutil.copyfile(
+                str(_EXAMPLES_PATH / "example2" / "world.txt"),
+                os.path.join(workdir, "first", "world.txt"),
+            )
+            result = subprocess.run(
+                ["./run.sh"],
+                capture_output=True,
+                text=True,
+                cwd=os.path.join(workdir, "first"),
+                timeout=15,
+            )
+            assert result.returncode == 0, result.stderr
+            assert not os.path.exists(socket_dirs[0].pop())
+
+
+def test_format() -> None:
+    """Test that unformatted and formatted programs run, and `none` never imports black."""
+    for formatting in ("none", "fast", "full"):
+        _compile_and_run(
+            example_name="example2",
+            trace_filename="example2.swirl",
+            expected_generated_files=["run.sh", "ld.py", "l1.py", "l2.py"],
+            extra_files_to_copy=["world.txt"],
+            extra_args=["--format", formatting],
+            expected_stdout="Workflow execution terminated",
+            expected_stderr_patterns=[
+                r"Step SecondStep-s2 has not an output port\. Result: 'Hello'"
+            ],
+        )
+    with tempfile.TemporaryDirectory() as workdir:
+        result = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import sys; from swirlc.main import main; "
+                f"main(['compile', {str(_EXAMPLES_PATH / 'example2' / 'example2.swirl')!r}, "
+                f"{str(_EXAMPLES_PATH / 'example2' / 'config.yml')!r}, "
+                f"'--outdir', {workdir!r}, '--format', 'none']); "
+                "print('black' in sys.modules)",
+            ],
+            capture_output=True,
+            text=True,
+        )
+        assert result.stdout.strip() == "False", result.stderr
+
+
+def test_example2_stdout() -> None:
+    _compile_and_run(
+        example_name="example2",
+        trace_filename="example2.swirl",
+        config_filename="config-stdout.yml",
+        expected_generated_files=["run.sh", "ld.py", "l1.py", "l2.py"],
+        extra_files_to_copy=["world.txt"],
+        expected_stdout="Workflow execution terminated",
+        expected_stderr_patterns=[
+            r"Step FirstStep-s1 result: 'Hello'",
+            r"Step SecondStep-s2 has not an output port\. Result: 'Hello'",
+            r"Step ThirdStep-s3 has not an output port\. Result: 'Hello'",
+        ],
+    )
+
+
+def test_example2_batch() -> None:
+    _compile_and_run(
+        example_name="example2",
+        trace_filename="example2-batch.swirl",
+        expected_generated_files=["run.sh", "ld.py", "l1.py", "l2.py"],
+        extra_files_to_copy=["world.txt"],
+        extra_args=["--optimize"],
+        expected_stdout="Workflow execution terminated",
+        expected_stderr_patterns=[
+            r"ld\.py .* Sent data for port p1 to location l1",
+            r"l1\.py .* Received data for port p2 from location ld",
+            r"Step SecondStep-s2 has not an output port\. Result: 'Hello'",
+            r"Step ThirdStep-s3 has not an output port\. Result: 'Hello'",
+        ],
+    )
+
+
+def test_example2_batch_chain() -> None:
+    # The send of p2 cannot be batched with the send of p1, because l2 needs p1 to
+    # produce the input of the step which writes p2
+    _compile_and_run(
+        example_name="example2",
+        trace_filename="example2-batch-chain.swirl",
+        config_filename="config-batch-chain.yml",
+        expected_generated_files=["run.sh", "l1.py", "l2.py"],
+        extra_files_to_copy=["world.txt"],
+        extra_args=["--optimize"],
+        expected_stdout="Workflow execution terminated",
+        expected_stderr_patterns=[
+            r"l1\.py .* Sent data for port p2 to location l2",
+            r"Step ThirdStep-s3 has not an output port\. Result: 'Hello'",
+        ],
+    )
+
+
+def test_example2_duplicates() -> None:
+    # Duplicate communications are removed, but l1 must still wait for the remaining
+    # `recv` before terminating its trace
+    _compile_and_run(
+        example_name="example2",
+        trace_filename="example2-duplicates.swirl",
+        expected_generated_files=["run.sh", "ld.py", "l1.py"],
+        extra_files_to_copy=["world.txt"],
+        extra_args=["--optimize"],
+        expected_stdout="Workflow execution terminated",
+        expected_stderr_patterns=[
+            r"l1\.py .* Received data for port p2 from location ld[\s\S]*l1\.py .* Terminated trace",
+        ],
+    )
+
+
+def test_example2_fusion() -> None:
+    _compile_and_run(
+        example_name="example2",
+        trace_filename="example2-fusion.swirl",
+        expected_generated_files=["run.sh", "ld.py", "l1.py", "l2.py"],
+        extra_files_to_copy=["world.txt"],
+        extra_args=["--fuse-execs"],
+        expected_stdout="Workflow execution terminated",
+        expected_stderr_patterns=[
+            r"ld\.py .* Step FirstStep-s1 result file: '{workdir}/exec_s1_.*/hello\.txt'",
+            r"ld\.py .* Step SecondStep-s2 has not an output port\. Result: 'Hello'",
+            r"ld\.py .* Step ThirdStep-s3 has not an output port\. Result: 'Hello'",
+            r"l1\.py .* Step SecondStep-s2 has not an output port\. Result: 'Hello'",
+            r"l2\.py .* Step ThirdStep-s3 has not an output port\. Result: 'Hello'",
+        ],
+    )
+
+
+def test_example2_fusion_stdout() -> None:
+    # Fused steps receive the same arguments as unfused ones, so the stdout of s1 is
+    # split into words in both cases
+    results = []
+    for extra_args in ([], ["--fuse-execs"]):
+        stderr = _compile_and_run(
+            example_name="example2",
+            trace_filename="example2-fusion.swirl",
+            config_filename="config-fusion.yml",
+            expected_generated_files=["run.sh", "ld.py", "l1.py", "l2.py"],
+            extra_files_to_copy=["hello-world.txt"],
+            extra_args=extra_args,
+            expected_stdout="Workflow execution terminated",
+            expected_stderr_patterns=[
+                r"ld\.py .* Step SecondStep-s2 has not an output port\. Result: 'Hello World'",
+            ],
+        )
+        results.append(sorted(re.findall(r"\S+\.py .* (Step .* Result: .*)", stderr)))
+    assert results[0] == results[1]
+
+
+def test_example2_fusion_roundtrip() -> None:
+    # The second fused step waits for data computed by another location from the
+    # output of the first one, which must be published before the sequence terminates
+    for extra_args in ([], ["--fuse-execs"]):
+        _compile_and_run(
+            example_name="example2",
+            trace_filename="example2-fusion-roundtrip.swirl",
+            config_filename="config-fusion-roundtrip.yml",
+            expected_generated_files=["run.sh", "l1.py", "l2.py"],
+            extra_files_to_copy=["world.txt"],
+            extra_args=extra_args,
+            expected_stdout="Workflow execution terminated",
+            expected_stderr_patterns=[
+                r"l1\.py .* Step ThirdStep-s3 has not an output port\. Result: 'Hello'",
+            ],
+        )
+
+
+def test_example3_broadcast() -> None:
+    _compile_and_run(
+        example_name="example3",
+        trace_filename="example3.swirl",
+        expected_generated_files=[
+            "run.sh",
+            "ld.py",
+            "l1.py",
+            "l2.py",
+            "l3.py",
+            "l4.py",
+        ],
+        extra_files_to_copy=["world.txt"],
+        extra_args=["--optimize"],
+        expected_stdout="Workflow execution terminated",
+        expected_stderr_patterns=[
+            r"ld\.py .* Opened channel to location l4 with codec zlib",
+            r"l2\.py .* Linked data for port p1 from location ld \(hardlink\)",
+            r"l1\.py .* Sent data for port p1 to location l3",
+            r"l3\.py .* Received data for port p1 from location l1",
+        ]
+        + [
+            rf"Step Step{i}-s{i} has not an output port\. Result: 'Hello'"
+            for i in range(1, 5)
+        ],
+    )
+
+
+def test_no_optimize() -> None:
+    """Traces are compiled as they are written unless `--optimize` is given."""
+    for extra_args, forwarded in (([], False), (["--optimize"], True)):
+        with tempfile.TemporaryDirectory() as workdir:
+            _compile(
+                str(_EXAMPLES_PATH / "example3" / "example3.swirl"),
+                str(_EXAMPLES_PATH / "example3" / "config.yml"),
+                workdir,
+                extra_args,
+            )
+            with open(os.path.join(workdir, "l1.py")) as f:
+                assert ("_forward," in f.read()) == forwarded
+
+
+def test_example4_directory() -> None:
+    _compile_and_run(
+        example_name="example4",
+        trace_filename="example4.swirl",
+        expected_generated_files=["run.sh", "l1.py", "l2.py"],
+        expected_stdout="Workflow execution terminated",
+        expected_stderr_patterns=[
+            r"l1\.py .* Opened channel to location l2 with codec zlib",
+            r"l2\.py .* Received data for port p1 from location l1",
+            r"Step ReadTree-s2 has not an output port\. Result: 'Hello\n750'",
+        ],
+    )
+
+
+def test_example3_asyncio() -> None:
+    _compile_and_run(
+        example_name="example3",
+        trace_filename="example3.swirl",
+        expected_generated_files=[
+            "run.sh",
+            "ld.py",
+            "l1.py",
+            "l2.py",
+            "l3.py",
+            "l4.py",
+        ],
+        extra_files_to_copy=["world.txt"],
+        extra_args=["--target", "asyncio", "--optimize"],
+        expected_stdout="Workflow execution terminated",
+        expected_stderr_patterns=[
+            r"ld\.py .* Opened channel to location l4 with codec zlib",
+            r"l2\.py .* Linked data for port p1 from location ld \(hardlink\)",
+            r"l1\.py .* Sent data for port p1 to location l3",
+            r"l3\.py .* Received data for port p1 from location l1",
+        ]
+        + [
+            rf"Step Step{i}-s{i} has not an output port\. Result: 'Hello'"
+            for i in range(1, 5)
+        ],
+    )
+
+
+def test_example4_asyncio() -> None:
+    _compile_and_run(
+        example_name="example4",
+        trace_filename="example4.swirl",
+        expected_generated_files=["run.sh", "l1.py", "l2.py"],
+        extra_args=["--target", "asyncio"],
+        expected_stdout="Workflow execution terminated",
+        expected_stderr_patterns=[
+            r"l1\.py .* Opened channel to location l2 with codec zlib",
+            r"l2\.py .* Received data for port p1 from location l1",
+            r"Step ReadTree-s2 has not an output port\. Result: 'Hello\n750'",
+        ],
+    )
+
+
+def test_example2_asyncio_stdout() -> None:
+    """Colocated locations hand off `stdout` data through shared memory."""
+    _compile_and_run(
+        example_name="example2",
+        trace_filename="example2.swirl",
+        config_filename="config-stdout.yml",
+        expected_generated_files=["run.sh", "ld.py", "l1.py", "l2.py"],
+        extra_files_to_copy=["world.txt"],
+        extra_args=["--target", "asyncio"],
+        expected_stdout="Workflow execution terminated",
+        expected_stderr_patterns=[
+            r"Step SecondStep-s2 has not an output port\. Result: 'Hello'",
+            r"Step ThirdStep-s3 has not an output port\. Result: 'Hello'",
+        ],
+    )
+
+
+def test_example2_empty_file() -> None:
+    for target in ("default", "asyncio"):
+        _compile_and_run(
+            example_name="example2",
+            trace_filename="example2.swirl",
+            config_filename="config-empty.yml",
+            expected_generated_files=["run.sh", "ld.py", "l1.py", "l2.py"],
+            extra_files_to_copy=["world.txt"],
+            extra_args=["--target", target],
+            expected_stdout="Workflow execution terminated",
+            expected_stderr_patterns=[
+                r"Step SecondStep-s2 has not an output port\. Result: ''",
+                r"Step ThirdStep-s3 has not an output port\. Result: ''",
+            ],
+        )
+
+
+def test_example2_broken_channel() -> None:
+    example_dir = _EXAMPLES_PATH / "example2"
+    for target in ("default", "asyncio"):
+        with tempfile.TemporaryDirectory() as workdir:
+            config_file = os.path.join(workdir, "config.yml")
+            with sockets_contextmanager() as reserved_sockets:
+                _update_config_metadata(
+                    str(example_dir / "config.yml"), config_file, reserved_sockets
+                )
+                _compile(
+                    str(example_dir / "example2.swirl"),
+                    config_file,
+                    workdir,
+                    ["--target", target],
+                )
+            with open(config_file) as f:
+                port = YAML(typ="safe").load(f)["locations"]["l1"]["port"]
+            process = subprocess.Popen(
+                [sys.executable, "l1.py"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                cwd=workdir,
+            )
+            try:
+                # Impersonate ld, and close the channel in the middle of a frame header
+                for _ in range(50):
+                    try:
+                        sock = socket.create_connection(("127.0.0.1", port))
+                        break
+                    except ConnectionRefusedError:
+                        time.sleep(0.1)
+                else:
+                    raise AssertionError("Location l1 is not listening")
+                with sock:
+                    sock.sendall(b"\x00\x02ld\x00\x00")
+                    reply = b""
+                    while len(reply) < 6:
+                        reply += sock.recv(6 - len(reply))
+                    assert reply == b"\x00\x00\x00\x02[]"
+                    sock.sendall(b"\x00\x02")
+                _, stderr = process.communicate(timeout=15)
+            except BaseException:
+                process.kill()
+                raise
+            # The location fails instead of waiting for the data forever
+            assert process.returncode != 0
+            assert "Channel from location ld closed in the middle of a frame" in stderr
+
+
+def test_example5_resources() -> None:
+    for target in ("default", "asyncio"):
+        _compile_and_run(
+            example_name="example5",
+            trace_filename="example5.swirl",
+            expected_generated_files=["run.sh", "l1.py"],
+            extra_args=["--target", target],
+            expected_stdout="Workflow execution terminated",
+            expected_stderr_patterns=[
+                r"l1\.py .* Step (Light-s[12]|Heavy-s3) waits for resources",
+            ]
+            + [
+                rf"Step {name}-s{i} has not an output port\. Result: 'Hello'"
+                for i, name in ((1, "Light"), (2, "Light"), (3, "Heavy"))
+            ],
+        )
+
+
+def test_example5_oversize_requirements(caplog) -> None:
+    example_dir = _EXAMPLES_PATH / "example5"
+    for target in ("default", "asyncio"):
+        with tempfile.TemporaryDirectory() as workdir:
+            yaml = YAML(typ="safe")
+            with open(example_dir / "config.yml") as f:
+                config = yaml.load(f)
+            config["steps"]["s3"]["requirements"]["cores"] = 1 << 20
+            config_file = os.path.join(workdir, "config.yml")
+            with open(config_file, "w") as f:
+                yaml.dump(config, f)
+            # Requirements exceeding the declared resources are rejected by the compiler
+            args = ["compile", str(example_dir / "example5.swirl"), config_file]
+            assert main(args + ["--outdir", workdir]) == 1
+            assert "Step s3 requires 1048576 cores" in caplog.text
+            # Otherwise, the location fails instead of hanging
+            del config["locations"]["l1"]["resources"]["cores"]
+            with sockets_contextmanager() as reserved_sockets:
+                os.remove(config_file)
+                with open(os.path.join(workdir, "src.yml"), "w") as f:
+                    yaml.dump(config, f)
+                _update_config_metadata(
+                    os.path.join(workdir, "src.yml"), config_file, reserved_sockets
+                )
+                _compile(
+                    str(example_dir / "example5.swirl"),
+                    config_file,
+                    workdir,
+                    ["--target", target],
+                )
+            process = subprocess.run(
+                ["./run.sh"], capture_output=True, text=True, cwd=workdir, timeout=15
+            )
+            assert process.returncode != 0
+            assert "Workflow execution failed" in process.stdout
+            assert "Step Heavy-s3 requires 1048576 cores" in process.stderr
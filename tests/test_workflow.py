@@ -0,0 +1,150 @@
+from swirlc.core.entity import DistributedWorkflow, Location, Port, Step
+from swirlc.core.utils import flatten_list
+
+
+def _build_workflow() -> DistributedWorkflow:
+    """
+    Workflow model          Deployment model
+          s1                    - s1 mapped on l1
+          |                     - s2 mapped on l2
+         p1                     - s3 mapped on l2 and l3
+        /  \
+       s2  s3
+       |   |
+       p2  p3
+    """
+    workflow = DistributedWorkflow()
+    for name in ("s1", "s2", "s3"):
+        workflow.add_step(Step(name, name))
+    p1 = Port("p1", "p1", {"d1"})
+    workflow.add_output_port(workflow.steps["s1"], p1)
+    workflow.add_input_port(workflow.steps["s3"], p1)
+    workflow.add_input_port(workflow.steps["s2"], p1)
+    workflow.add_output_port(workflow.steps["s3"], Port("p3", "p3", {"d3"}))
+    workflow.add_output_port(workflow.steps["s2"], Port("p2", "p2", {"d2"}))
+    for name in ("l1", "l2", "l3"):
+        workflow.add_location(Location(name, name, {}))
+    workflow.map(workflow.steps["s1"], workflow.locations["l1"])
+    workflow.map(workflow.steps["s2"], workflow.locations["l2"])
+    workflow.map(workflow.steps["s3"], workflow.locations["l3"])
+    workflow.map(workflow.steps["s3"], workflow.locations["l2"])
+    return workflow
+
+
+def test_dependencies():
+    """Test the dependency queries of the `Workflow` class."""
+    workflow = _build_workflow()
+    names = lambda elems: [e.name for e in elems]  # noqa: E731
+    assert names(workflow.get_output_steps(workflow.ports["p1"])) == ["s2", "s3"]
+    assert names(workflow.get_input_steps(workflow.ports["p1"])) == ["s1"]
+    assert names(workflow.get_input_ports(workflow.steps["s3"])) == ["p1"]
+    assert names(workflow.get_output_ports(workflow.steps["s3"])) == ["p3"]
+    assert names(workflow.get_input_ports(workflow.steps["s1"])) == []
+    assert names(workflow.get_output_steps(workflow.ports["p3"])) == []
+    assert workflow.dependencies == {
+        ("s1", "p1"),
+        ("p1", "s2"),
+        ("p1", "s3"),
+        ("s2", "p2"),
+        ("s3", "p3"),
+    }
+
+
+def test_mapping():
+    """Test the mapping queries of the `DistributedWorkflow` class."""
+    workflow = _build_workflow()
+    names = lambda elems: [e.name for e in elems]  # noqa: E731
+    assert names(workflow.get_step_locations(workflow.steps["s3"])) == ["l2", "l3"]
+    assert names(workflow.get_location_steps(workflow.locations["l2"])) == ["s2", "s3"]
+    assert names(workflow.get_input_locations(workflow.ports["p1"])) == ["l1"]
+    assert names(workflow.get_output_locations(workflow.ports["p1"])) == [
+        "l2",
+        "l2",
+        "l3",
+    ]
+    # Cached views must be invalidated on mutation
+    workflow.add_location(Location("l0", "l0", {}))
+    workflow.map(workflow.steps["s3"], workflow.locations["l0"])
+    assert names(workflow.get_locations()) == ["l0", "l1", "l2", "l3"]
+    assert names(workflow.get_step_locations(workflow.steps["s3"])) == [
+        "l0",
+        "l2",
+        "l3",
+    ]
+    assert names(workflow.get_location_steps(workflow.locations["l0"])) == ["s3"]
+    assert names(workflow.get_output_locations(workflow.ports["p1"])) == [
+        "l0",
+        "l2",
+        "l2",
+        "l3",
+    ]
+
+
+def test_freeze():
+    """Test that a `FrozenWorkflow` answers queries as the original workflow."""
+    workflow = _build_workflow()
+    frozen = workflow.freeze()
+    names = lambda elems: [e.name for e in elems]  # noqa: E731
+    assert names(frozen.get_locations()) == names(workflow.get_locations())
+    for step in workflow.steps.values():
+        for query in (
+            "get_input_ports",
+            "get_output_ports",
+            "get_step_locations",
+            "get_input_data",
+            "get_output_data",
+        ):
+            expected = getattr(workflow, query)(step)
+            actual = getattr(frozen, query)(step)
+            if query.endswith("data"):
+                assert list(actual) == list(expected)
+            else:
+                assert names(actual) == names(expected)
+    for port in workflow.ports.values():
+        for query in (
+            "get_input_steps",
+            "get_output_steps",
+            "get_input_locations",
+            "get_output_locations",
+        ):
+            assert names(getattr(frozen, query)(port)) == names(
+                getattr(workflow, query)(port)
+            )
+    for location in workflow.locations.values():
+        assert names(frozen.get_location_steps(location)) == names(
+            workflow.get_location_steps(location)
+        )
+    # Rows are views of the CSR arrays, which resolve entities on access
+    row = frozen.get_output_locations(workflow.ports["p1"])
+    assert len(row) == 3
+    assert [loc.name for loc in row[1:]] == ["l2", "l3"]
+    assert row[-1] is workflow.locations["l3"]
+    # The snapshot is not affected by later changes to the original workflow
+    workflow.map(workflow.steps["s1"], workflow.locations["l3"])
+    assert names(frozen.get_step_locations(workflow.steps["s1"])) == ["l1"]
+
+
+def test_data():
+    """Test that the cached data pairs are invalidated when the workflow changes."""
+    workflow = _build_workflow()
+    assert workflow.get_input_data(workflow.steps["s2"]) == ["(p1,d1)"]
+    assert workflow.get_output_data(workflow.steps["s1"]) == ["(p1,d1)"]
+    workflow.add_port_data(workflow.ports["p1"], "d0")
+    assert workflow.get_input_data(workflow.steps["s2"]) == ["(p1,d0)", "(p1,d1)"]
+    assert workflow.get_output_data(workflow.steps["s1"]) == ["(p1,d0)", "(p1,d1)"]
+    workflow.add_input_port(workflow.steps["s2"], Port("p0", "p0", {"d4"}))
+    assert workflow.get_input_data(workflow.steps["s2"]) == [
+        "(p0,d4)",
+        "(p1,d0)",
+        "(p1,d1)",
+    ]
+
+
+def test_flatten_list():
+    """Test the `flatten_list` utility function."""
+    assert flatten_list([]) == []
+    assert flatten_list([1, [2, [3, [4]], []], 5, [[6]]]) == [1, 2, 3, 4, 5, 6]
+    nested = [0]
+    for i in range(1, 10000):
+        nested = [nested, i]
+    assert flatten_list(nested) == list(range(10000))